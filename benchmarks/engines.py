@@ -0,0 +1,184 @@
+from ngt.operations import transforms, polars_transforms
+from ngt.assets.security_master import INSTRUMENT_COLUMN_MAPPINGS
+from .normalization import timeit
+from . import synthetic
+import pandas as pd
+import subprocess
+import tempfile
+import argparse
+import json
+import sys
+import os
+
+def read_inputs(portfolios_path: str, trades_path: str) -> dict[str, tuple]:
+    """
+    Read the files like the file assets (categories, de-duplicated trades) and create the input of every transformation
+
+    Parameters:
+        - `portfolios_path` - a portfolio file
+        - `trades_path` - a trades file
+
+    Output:
+        - the transformation name to its arguments
+    """
+    portfolios = transforms.categorize(pd.read_csv(portfolios_path))
+    trades = transforms.categorize(pd.read_csv(trades_path).dropna(subset="nt_trade_date").drop_duplicates().reset_index(drop=True))
+
+    # The later transformations get the output of the reference engine
+    columns = portfolios.rename(columns=lambda column: column[3:] if column.startswith("nt_") else column)
+    instruments = transforms.portfolio_instruments(portfolios, INSTRUMENT_COLUMN_MAPPINGS)
+    valid, _, _ = transforms.trade_filter(trades)
+
+    return {
+        "portfolio_ids": (portfolios,),
+        "fill_by_figi": (columns,),
+        "portfolio_instruments": (portfolios, INSTRUMENT_COLUMN_MAPPINGS),
+        "unique_figis": (instruments,),
+        "trade_filter": (trades,),
+        "trade_ids": (valid,)
+    }
+
+
+
+def normalize(value) -> list:
+    """
+    Make the outputs of both engines comparable - `None` / `NaN` become `None` and the dtypes are ignored
+    """
+    values = value if isinstance(value, tuple) else (value,)
+    return [
+        frame.reset_index(drop=True).astype(object).where(frame.reset_index(drop=True).notna(), None) if isinstance(frame, pd.DataFrame) else frame
+        for frame in values
+    ]
+
+
+
+def parity(inputs: dict[str, tuple]) -> pd.DataFrame:
+    """
+    Check that the polars engine returns the same rows (values and order) as the pandas engine
+
+    Parameters:
+        - `inputs` - see `read_inputs`
+
+    Output:
+        - one row per transformation (`same` is `False` with the first difference in `difference`)
+    """
+    results = []
+    for name, args in inputs.items():
+        expected = normalize(getattr(transforms, name)(*args))
+        actual = normalize(getattr(polars_transforms, name)(*args))
+
+        difference = None
+        try:
+            for expected_value, actual_value in zip(expected, actual):
+                if isinstance(expected_value, pd.DataFrame):
+                    pd.testing.assert_frame_equal(expected_value, actual_value, check_dtype=False)
+                else:
+                    assert expected_value == actual_value, f"{expected_value} != {actual_value}"
+        except AssertionError as error:
+            difference = str(error).strip().splitlines()[0]
+
+        results.append({"transformation": name, "rows": len(args[0]), "same": difference is None, "difference": difference})
+
+    return pd.DataFrame(results)
+
+
+
+def time_engine(engine: str, inputs: dict[str, tuple], repeat: int = 3) -> dict[str, float]:
+    """
+    Best wall time (seconds) of every transformation of an engine
+    """
+    module = transforms if engine == "pandas" else polars_transforms
+    return {name: timeit(getattr(module, name), *args, repeat=repeat) for name, args in inputs.items()}
+
+
+
+def time_polars(threads: int, portfolios_path: str, trades_path: str, repeat: int = 3) -> dict[str, float]:
+    """
+    Time the polars engine in a new process - Polars reads `POLARS_MAX_THREADS` when it is imported
+    """
+    command = [sys.executable, "-m", "benchmarks.engines", "time", portfolios_path, trades_path, "--repeat", str(repeat)]
+    environment = {**os.environ, "POLARS_MAX_THREADS": str(threads)}
+    output = subprocess.run(command, env=environment, capture_output=True, text=True, check=True).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+
+def scaling(rows: int, threads: list[int], folder: str, repeat: int = 3) -> pd.DataFrame:
+    """
+    Time both engines on synthetic files - pandas once, polars once per number of threads
+
+    Parameters:
+        - `rows` - the number of rows of each file
+        - `threads` - the numbers of polars threads
+        - `folder` - where the files are written
+        - `repeat` - the number of timed calls (the best one is kept)
+
+    Output:
+        - one row per transformation / engine / threads with the wall time and the speedup over pandas
+    """
+    portfolios_path = synthetic.write_csv(synthetic.generate_portfolios, os.path.join(folder, f"portfolios_{rows}.csv"), rows)
+    trades_path = synthetic.write_csv(synthetic.generate_trades, os.path.join(folder, f"trades_{rows}.csv"), rows)
+
+    results = [
+        {"transformation": name, "engine": "pandas", "threads": 1, "wall_s": wall_s}
+        for name, wall_s in time_engine("pandas", read_inputs(portfolios_path, trades_path), repeat).items()
+    ]
+    for count in threads:
+        results += [
+            {"transformation": name, "engine": "polars", "threads": count, "wall_s": wall_s}
+            for name, wall_s in time_polars(count, portfolios_path, trades_path, repeat).items()
+        ]
+
+    results = pd.DataFrame(results).assign(rows=rows)
+    pandas_s = results.loc[results["engine"] == "pandas"].set_index("transformation")["wall_s"]
+    results["speedup"] = (results["transformation"].map(pandas_s) / results["wall_s"]).round(2)
+
+    return results
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check and time the polars engine of the transformations against pandas")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    check = commands.add_parser("parity", help="Compare the outputs of both engines on the sample files and synthetic files")
+    check.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000])
+
+    scale = commands.add_parser("scaling", help="Time both engines on large synthetic files")
+    scale.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    scale.add_argument("--threads", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    scale.add_argument("--repeat", type=int, default=3)
+
+    # Used by `time_polars`
+    time_files = commands.add_parser("time")
+    time_files.add_argument("portfolios_path")
+    time_files.add_argument("trades_path")
+    time_files.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.command == "time":
+        print(json.dumps(time_engine("polars", read_inputs(args.portfolios_path, args.trades_path), args.repeat)))
+        raise SystemExit()
+
+    with tempfile.TemporaryDirectory() as folder:
+
+        if args.command == "parity":
+            results = [parity(read_inputs(synthetic.PORTFOLIOS_PATH, synthetic.TRADES_PATH))]
+            for rows in args.rows:
+                results.append(parity(read_inputs(
+                    synthetic.write_csv(synthetic.generate_portfolios, os.path.join(folder, f"portfolios_{rows}.csv"), rows),
+                    synthetic.write_csv(synthetic.generate_trades, os.path.join(folder, f"trades_{rows}.csv"), rows)
+                )))
+
+            results = pd.concat(results, ignore_index=True)
+            print(results.to_markdown(index=False))
+
+            if not results["same"].all():
+                raise SystemExit(f"{int((~results['same']).sum())} transformation(s) differ between the engines")
+
+        else:
+            results = pd.concat([scaling(rows, args.threads, folder, args.repeat) for rows in args.rows], ignore_index=True)
+            print(results.to_markdown(index=False))
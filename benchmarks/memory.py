@@ -0,0 +1,152 @@
+from dagster import materialize, DagsterInstance, DagsterEventType
+from ngt import constants
+from ngt.operations.instrumentation import MEMORY_TAG
+from ngt.operations.metadata import METADATA_TAG
+from contextlib import nullcontext
+from unittest import mock
+from .pipeline import get_assets, get_run_config, get_resources, get_partition_key, reset_databases
+from . import synthetic
+import pandas as pd
+import tempfile
+import argparse
+import json
+import os
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_baseline.json")
+
+# Differences below this are noise (interpreter / Dagster allocations)
+MIN_REGRESSION_MB = 1.0
+
+def traced_peaks(instance: DagsterInstance, run_id: str) -> list[dict]:
+    """
+    Get the tracemalloc peak of every asset of a run from its materialization metadata (see `ngt.operations.instrumentation`)
+    """
+    peaks = []
+    for entry in instance.all_logs(run_id, of_type=DagsterEventType.ASSET_MATERIALIZATION):
+        metadata = entry.asset_materialization.metadata
+        if "peak_traced_mb" not in metadata:
+            continue
+
+        peaks.append({
+            "asset": entry.asset_materialization.asset_key.to_user_string(),
+            "peak_traced_mb": metadata["peak_traced_mb"].value,
+            "retained_traced_mb": metadata["retained_traced_mb"].value
+        })
+
+    return peaks
+
+
+
+def run(mode: str, rows: int, mongo_url: str, folder: str, days: int = 1, start: str = "2024-02-01", fund: str = constants.FUND_CODES[0], io_manager: str = "ipc", reset: bool = False) -> list[dict]:
+    """
+    Run an upload job on a synthetic file with the memory profile of every asset (`ngt/memory` run tag)
+
+    Parameters:
+        - `mode` - either `portfolios` or `trades`
+        - `rows` - the number of rows of the synthetic file
+        - `mongo_url` - a local mongod (the upload jobs write to the `pipeline.DATABASE_PREFIX` databases)
+        - `folder` - the working folder (synthetic file, HITL files, step outputs)
+        - `days` - the number of dates in the synthetic file
+        - `start` - the first date of the synthetic file (the benchmarked partition)
+        - `fund` - the fund of the benchmarked partition
+        - `io_manager` - how the step outputs are stored (see `pipeline.get_resources`)
+        - `reset` - drop the benchmark's databases first (see `pipeline.reset_databases`)
+
+    Output:
+        - the peak / retained traced memory of every asset
+    """
+    generate = synthetic.generate_portfolios if mode == "portfolios" else synthetic.generate_trades
+    file_path = synthetic.write_csv(generate, os.path.join(folder, f"{mode}_{rows}.csv"), rows, days=days, start=start)
+
+    if reset:
+        reset_databases(mongo_url)
+
+    # The metadata is off so that the previews do not count
+    instance = DagsterInstance.ephemeral()
+    assets, keys = get_assets(mode)
+    result = materialize(
+        assets, selection=keys, partition_key=get_partition_key(mode, start, fund), run_config=get_run_config(mode, file_path, folder),
+        resources=get_resources(mongo_url, folder, io_manager), instance=instance, tags={MEMORY_TAG: "*", METADATA_TAG: "off"}
+    )
+
+    return [{"mode": mode, "rows": rows, **peak} for peak in traced_peaks(instance, result.run_id)]
+
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compare the peaks with a baseline
+
+    Parameters:
+        - `results` - the current peaks
+        - `baseline` - the baseline peaks
+        - `tolerance` - the allowed relative growth
+
+    Output:
+        - the comparison of every asset that is part of both (`regression` is `True` if its peak grew more than the
+          tolerance and more than `MIN_REGRESSION_MB`)
+    """
+    key = ["mode", "rows", "asset"]
+    comparison = pd.DataFrame(results).merge(pd.DataFrame(baseline), "inner", key, suffixes=("", "_baseline"))
+
+    growth = comparison["peak_traced_mb"] - comparison["peak_traced_mb_baseline"]
+    comparison["peak_ratio"] = (comparison["peak_traced_mb"] / comparison["peak_traced_mb_baseline"]).round(2)
+    comparison["regression"] = (comparison["peak_traced_mb"] > comparison["peak_traced_mb_baseline"] * (1 + tolerance)) & (growth > MIN_REGRESSION_MB)
+
+    return comparison
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Profile the memory (tracemalloc peak per asset) of the upload jobs on synthetic data")
+    parser.add_argument("mode", choices=["portfolios", "trades"])
+    parser.add_argument("--rows", type=int, nargs="+", default=[5_000], help="The baseline was recorded with --mongomock on 5,000 rows")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--mongo-url", help="The benchmark's mongod - never taken from MONGO_URL (required unless --mongomock)")
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory mongomock database instead of a mongod")
+    parser.add_argument("--io-manager", choices=["pickle", "ipc", "parquet", "memory"], default="ipc")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--reset", action="store_true", help="Drop the benchmark's databases before every run (required for more than one run)")
+    args = parser.parse_args()
+
+    if args.mongo_url is None and not args.mongomock:
+        parser.error("--mongo-url is required (or --mongomock)")
+
+    if len(args.rows) > 1 and not args.reset:
+        parser.error("--reset is required to compare several runs (the later runs would skip the already uploaded files)")
+
+    patch = nullcontext()
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        patch = mock.patch("pymongo.MongoClient", lambda *_, **__: client)
+        args.mongo_url = args.mongo_url or "mongodb://mongomock"
+
+    results = []
+    with patch, tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            results += run(args.mode, rows, args.mongo_url, folder, days=args.days, io_manager=args.io_manager, reset=args.reset)
+
+    print(pd.DataFrame(results).sort_values(["rows", "peak_traced_mb"], ascending=[True, False]).to_markdown(index=False))
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file).get(args.mode, []), args.tolerance)
+        print(comparison.to_markdown(index=False))
+
+        if comparison["regression"].any():
+            raise SystemExit(f"{int(comparison['regression'].sum())} memory regression(s) against {args.baseline}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+
+        baseline[args.mode] = results
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=4)
+        print(f"Saved the baseline - {args.baseline}")
@@ -0,0 +1,98 @@
+from ngt import constants
+from ngt.operations.normalization import prefix_match
+import numpy as np
+import pandas as pd
+import time
+
+SECURITY_NAMES = [
+    "INTEREST RATE SWAP", "PUT", "CALL", "CREDIT DEFAULT SWAP",
+    "TESLA INC", "CHURCH & DWIGHT CO INC", "UK TSY GILT", "US TREASURY N/B"
+]
+
+def make_names(rows: int, cardinality: int, seed: int = 42) -> pd.Series:
+    """
+    Create a security name column
+
+    Parameters:
+        - `rows` - the number of rows
+        - `cardinality` - the number of distinct names
+        - `seed` - the random seed
+
+    Output:
+        - the security names
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"{SECURITY_NAMES[i % len(SECURITY_NAMES)]} {i}" for i in range(cardinality)], dtype=object)
+
+    return pd.Series(names[rng.integers(0, cardinality, rows)])
+
+
+
+def per_rule(names: pd.Series) -> pd.Series:
+    """
+    The previous implementation - one full `.str` pass per rule
+    """
+    yellow_key_codes = pd.Series(np.nan, index=names.index, dtype=object)
+    for security_name, yellow_code in constants.MISSING_YELLOW_CODES.items():
+        query = names.fillna("").str.upper().str.startswith(security_name)
+        yellow_key_codes.loc[query] = yellow_code
+
+    return yellow_key_codes
+
+
+
+def per_unique(names: pd.Series) -> pd.Series:
+    """
+    The shared normalization layer - one trie match per distinct value
+    """
+    return prefix_match(names, constants.MISSING_YELLOW_CODES.keys()).map(constants.MISSING_YELLOW_CODES)
+
+
+
+def timeit(func, *args, repeat: int = 3) -> float:
+    """
+    Best wall time (seconds) of `repeat` calls
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+
+def run(rows: int = 1_000_000) -> pd.DataFrame:
+    """
+    Compare both implementations on low and high cardinality inputs
+
+    Parameters:
+        - `rows` - the number of rows per input
+
+    Output:
+        - the timings for every input
+    """
+    results = []
+    for cardinality in [100, 10_000, rows]:
+
+        names = make_names(rows, cardinality)
+        pd.testing.assert_series_equal(per_rule(names), per_unique(names), check_names=False)
+
+        results.append({
+            "rows": rows,
+            "cardinality": cardinality,
+            "per_rule_s": timeit(per_rule, names),
+            "per_unique_s": timeit(per_unique, names),
+        })
+
+    results = pd.DataFrame(results)
+    results["speedup"] = results["per_rule_s"] / results["per_unique_s"]
+
+    return results
+
+
+
+if __name__ == "__main__":
+
+    print(run().to_markdown(index=False))
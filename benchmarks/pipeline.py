@@ -0,0 +1,501 @@
+from dagster import materialize, execute_job, build_reconstructable_job, define_asset_job, in_process_executor, multiprocess_executor, Definitions, AssetsDefinition, DagsterInstance, DagsterEventType, FilesystemIOManager, MultiPartitionKey
+from ngt import defs, jobs, constants, resources, partitions
+from ngt.operations.metadata import METADATA_TAG, POLICIES, DEFAULT_POLICY
+from collections import Counter
+from contextlib import nullcontext
+from typing import Optional
+from unittest import mock
+from . import synthetic
+import pymongo.monitoring
+import pandas as pd
+import threading
+import tempfile
+import argparse
+import bisect
+import json
+import time
+import os
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# The databases the upload jobs write to (see `resources.Mongo`)
+DATABASES = ["raw", "processed", "faulty", "api", "outbox", "monitoring"]
+
+# The benchmarks only ever use (and drop) their own copies of the databases (see `resources.Mongo.database_prefix`)
+DATABASE_PREFIX = "benchmark_"
+
+class CommandCounter(pymongo.monitoring.CommandListener):
+
+    def __init__(self):
+        """
+        Record every command sent to MongoDB (time and command name) so that the commands can be attributed to the asset steps
+        """
+        self.commands: list[tuple[float, str]] = []
+        self.__lock = threading.Lock()
+
+    def started(self, event):
+        with self.__lock:
+            self.commands.append((time.time(), event.command_name))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def between(self, start: float, end: float) -> Counter:
+        """
+        Count the commands sent between `start` and `end`
+        """
+        with self.__lock:
+            times = [timestamp for timestamp, _ in self.commands]
+            return Counter(name for _, name in self.commands[bisect.bisect_left(times, start):bisect.bisect_right(times, end)])
+
+
+
+class MemorySampler(threading.Thread):
+
+    def __init__(self, interval: float = 0.01):
+        """
+        Sample the resident memory of the process in the background (Linux `/proc`, else `psutil` if installed)
+
+        Parameters:
+            - `interval` - the time between two samples (seconds)
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples: list[tuple[float, int]] = []
+        self.__stop = threading.Event()
+
+    @staticmethod
+    def rss() -> Optional[int]:
+        """
+        The current resident memory (bytes)
+        """
+        if os.path.exists("/proc/self/statm"):
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+        try:
+            import psutil
+        except ImportError: # Optional - no memory figures
+            return None
+
+        return psutil.Process().memory_info().rss
+
+    def run(self):
+        while not self.__stop.is_set():
+            rss = self.rss()
+            if rss is None:
+                return
+            self.samples.append((time.time(), rss))
+            self.__stop.wait(self.interval)
+
+    def stop(self):
+        self.__stop.set()
+        self.join()
+
+    def peak(self, start: float, end: float) -> Optional[float]:
+        """
+        The peak resident memory (MB) between `start` and `end`
+        """
+        values = [rss for timestamp, rss in self.samples if start <= timestamp <= end]
+        return round(max(values) / 1024 ** 2, 1) if values else None
+
+
+
+def get_run_config(mode: str, file_path: str, folder: str) -> dict:
+    """
+    Get the run config of an upload job that reads a synthetic file
+    """
+    ops = {
+        f"{mode}_file_data": {"config": {"file_path": file_path}},
+        f"inconsistent_{mode}_email": {"config": {"to": ["benchmark@localhost"], "file_path": os.path.join(folder, f"Faulty {mode.title()}.csv")}}
+    }
+    if mode == "portfolios":
+        ops["country_codes"] = {"config": {"file_path": constants.COUNTRY_NAMES_PATH}}
+
+    return {"ops": ops}
+
+
+
+def get_resources(mongo_url: str, folder: str, io_manager: str = "ipc") -> dict:
+    """
+    Get the resources of a benchmark run - the step outputs are kept on disk so that every asset can be re-run on its own
+
+    Parameters:
+        - `mongo_url` - the local mongod
+        - `folder` - the working folder
+        - `io_manager` - `pickle` (Dagster's filesystem I/O manager), `ipc` or `parquet` (`resources.ArrowIOManager`)
+          or `memory` (the fused mode of `resources.ArrowIOManager`)
+    """
+    storage = os.path.join(folder, "storage", io_manager)
+    if io_manager == "pickle":
+        io_manager = FilesystemIOManager(base_dir=storage)
+    elif io_manager == "memory":
+        io_manager = resources.ArrowIOManager(memory=True)
+    else:
+        io_manager = resources.ArrowIOManager(base_dir=storage, format=io_manager)
+
+    return {
+        "mongo": resources.Mongo(url=mongo_url, database_prefix=DATABASE_PREFIX),
+        "open_figi": resources.OpenFigi(api_key="benchmark"),
+        "mail": resources.Email(sender="benchmark@localhost", host="localhost", port="25", username="", password="", use_ssl=False),
+        "duckdb": resources.DuckDB(snapshot_dir=os.path.join(folder, "security_master"), temp_directory=os.path.join(folder, "duckdb_tmp")),
+        "io_manager": io_manager
+    }
+
+
+
+def get_assets(mode: str) -> tuple[list[AssetsDefinition], list]:
+    """
+    Get all of the assets and the keys selected by the mode's upload job - the assets of `defs` as they were
+    defined, without the resources that `Definitions` binds to them (the benchmark passes its own)
+    """
+    assets = list(defs.assets)
+
+    job = jobs.portfolio_upload_job if mode == "portfolios" else jobs.trades_upload_job
+    keys = job.selection.resolve(assets)
+
+    return assets, sorted(keys, key=lambda key: key.to_user_string())
+
+
+
+def get_partition_key(mode: str, start: str, fund: str) -> MultiPartitionKey:
+    """
+    Get the partition of the synthetic file's first date - portfolios are reported the business day after their date
+    """
+    date = pd.Timestamp(start) - pd.offsets.BDay() if mode == "portfolios" else pd.Timestamp(start)
+    return MultiPartitionKey({"date": date.strftime("%Y-%m-%d"), "fund": fund})
+
+
+
+def get_job(mode: str, mongo_url: str, folder: str, io_manager: str, executor: str):
+    """
+    Build the benchmarked upload job - reconstructed in every step process by the multiprocess executor
+
+    Parameters:
+        - `mode` - either `portfolios` or `trades`
+        - `mongo_url` - the local mongod
+        - `folder` - the working folder
+        - `io_manager` - see `get_resources`
+        - `executor` - `multiprocess` (one process per step like the deployed jobs) or `in_process`
+    """
+    assets, keys = get_assets(mode)
+    job = define_asset_job(
+        f"{mode}_benchmark_job", selection=keys, partitions_def=partitions.date_fund_partitions,
+        executor_def=multiprocess_executor if executor == "multiprocess" else in_process_executor
+    )
+
+    return Definitions(assets=assets, jobs=[job], resources=get_resources(mongo_url, folder, io_manager)).get_job_def(job.name)
+
+
+
+def materialized_mongo_ops(instance: DagsterInstance, run_id: str) -> dict[str, int]:
+    """
+    Get the Mongo round trips of every step from its materialization metadata (see `ngt.operations.instrumentation`) -
+    the steps of a multiprocess run are not seen by the `CommandCounter` of this process
+    """
+    round_trips = {}
+    for entry in instance.all_logs(run_id, of_type=DagsterEventType.ASSET_MATERIALIZATION):
+        value = entry.asset_materialization.metadata.get("mongo_round_trips")
+        if value is not None:
+            round_trips[entry.step_key] = round_trips.get(entry.step_key, 0) + value.value
+
+    return round_trips
+
+
+
+def step_intervals(instance: DagsterInstance, run_id: str) -> dict[str, tuple[float, float]]:
+    """
+    Get the start / end time of every step of a run from the event log
+    """
+    intervals = {}
+    for entry in instance.all_logs(run_id):
+
+        if entry.step_key is None or entry.dagster_event is None:
+            continue
+
+        event_type = entry.dagster_event.event_type
+        if event_type == DagsterEventType.STEP_START:
+            intervals[entry.step_key] = (entry.timestamp, entry.timestamp)
+        elif event_type in (DagsterEventType.STEP_SUCCESS, DagsterEventType.STEP_FAILURE) and entry.step_key in intervals:
+            intervals[entry.step_key] = (intervals[entry.step_key][0], entry.timestamp)
+
+    return intervals
+
+
+
+def reset_databases(mongo_url: str):
+    """
+    Drop the benchmark's databases (see `DATABASE_PREFIX`) so that every benchmark run uploads the same rows from scratch
+    (without a reset, a second run only finds files that have already been uploaded). The pipeline's databases are never touched.
+    """
+    client = pymongo.MongoClient(mongo_url)
+    for database in DATABASES:
+        client.drop_database(f"{DATABASE_PREFIX}{database}")
+
+
+
+def storage_size(folder: str) -> float:
+    """
+    Get the disk use of the step outputs (MB)
+    """
+    size = 0
+    for root, _, files in os.walk(folder):
+        size += sum(os.path.getsize(os.path.join(root, file)) for file in files)
+
+    return round(size / 1024 ** 2, 2)
+
+
+
+def measure(name: str, func, counter: CommandCounter, sampler: MemorySampler) -> tuple[object, dict]:
+    """
+    Run `func` and measure its wall time, peak memory and Mongo commands
+    """
+    start = time.time()
+    result = func()
+    end = time.time()
+
+    commands = counter.between(start, end)
+    return result, {
+        "name": name,
+        "wall_s": round(end - start, 3),
+        "peak_rss_mb": sampler.peak(start, end),
+        "mongo_ops": sum(commands.values()),
+        "mongo_commands": dict(commands)
+    }
+
+
+
+def run(mode: str, rows: int, mongo_url: str, folder: str, days: int = 1, start: str = "2024-02-01", fund: str = constants.FUND_CODES[0], standalone: bool = True, metadata: str = DEFAULT_POLICY, io_manager: str = "ipc", executor: str = "in_process", reset: bool = False) -> list[dict]:
+    """
+    Benchmark an upload job on a synthetic file - first the full job (with a per asset breakdown) and then every asset on its own
+
+    Parameters:
+        - `mode` - either `portfolios` or `trades`
+        - `rows` - the number of rows of the synthetic file
+        - `mongo_url` - a local mongod (the upload jobs write to the `DATABASE_PREFIX` databases)
+        - `folder` - the working folder (synthetic file, HITL files, step outputs)
+        - `days` - the number of dates in the synthetic file
+        - `start` - the first date of the synthetic file (the benchmarked partition)
+        - `fund` - the fund of the benchmarked partition
+        - `standalone` - also run every asset on its own (its inputs are read from the full job's outputs)
+        - `metadata` - the metadata policy of the runs (see `ngt.operations.metadata`)
+        - `io_manager` - how the step outputs are stored (see `get_resources`) - `memory` + `in_process` is the fused mode
+          (see `jobs.portfolio_fused_upload_job`)
+        - `executor` - how the full job is run (see `get_job`) - the standalone assets are always run in process
+        - `reset` - drop the benchmark's databases first (see `reset_databases`)
+
+    Output:
+        - one result per job / asset
+    """
+    generate = synthetic.generate_portfolios if mode == "portfolios" else synthetic.generate_trades
+    file_path = synthetic.write_csv(generate, os.path.join(folder, f"{mode}_{rows}.csv"), rows, days=days, start=start)
+
+    partition_key = get_partition_key(mode, start, fund)
+
+    if reset:
+        reset_databases(mongo_url)
+
+    counter = CommandCounter()
+    pymongo.monitoring.register(counter)
+    sampler = MemorySampler()
+    sampler.start()
+
+    # The multiprocess executor needs an instance on disk
+    instance = DagsterInstance.local_temp(tempdir=os.path.join(folder, "dagster")) if executor == "multiprocess" else DagsterInstance.ephemeral()
+    assets, keys = get_assets(mode)
+    partitioned_keys = {key for asset in assets if asset.partitions_def is not None for key in asset.keys}
+    run_config = get_run_config(mode, file_path, folder)
+    tags = {METADATA_TAG: metadata}
+
+    def materialize_keys(selection):
+        # Only the config of the selected assets is allowed
+        names = {key.path[-1] for key in selection}
+        config = {"ops": {op: op_config for op, op_config in run_config["ops"].items() if op in names}}
+
+        # The country codes are not partitioned
+        partitioned = any(key in partitioned_keys for key in selection)
+
+        return materialize(
+            assets, selection=selection, partition_key=partition_key if partitioned else None, run_config=config,
+            resources=get_resources(mongo_url, folder, io_manager), instance=instance, tags=tags
+        )
+
+    def execute():
+        job = build_reconstructable_job("benchmarks.pipeline", "get_job", reconstructable_args=(mode, mongo_url, folder, io_manager, executor))
+        partition_tags = {
+            "dagster/partition": str(partition_key),
+            **{f"dagster/partition/{dimension}": key for dimension, key in partition_key.keys_by_dimension.items()}
+        }
+        return execute_job(job, instance, run_config=run_config, tags={**tags, **partition_tags}, raise_on_error=True)
+
+    options = {"metadata": metadata, "io_manager": io_manager, "executor": executor}
+
+    results = []
+    try:
+        result, job_result = measure(f"{mode}_upload_job", execute if executor == "multiprocess" else lambda: materialize_keys(keys), counter, sampler)
+        job_result.update({"rows": rows, "kind": "job", **options, "storage_mb": storage_size(os.path.join(folder, "storage", io_manager))})
+        results.append(job_result)
+
+        # The job's breakdown per asset (the memory / Mongo figures of a multiprocess run come from the step processes' metadata)
+        round_trips = materialized_mongo_ops(instance, result.run_id) if executor == "multiprocess" else {}
+        for step_key, (step_start, step_end) in step_intervals(instance, result.run_id).items():
+            commands = counter.between(step_start, step_end)
+            results.append({
+                "name": step_key,
+                "kind": "job_step",
+                "rows": rows,
+                **options,
+                "wall_s": round(step_end - step_start, 3),
+                "peak_rss_mb": sampler.peak(step_start, step_end) if executor == "in_process" else None,
+                "mongo_ops": round_trips.get(step_key, sum(commands.values())),
+                "mongo_commands": dict(commands)
+            })
+
+        if executor == "multiprocess":
+            job_result["mongo_ops"] = sum(round_trips.values())
+
+        # The in-memory outputs of a fused run cannot be loaded by another run
+        if standalone and io_manager != "memory":
+            for key in keys:
+                _, asset_result = measure(key.to_user_string(), lambda: materialize_keys([key]), counter, sampler)
+                asset_result.update({"rows": rows, "kind": "asset", **options})
+                results.append(asset_result)
+    finally:
+        sampler.stop()
+
+    return results
+
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compare the results with a baseline
+
+    Parameters:
+        - `results` - the current results
+        - `baseline` - the baseline results
+        - `tolerance` - the allowed relative slow down
+
+    Output:
+        - the comparison of every job / asset that is part of both (`regression` is `True` if it got slower than the tolerance)
+    """
+    key = ["name", "kind", "rows", "metadata", "io_manager", "executor"]
+    # Baselines saved before the metadata policy / I/O manager / executor options existed ran with the defaults of that time
+    defaults = {"metadata": DEFAULT_POLICY, "io_manager": "pickle", "executor": "in_process"}
+    current = pd.DataFrame(results).reindex(columns=[*key, "wall_s", "peak_rss_mb", "mongo_ops"]).fillna(defaults)
+    previous = pd.DataFrame(baseline).reindex(columns=[*key, "wall_s", "peak_rss_mb", "mongo_ops"]).fillna(defaults)
+
+    comparison = current.merge(previous, "inner", key, suffixes=("", "_baseline"))
+    comparison["wall_ratio"] = (comparison["wall_s"] / comparison["wall_s_baseline"]).round(2)
+    comparison["regression"] = (comparison["wall_ratio"] > 1 + tolerance) | (comparison["mongo_ops"] > comparison["mongo_ops_baseline"])
+
+    return comparison
+
+
+
+def savings(results: list[dict], option: str, reference: str) -> pd.DataFrame:
+    """
+    Compare the job run times of the values of an option with a reference value (e.g. the metadata policies with `full`)
+
+    Parameters:
+        - `results` - the results of runs with several values of the option
+        - `option` - `metadata`, `io_manager` or `executor`
+        - `reference` - the value that the others are compared with
+
+    Output:
+        - the job wall time per value (one row per number of rows and other option), and the time saved compared to `reference`
+    """
+    jobs = pd.DataFrame(results).query("kind == 'job'")
+    others = [column for column in ["rows", "metadata", "io_manager", "executor"] if column != option]
+    table = jobs.pivot_table(index=others, columns=option, values="wall_s", aggfunc="min")
+
+    if reference in table.columns:
+        for value in table.columns.drop(reference):
+            table[f"{value}_saved_s"] = (table[reference] - table[value]).round(3)
+            table[f"{value}_saved_pct"] = (100 * (1 - table[value] / table[reference])).round(1)
+
+    return table.reset_index()
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the upload jobs on synthetic data")
+    parser.add_argument("mode", choices=["portfolios", "trades"])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--mongo-url", help="The benchmark's mongod - never taken from MONGO_URL (required unless --mongomock)")
+    parser.add_argument("--mongomock", action="store_true", help="Use an in-memory mongomock database instead of a mongod (no Mongo op counts)")
+    parser.add_argument("--no-standalone", action="store_true", help="Only run the full job")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--metadata", nargs="+", choices=POLICIES, default=[DEFAULT_POLICY], help="The metadata policies to compare")
+    parser.add_argument("--io-manager", nargs="+", choices=["pickle", "ipc", "parquet", "memory"], default=["ipc"], help="How the step outputs are stored")
+    parser.add_argument("--executor", nargs="+", choices=["in_process", "multiprocess"], default=["in_process"], help="How the full job is run")
+    parser.add_argument("--reset", action="store_true", help="Drop the benchmark's databases before every run (required for more than one run)")
+    args = parser.parse_args()
+
+    if args.mongo_url is None and not args.mongomock:
+        parser.error("--mongo-url is required (or --mongomock)")
+
+    if len(args.rows) * len(args.metadata) * len(args.io_manager) * len(args.executor) > 1 and not args.reset:
+        parser.error("--reset is required to compare several runs (the later runs would skip the already uploaded files)")
+
+    if args.mongomock and "multiprocess" in args.executor:
+        parser.error("--mongomock only works in process (the step processes would not share the database)")
+
+    patch = nullcontext()
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        patch = mock.patch("pymongo.MongoClient", lambda *_, **__: client)
+        args.mongo_url = args.mongo_url or "mongodb://mongomock"
+
+    results = []
+    with patch, tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            for metadata in args.metadata:
+                for io_manager in args.io_manager:
+                    for executor in args.executor:
+                        # The in-memory outputs are not shared between step processes
+                        if io_manager == "memory" and executor == "multiprocess":
+                            continue
+
+                        results += run(
+                            args.mode, rows, args.mongo_url, folder, days=args.days, standalone=not args.no_standalone,
+                            metadata=metadata, io_manager=io_manager, executor=executor, reset=args.reset
+                        )
+
+    print(pd.DataFrame(results).drop(columns="mongo_commands").to_markdown(index=False))
+
+    if len(args.metadata) > 1:
+        print(savings(results, "metadata", "full").to_markdown(index=False))
+
+    if len(args.io_manager) > 1:
+        print(savings(results, "io_manager", "pickle").to_markdown(index=False))
+
+    if len(args.executor) > 1:
+        print(savings(results, "executor", "multiprocess").to_markdown(index=False))
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            comparison = compare(results, json.load(file).get(args.mode, []), args.tolerance)
+        print(comparison.to_markdown(index=False))
+
+        if comparison["regression"].any():
+            raise SystemExit(f"{int(comparison['regression'].sum())} regression(s) against {args.baseline}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+
+        baseline[args.mode] = results
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=4)
+        print(f"Saved the baseline - {args.baseline}")
@@ -0,0 +1,240 @@
+from ngt import constants
+from typing import Callable
+import numpy as np
+import pandas as pd
+import argparse
+import string
+import os
+
+PORTFOLIOS_PATH = os.path.join(constants.DATA_PATH, "Portfolios.csv")
+TRADES_PATH = os.path.join(constants.DATA_PATH, "Trades.csv")
+
+def read_seed(file_path: str) -> pd.DataFrame:
+    """
+    Read a seed file exactly as written (no type inference, "NA" stays Namibia)
+
+    Parameters:
+        - `file_path` - the seed file
+
+    Output:
+        - the seed rows as strings ("" = missing)
+    """
+    return pd.read_csv(file_path, dtype=str, keep_default_na=False)
+
+
+
+def business_days(start: str, days: int) -> pd.DatetimeIndex:
+    """
+    Get `days` business days from `start`
+    """
+    return pd.bdate_range(start, periods=days)
+
+
+
+def random_codes(rng: np.random.Generator, size: int, prefix: str = "", length: int = 9) -> np.ndarray:
+    """
+    Create random upper case / digit codes (e.g. new FIGIs)
+    """
+    alphabet = np.array(list(string.ascii_uppercase + string.digits))
+    characters = alphabet[rng.integers(0, len(alphabet), (size, length))]
+
+    return np.array([prefix + "".join(row) for row in characters], dtype=object)
+
+
+
+def clone_securities(seed: pd.DataFrame, rng: np.random.Generator, rows: int, new_securities: float, figi_column: str, bbg_column: str) -> pd.DataFrame:
+    """
+    Sample the securities of the seed (keeping its FIGI / Bloomberg code distribution) and turn a fraction of the
+    samples into new securities, so that the number of distinct securities grows with the number of rows
+
+    Parameters:
+        - `seed` - the seed rows
+        - `rng` - the random generator
+        - `rows` - the number of rows
+        - `new_securities` - the fraction of rows that belong to a new security
+        - `figi_column` - the FIGI column (`None` if there is none)
+        - `bbg_column` - the Bloomberg code column
+
+    Output:
+        - the sampled rows
+    """
+    data = seed.iloc[rng.integers(0, len(seed), rows)].reset_index(drop=True)
+
+    # New securities are reused by several rows like the real ones
+    new = rng.random(rows) < new_securities
+    count = int(new.sum())
+    if count == 0:
+        return data
+
+    securities = max(1, count // 4)
+    ids = rng.integers(0, securities, count)
+
+    if figi_column:
+        figis = random_codes(rng, securities, "BBG")[ids]
+        data.loc[new, figi_column] = np.where(data.loc[new, figi_column] == "", "", figis)
+
+    tickers = random_codes(rng, securities, length=4)[ids]
+    exchanges = data.loc[new, bbg_column].str.split(" ").str[-1]
+    data.loc[new, bbg_column] = np.where(data.loc[new, bbg_column].str.contains(" "), tickers + " " + exchanges, tickers)
+
+    return data
+
+
+
+def mess_up(data: pd.DataFrame, rng: np.random.Generator, rates: dict[str, float], variants: dict[str, Callable[[pd.Series], pd.Series]]) -> pd.DataFrame:
+    """
+    Add the inconsistencies of the real files
+
+    Parameters:
+        - `data` - the generated rows
+        - `rng` - the random generator
+        - `rates` - the column to the fraction of values that are blanked
+        - `variants` - the column to the function that creates a different spelling (applied to 1% of the values)
+
+    Output:
+        - the messy rows
+    """
+    for column, rate in rates.items():
+        data.loc[rng.random(len(data)) < rate, column] = ""
+
+    for column, variant in variants.items():
+        query = rng.random(len(data)) < 0.01
+        data.loc[query, column] = variant(data.loc[query, column])
+
+    return data
+
+
+
+def generate_portfolios(rows: int, seed: int = 42, days: int = 1, start: str = "2024-02-01", new_securities: float = 0.1) -> pd.DataFrame:
+    """
+    Create a synthetic portfolio file with the `nt_*` schema of `Portfolios.csv`
+
+    Parameters:
+        - `rows` - the number of rows
+        - `seed` - the random seed
+        - `days` - the number of report dates (`nx_date`)
+        - `start` - the first report date
+        - `new_securities` - the fraction of rows that belong to securities not in the seed file
+
+    Output:
+        - the portfolio rows
+    """
+    rng = np.random.default_rng(seed)
+    seed_data = read_seed(PORTFOLIOS_PATH)
+    data = clone_securities(seed_data, rng, rows, new_securities, "nt_figi_code", "nt_bloomberg_code")
+
+    dates = business_days(start, days).strftime("%Y-%m-%d").to_numpy()
+    data["nx_date"] = dates[rng.integers(0, len(dates), rows)]
+    data["nt_pool_fund_code"] = np.array(constants.FUND_CODES, dtype=object)[rng.integers(0, len(constants.FUND_CODES), rows)]
+
+    quantities = pd.to_numeric(data["nt_quantity"], errors="coerce").fillna(1000)
+    data["nt_quantity"] = (quantities * rng.lognormal(0, 0.3, rows)).round(3).astype(str)
+
+    data = mess_up(
+        data, rng,
+        rates={"nt_yellow_key_code": 0.03, "nt_figi_code": 0.01, "nt_security_currency": 0.005},
+        variants={"nt_issuer_country_code": lambda values: values.str.lower()}
+    )
+
+    # Exact duplicates (1%)
+    duplicates = rows // 100
+    if duplicates > 0:
+        data.iloc[rows - duplicates:] = data.iloc[rng.integers(0, rows - duplicates, duplicates)].to_numpy()
+
+    return data[seed_data.columns]
+
+
+
+def generate_trades(rows: int, seed: int = 42, days: int = 1, start: str = "2024-02-01", new_securities: float = 0.1) -> pd.DataFrame:
+    """
+    Create a synthetic trades file with the `nt_*` schema (and date formats) of `Trades.csv`
+
+    Parameters:
+        - `rows` - the number of rows
+        - `seed` - the random seed
+        - `days` - the number of trade dates
+        - `start` - the first trade date
+        - `new_securities` - the fraction of rows that belong to securities not in the seed file
+
+    Output:
+        - the trades rows
+    """
+    rng = np.random.default_rng(seed)
+    seed_data = read_seed(TRADES_PATH)
+    columns = seed_data.columns
+    seed_data = seed_data.loc[seed_data["nt_trade_date"] != ""]
+
+    data = clone_securities(seed_data, rng, rows, new_securities, None, "nt_bloomberg_code")
+
+    # Trades are booked on the next business day - every distinct date is only formatted once
+    trade_dates = business_days(start, days)
+    booking_dates = trade_dates + pd.offsets.BDay()
+    index = rng.integers(0, days, rows)
+
+    formats = {
+        "nt_trade_date": [f"{date.month}/{date.day}/{date.year} 0:00:00" for date in trade_dates],
+        "nx_date": [f"{date.month}/{date.day}/{date.year}" for date in booking_dates],
+        "nt_accounting_date": [f"{date.strftime('%A, %B')} {date.day}" for date in booking_dates]
+    }
+    for column, values in formats.items():
+        data[column] = np.array(values, dtype=object)[index]
+
+    data["nt_fund_code"] = np.array(constants.FUND_CODES, dtype=object)[rng.integers(0, len(constants.FUND_CODES), rows)]
+
+    quantities = pd.to_numeric(data["nt_transaction_quantity"], errors="coerce").fillna(100)
+    prices = pd.to_numeric(data["nt_transaction_price"], errors="coerce").fillna(10)
+    data["nt_transaction_quantity"] = (quantities * rng.lognormal(0, 0.3, rows)).round().astype(int).astype(str)
+    data["nt_transaction_price"] = (prices * rng.lognormal(0, 0.01, rows)).round(4).astype(str)
+
+    data = mess_up(
+        data, rng,
+        rates={"nt_transaction_quantity": 0.02, "nt_transaction_price": 0.02},
+        variants={"nt_issuer_country_name": lambda values: values.str.title().str.replace("-", " ")}
+    )
+
+    # Fully empty rows (~15% of the real file)
+    data.loc[rng.random(rows) < 0.15, :] = ""
+
+    return data[columns]
+
+
+
+def write_csv(generate: Callable[..., pd.DataFrame], file_path: str, rows: int, chunk_size: int = 1_000_000, seed: int = 42, **kwargs) -> str:
+    """
+    Write a synthetic file in chunks so that 10M+ row files never have to fit in memory
+
+    Parameters:
+        - `generate` - `generate_portfolios` or `generate_trades`
+        - `file_path` - the output file
+        - `rows` - the number of rows
+        - `chunk_size` - the number of rows generated at a time
+        - `seed` - the random seed (every chunk gets its own seed)
+        - `kwargs` - passed to `generate`
+
+    Output:
+        - the file path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+
+    for chunk, start in enumerate(range(0, rows, chunk_size)):
+        data = generate(min(chunk_size, rows - start), seed=seed + chunk, **kwargs)
+        data.to_csv(file_path, index=False, mode="w" if chunk == 0 else "a", header=chunk == 0)
+
+    return file_path
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Create synthetic portfolio / trades files")
+    parser.add_argument("mode", choices=["portfolios", "trades"])
+    parser.add_argument("file_path")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--start", default="2024-02-01")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    generate = generate_portfolios if args.mode == "portfolios" else generate_trades
+    write_csv(generate, args.file_path, args.rows, seed=args.seed, days=args.days, start=args.start)
+    print(f"Created {args.file_path} ({args.rows} rows)")
@@ -3,13 +3,16 @@ from .assets import portfolios, trades, factory, figi, security_master, hitl, co
 from . import resources
 from . import jobs
 from . import sensors
+from . import schedules
+from .sensors import events, monitoring
+from .checks import portfolios as portfolio_checks, trades as trades_checks, security_master as security_master_checks
 
 module_assets = load_assets_from_modules([
     portfolios, trades, figi, security_master, hitl, country_codes
 ])
 
 module_asset_checks = load_asset_checks_from_modules([
-    # put asset check modules here
+    portfolio_checks, trades_checks, security_master_checks
 ])
 
 defs = Definitions(
@@ -21,19 +24,26 @@ defs = Definitions(
         factory.make_inconsistent_data("portfolios"), factory.make_inconsistent_data("trades")
     ],
     jobs = [
-        jobs.portfolio_upload_job, jobs.trades_upload_job
+        jobs.portfolio_upload_job, jobs.trades_upload_job, jobs.portfolio_fused_upload_job,
+        jobs.portfolio_folder_upload_job, jobs.trades_folder_upload_job,
+        jobs.hitl_digest_job
     ],
     sensors = [
         sensors.open_figi_api_sensor, sensors.security_master_figi_sensor,
-        sensors.fixed_portfolio_data_sensor, sensors.reupload_faulty_trades
+        sensors.fixed_portfolio_data_sensor, sensors.reupload_faulty_trades,
+        events.faulty_digest_stream_sensor, events.security_master_stream_sensor,
+        events.fixed_portfolio_data_watch_sensor, events.faulty_trades_watch_sensor,
+        monitoring.run_instrumentation_summary
     ],
     schedules = [
-        # Insert schedules here. Example schedules.your_schedule_name
+        schedules.hitl_digest_schedule
     ],
     asset_checks = [*module_asset_checks],
     resources={
+        "io_manager": resources.ArrowIOManager(),
         "mongo": resources.Mongo(url=EnvVar("MONGO_URL")),
         "open_figi": resources.OpenFigi(api_key=EnvVar("FIGI_API_KEY")),
+        "duckdb": resources.DuckDB(),
         "mail": resources.Email(
             sender=EnvVar("EMAIL_SENDER"), 
             host=EnvVar("EMAIL_HOST"), 
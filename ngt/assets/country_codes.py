@@ -1,7 +1,9 @@
-from dagster import asset, Output, AssetIn, MarkdownMetadataValue, AssetExecutionContext, MaterializeResult
+from dagster import asset, Output, AssetIn, AssetExecutionContext, MaterializeResult
 from .. import constants
 from ..resources import Mongo
 from ..configs import RawFilesConfig
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview
 import pandas as pd
 import datetime
 
@@ -10,7 +12,8 @@ import datetime
     description="Get all of the country names and their correct country code (2 digits)",
     group_name="Country_Codes_Upload",
 )
-def country_codes(config: RawFilesConfig) -> Output:
+@instrumented
+def country_codes(context: AssetExecutionContext, config: RawFilesConfig) -> Output:
 
     column_names = {
         "Name": "country_name",
@@ -21,8 +24,8 @@ def country_codes(config: RawFilesConfig) -> Output:
     data = pd.read_csv(config.file_path).drop_duplicates().reset_index(drop=True).rename(columns=column_names)
     
     metadata = {
-        "preview": MarkdownMetadataValue(data.head(20).to_markdown(index=False)),
-        "countries": len(data)
+        "countries": len(data),
+        **preview(context, lambda rows: data.head(rows))
     }
     return Output(data, metadata=metadata)
 
@@ -33,7 +36,8 @@ def country_codes(config: RawFilesConfig) -> Output:
     description="Fetch the existing country codes from the database",
     group_name="Country_Codes_Upload",
 )
-def existing_country_codes(mongo: Mongo) -> Output:
+@instrumented
+def existing_country_codes(context: AssetExecutionContext, mongo: Mongo) -> Output:
     
     data =  pd.DataFrame(mongo.country_codes.find())
     if len(data) > 0:
@@ -55,7 +59,8 @@ def existing_country_codes(mongo: Mongo) -> Output:
         "existing": AssetIn("existing_country_codes")
     }
 )
-def new_country_codes(raw: pd.DataFrame, existing: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
+@instrumented
+def new_country_codes(context: AssetExecutionContext, raw: pd.DataFrame, existing: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
     metadata = {
         "existing": str(len(existing)),
@@ -66,7 +71,7 @@ def new_country_codes(raw: pd.DataFrame, existing: pd.DataFrame, mongo: Mongo) -
         mongo.country_codes.insert_many(raw.to_dict("records"))
         return MaterializeResult(metadata=metadata)
 
-    new = raw.merge(existing, "left", ["country_name", "country_code"], indicator=True).copy()
+    new = raw.merge(existing, "left", ["country_name", "country_code"], indicator=True)
     new = new.loc[new["_merge"] == "left_only"].reset_index(drop=True)
     metadata["new"] = str(len(new))
 
@@ -1,6 +1,11 @@
-from dagster import asset, Output, MaterializeResult, AssetExecutionContext, AssetIn, MarkdownMetadataValue
-from ..resources import Mongo, Email
+from dagster import asset, Output, MaterializeResult, AssetExecutionContext, AssetIn
+from ..resources import Mongo
 from ..configs import EmailConfig
+from .. import partitions
+from ..operations.files import complete_files
+from ..operations.hitl import write_hitl_file, faulty_ids, new_faulty, insert_faulty, content_key
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview
 import pandas as pd
 import os
 import datetime
@@ -12,14 +17,26 @@ def make_upload(mode: str) -> Output:
         name=f"uploaded_raw_{mode}",
         description=f"Filter out the already uploaded {mode} rows.",
         group_name=f"{mode.title()}_Upload",
+        partitions_def=partitions.date_fund_partitions,
         ins={
             "data": AssetIn(f"{mode}_raw_processed_data")
         }
     )
+    @instrumented
     def asset_template(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo) -> Output:
 
         collection = mongo.raw_portfolio if mode == "portfolios" else mongo.raw_trades
+
+        if len(data) == 0:
+            context.log.info("No data found")
+            return Output(data, metadata={"total": 0, "found": 0, "new": 0})
+
+        # Scope the lookup to the partition's date range / fund so that it hits a small index range
+        date_field, fund_field = ("date", "nt_pool_fund_code") if mode == "portfolios" else ("nt_trade_date", "nt_fund_code")
+        collection.create_index([(date_field, 1), (fund_field, 1), ("id", 1)])
+
         query = {
+            **partitions.partition_query(context, date_field, fund_field),
             "id": {"$in": data["id"].drop_duplicates().to_list()}
         }
         project = {
@@ -53,10 +70,12 @@ def make_new_data(mode: str) -> Output:
         description=f"Upload the new raw {mode}.",
         name=f"new_raw_{mode}_data",
         group_name=f"{mode.title()}_Upload",
+        partitions_def=partitions.date_fund_partitions,
         ins={
             "data": AssetIn(f"uploaded_raw_{mode}")
         }
     )
+    @instrumented
     def asset_template(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo) -> Output:
 
         is_portfolio = mode == "portfolios"
@@ -65,17 +84,18 @@ def make_new_data(mode: str) -> Output:
         metadata = {
             "uploaded": len(data) > 0,
             "rows": len(data),
-            "preview": "",
             "collection": f"{collection.database.name}/{collection.name}"
         }
 
         if metadata["uploaded"]:
-            metadata["preview"] = MarkdownMetadataValue(data.head(10).to_markdown(index=False))
+            metadata.update(preview(context, lambda rows: data.head(rows)))
             collection.insert_many(data.to_dict("records"))
             context.log.info(f"Uploaded {len(data)} row(s)")
         else:
             context.log.warning("No new rows have been uploaded")
-            metadata.pop("preview")
+
+        # The landing folder files of this run are only skipped once their rows are in the database
+        metadata["completed_files"] = complete_files(context, mongo.file_registry)
 
         return Output(data, metadata=metadata)
     
@@ -89,39 +109,58 @@ def make_inconsistent_email(mode: str):
     @asset(
         name=f"inconsistent_{mode}_email",
         compute_kind="Python",
-        description="Send an alert that there are rows that need to be fixed",
+        description="Export the new rows that need to be fixed (the email is sent by the HITL digest unless `digest` is off)",
         group_name="Human_In_The_Loop",
+        partitions_def=partitions.date_fund_partitions,
         ins={
-            "data": AssetIn(f"filter_{mode}_data")
+            "data": AssetIn(f"filter_{mode}_data", metadata={"parts": [1]})
         }
     )
-    def asset_template(context: AssetExecutionContext, data: tuple[pd.DataFrame, pd.DataFrame], mail: Email, config: EmailConfig) -> Output:
+    @instrumented
+    def asset_template(context: AssetExecutionContext, data: tuple[pd.DataFrame, pd.DataFrame], mongo: Mongo, config: EmailConfig) -> Output:
 
         _, faulty = data
+        collection = mongo.inconsistent_portfolio if mode == "portfolios" else mongo.inconsistent_trades
+
+        # Only the rows that are not tracked yet - the pending ones have already been reported
+        if len(faulty) > 0:
+            faulty = faulty.assign(faulty_id=faulty_ids(faulty, ["id", "column_name"] if mode == "portfolios" else None))
+            faulty = new_faulty(collection, faulty)
 
         metadata = {
-            "email": len(faulty) > 0,
+            "new": len(faulty),
+            "email": len(faulty) > 0 and not config.digest,
             "to": "; ".join(config.to)
         }
 
-        if not metadata["email"]:
-            context.log.info("No inconsistent rows to be emailed.")
+        if len(faulty) == 0:
+            context.log.info("No new inconsistent rows to be exported.")
             return Output(faulty, metadata=metadata)
-        
-        subject = f"Faulty {mode.title()}"
-        body = "<p>The attached file has rows that must be filled up manually. Please further investigate</p>"
 
-        folder = os.path.dirname(config.file_path)
-        os.makedirs(folder, exist_ok=True)
-        context.log.info(f"Folder {folder} created")
+        # The digest writes its own files - no per-partition file that nobody receives
+        if not metadata["email"]:
+            context.log.info("The rows will be part of the next HITL digest")
+            return Output(faulty.assign(emailed_timestamp=None), metadata=metadata)
+
+        # Every partition / email gets its own file so that parallel runs and re-runs never overwrite the
+        # attachment of a queued email
+        key = content_key(faulty["faulty_id"])
+        name, extension = os.path.splitext(config.file_path)
+        partition = f" {context.partition_key.replace('|', ' ')}" if context.has_partition_key else ""
+        file_path = f"{name}{partition} {key[:12]}{extension}"
+
+        # The format follows the extension - CSV / Parquet by default, Excel only when asked for
+        write_hitl_file(faulty.drop(columns="faulty_id"), file_path)
+        context.log.info(f"File has been saved - {file_path}")
 
-        faulty.to_excel(config.file_path, index=False)
-        context.log.info(f"File has been saved - {config.file_path}")
+        subject = f"Faulty {mode.title()}"
+        body = "<p>The attached file has rows that must be filled up manually. Please further investigate</p>"
 
-        mail.send(config.to, subject, body, config.cc, config.file_path)
-        context.log.info(f"Email was sent to {config.to}")
+        # Queued in the outbox - the pipeline does not wait for the mail server
+        mongo.enqueue_email(config.to, subject, body, config.cc, file_path, key=f"{mode}/{key}")
+        context.log.info(f"Email to {config.to} was queued")
 
-        return Output(faulty, metadata=metadata)
+        return Output(faulty.assign(emailed_timestamp=datetime.datetime.now()), metadata=metadata)
     
     return asset_template
 
@@ -134,10 +173,12 @@ def make_inconsistent_data(mode: str):
         compute_kind="Mongodb",
         description="Send an alert that there are rows that need to be fixed",
         group_name="Human_In_The_Loop",
+        partitions_def=partitions.date_fund_partitions,
         ins={
             "faulty": AssetIn(f"inconsistent_{mode}_email")
         }
     )
+    @instrumented
     def asset_template(context: AssetExecutionContext, faulty: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
         collection = mongo.inconsistent_portfolio if mode == "portfolios" else mongo.inconsistent_trades
@@ -155,9 +196,9 @@ def make_inconsistent_data(mode: str):
         faulty["upload_timestamp"] = datetime.datetime.now()
         faulty["completed_timestamp"] = None
 
-        documents = faulty.to_dict("records")
-        collection.insert_many(documents)
-        context.log.info(f"Uploaded {len(documents)}")
+        # Upserted on the faulty id - a re-run never duplicates the pending rows
+        metadata["new"] = insert_faulty(collection, faulty)
+        context.log.info(f"Uploaded {metadata['new']}")
 
         return MaterializeResult(metadata=metadata)
 
@@ -1,6 +1,9 @@
 from dagster import asset, Output, AssetExecutionContext, AssetIn, MaterializeResult
 from ..configs import FigiConfig
 from ..resources import OpenFigi, Mongo
+from .. import partitions
+from ..operations.security_master import enrich_security_master, enrich_security_master_server_side
+from ..operations.instrumentation import instrumented
 import pandas as pd
 import time
 import datetime
@@ -10,31 +13,31 @@ import datetime
     compute_kind="Mongodb",
     description="Fetch the information about the FIGIs",
     group_name="Figi_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
-        "data": AssetIn("uploaded_raw_portfolios")
+        "data": AssetIn("uploaded_raw_portfolios", metadata={"columns": ["nt_figi_code", "nt_security_currency", "upload_timestamp"]})
     }
 )
+@instrumented
 def figi_queue(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
     if len(data) == 0:
         return MaterializeResult()
     
     figis = data[["nt_figi_code", "nt_security_currency", "upload_timestamp"]]\
-                    .dropna().drop_duplicates().copy()
+                    .dropna()\
+                    .drop_duplicates(subset=["nt_figi_code", "nt_security_currency"])
     
-    queued = mongo.figi_queue.distinct("nt_figi_code")
+    new = mongo.enqueue_figis(figis.to_dict("records"))
 
-    query = ~figis["nt_figi_code"].isin(queued)
-
-    if query.sum() > 0:
-        mongo.figi_queue.insert_many(figis.loc[query].to_dict("records"))
-        context.log.info(f"Added {len(figis)} to the OpenFIGI API queue")
+    if new > 0:
+        context.log.info(f"Added {new} to the OpenFIGI API queue")
     else:
         context.log.info("No new FIGIs uploaded")
     
     metadata = {
         "total": len(figis),
-        "new": int(query.sum())
+        "new": new
     }
 
     return MaterializeResult(metadata=metadata)
@@ -47,12 +50,14 @@ def figi_queue(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo)
     group_name="Figi_Upload",
     deps = ["figi_queue"]
 )
+@instrumented
 def new_figis(context: AssetExecutionContext, open_figi: OpenFigi, mongo: Mongo, config: FigiConfig) -> MaterializeResult:
     
     collection = mongo.open_figi
     metadata = {
         "uploaded": 0,
         "skipped": 0,
+        "failed": 0,
         "collection": f"{collection.database.name}/{collection.name}"
     }
 
@@ -61,23 +66,26 @@ def new_figis(context: AssetExecutionContext, open_figi: OpenFigi, mongo: Mongo,
     for figi in config.figis:
         
         if requests >= open_figi.MAX_REQUESTS_PER_MINUTE:
-            context.log.info(f"Waiting 1 minute for OpenFIGI requests to refresh")
+            context.log.info("Waiting 1 minute for OpenFIGI requests to refresh")
             time.sleep(70) # Sleep for slightly longer just in case of server delay
             requests = 0
 
         context.log.info(f"Starting {figi.code}")
 
-        data = open_figi.search(figi.code, figi.ccy)
-        requests += 1
+        try:
+            data = open_figi.search(figi.code, figi.ccy)
+        except Exception as error:
+            dead = mongo.fail_figi(figi.code, figi.ccy, repr(error), lease_id=figi.lease_id)
+            context.log.warning(f"Failed {figi.code} ({'dead-lettered' if dead else 'will be retried'}): {error!r}")
+            metadata["failed"] += 1
+            continue
+        finally:
+            requests += 1
 
-        query = {"nt_figi_code": figi.code}
-        update = {
-            "$set": {
-                "completed_timestamp": datetime.datetime.now(),
-                "found": len(data) > 0
-            }
-        }
-        mongo.figi_queue.update_many(query, update)
+        if not mongo.complete_figi(figi.code, figi.ccy, len(data) > 0, figi.lease_id):
+            context.log.warning(f"The lease of {figi.code} has expired - it is processed by another run")
+            metadata["skipped"] += 1
+            continue
 
         if len(data) == 0:
             context.log.warning(f"No data found for {figi.code}")
@@ -103,48 +111,16 @@ def new_figis(context: AssetExecutionContext, open_figi: OpenFigi, mongo: Mongo,
     group_name="Figi_Upload",
     deps=["new_figis"]
 )
+@instrumented
 def figi_security_master(context: AssetExecutionContext, mongo: Mongo, config: FigiConfig) -> MaterializeResult:
 
-    metadata = {
-        "updates": 0,
-        "skips": 0
-    }
-    for figi in config.figis:
-
-        now = datetime.datetime.now()
-        query = {
-            "figi": figi.code,
-            "ccy": figi.ccy
-        }
+    figis = [(figi.code, figi.ccy) for figi in config.figis]
 
-        api_data = mongo.open_figi.find_one(query)
-        
-        mongo.figi_queue.update_many({
-            "nt_figi_code": figi.code,
-            "nt_security_currency": figi.ccy
-        }, {
-            "$set": {
-                "security_master_timestamp": now
-            }
-        })
-        if not api_data:
-            metadata["skips"] += 1
-            continue
-
-        query["figi_code"] = query.pop("figi")        
-
-        security: dict = mongo.security_master.find_one(query)        
-        security.pop("upload_timestamp")
-
-        if not security.get("security_name"):
-            security["security_name"] = api_data["ticker"]
-
-        security["security_type"] = api_data["securityType"]
-        security["yellow_key_code"] = api_data["marketSector"]
-        security["security_type_2"] = api_data["securityType2"]
-        security["upload_timestamp"] = now
-
-        mongo.security_master.update_one({"_id": security["_id"]}, {"$set": security})
-        metadata["updates"] += 1
+    if config.server_side:
+        metadata = enrich_security_master_server_side(mongo, figis)
+        context.log.info(f"Merged the API data of {metadata['figis']} FIGI(s)")
+    else:
+        metadata = enrich_security_master(mongo, figis)
+        context.log.info(f"Updated {metadata['updates']} securities, skipped {metadata['skips']}")
 
     return MaterializeResult(metadata=metadata)
\ No newline at end of file
@@ -1,6 +1,10 @@
-from dagster import asset, Output, AssetExecutionContext, AssetIn, MarkdownMetadataValue, MaterializeResult
+from dagster import asset, Output, AssetExecutionContext, AssetIn, MaterializeResult
 from ..resources import Mongo
-from ..configs import RawFilesConfig
+from ..configs import RawFilesConfig, DigestConfig
+from ..operations.repair import save_corrections
+from ..operations.hitl import read_hitl_file, apply_corrections, write_hitl_file, pending_digest, content_key, TRACKING_COLUMNS
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview
 import pandas as pd
 import os
 import shutil
@@ -13,35 +17,35 @@ import datetime
     group_name="Human_In_The_Loop",
     deps=["inconsistent_portfolios_data"]
 )
+@instrumented
 def fixed_inconsistent_portfolio_data(context: AssetExecutionContext, config: RawFilesConfig, mongo: Mongo) -> Output:
 
-    data = pd.read_excel(config.file_path)
+    # All of the corrections are applied at once - one insert and one status update for the whole file
+    fixed = read_hitl_file(config.file_path)
+    data = apply_corrections(fixed)
 
     metadata = {
-        "rows": 0
+        "rows": len(data),
+        # The next occurrence of the same security is repaired without a human
+        "learned_corrections": save_corrections(mongo.hitl_corrections, fixed)
     }
 
-    completed = []
+    now = datetime.datetime.now()
+    completed = data.assign(upload_timestamp=now)
 
-    for id, group in data.groupby("id"):
-
-        group = group.drop(["column_name", "comment"], axis=1).ffill().bfill().drop_duplicates().reset_index(drop=True)
-        group["upload_timestamp"] = datetime.datetime.now()
-        completed.append(group.copy())
-
-        metadata["rows"] += len(group)
-
-        mongo.processed_portfolio.insert_many(group.to_dict("records"))
+    if len(completed) > 0:
+        mongo.processed_portfolio.insert_many(completed.to_dict("records"))
 
-        context.log.info(f"Uploaded {id}")
-        query = {"id": id}
+        ids = completed["id"].drop_duplicates().to_list()
+        query = {"id": {"$in": ids}}
         update = {
             "$set": {
-                "completed_timestamp": datetime.datetime.now(),
+                "completed_timestamp": now,
                 "status": "completed"
             }
         }
         mongo.inconsistent_portfolio.update_many(query, update)
+        context.log.info(f"Uploaded {len(ids)} fixed portfolio(s)")
 
     completed_file_path = os.path.join(os.path.dirname(config.file_path), "completed", os.path.basename(config.file_path))
     os.makedirs(os.path.dirname(completed_file_path), exist_ok=True)
@@ -49,8 +53,69 @@ def fixed_inconsistent_portfolio_data(context: AssetExecutionContext, config: Ra
     shutil.move(config.file_path, completed_file_path)
     context.log.info("File was archived")
 
-    completed = pd.concat(completed, ignore_index=True) if completed else pd.DataFrame()
     if len(completed) > 0:
-        completed["preview"] = MarkdownMetadataValue(completed.to_markdown(index=False))
+        metadata.update(preview(context, lambda rows: completed.head(rows)))
     
-    return Output(completed, metadata=metadata)
\ No newline at end of file
+    return Output(completed, metadata=metadata)
+
+
+
+@asset(
+    compute_kind="Python",
+    description="Email all of the new faulty portfolio / trades rows in one digest",
+    group_name="Human_In_The_Loop"
+)
+@instrumented
+def inconsistent_digest_email(context: AssetExecutionContext, config: DigestConfig, mongo: Mongo) -> MaterializeResult:
+
+    now = datetime.datetime.now()
+    collections = {
+        "portfolios": mongo.inconsistent_portfolio,
+        "trades": mongo.inconsistent_trades
+    }
+
+    metadata = {
+        "email": False,
+        "to": "; ".join(config.to)
+    }
+
+    # The rows of a queued (not yet sent) digest are not emailed again
+    queued = list(mongo.email_outbox.find({"status": {"$in": ["pending", "leased"]}}, {"faulty_ids": 1}))
+
+    pending = {}
+    for mode, collection in collections.items():
+
+        faulty = pending_digest(collection)
+        if len(faulty) > 0:
+            faulty = faulty.loc[~faulty["faulty_id"].isin([id for email in queued for id in email.get("faulty_ids", {}).get(mode, [])])]
+        metadata[mode] = len(faulty)
+
+        if len(faulty) > 0:
+            pending[mode] = faulty
+
+    if not pending:
+        context.log.info("No new inconsistent rows to be emailed.")
+        return MaterializeResult(metadata=metadata)
+
+    # Every email gets its own folder - a later digest never overwrites the attachments of a queued email
+    emailed = {mode: faulty["faulty_id"].to_list() for mode, faulty in pending.items()}
+    key = content_key(pd.Series([id for ids in emailed.values() for id in ids]))
+    folder_path = os.path.join(config.folder_path, f"{now.strftime('%Y-%m-%d %H%M%S')} {key[:12]}")
+
+    attachments = []
+    for mode, faulty in pending.items():
+
+        file_path = os.path.join(folder_path, f"Faulty {mode.title()}{config.extension}")
+        write_hitl_file(faulty.drop(columns=[column for column in TRACKING_COLUMNS if column in faulty.columns]), file_path)
+        context.log.info(f"File has been saved - {file_path}")
+        attachments.append(file_path)
+
+    subject = "Faulty Portfolios / Trades"
+    body = "<p>The attached files have rows that must be filled up manually. Please further investigate</p>"
+
+    # One email for everything that was found since the last digest - sent by the outbox sender, which marks the
+    # rows as emailed once the email has actually been sent
+    metadata["email"] = mongo.enqueue_email(config.to, subject, body, config.cc, attachments, key=f"digest/{key}", faulty_ids=emailed)
+    context.log.info(f"Email to {config.to} was queued" if metadata["email"] else "The same digest is already queued")
+
+    return MaterializeResult(metadata=metadata)
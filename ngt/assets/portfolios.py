@@ -1,7 +1,17 @@
-from dagster import asset, Output, AssetExecutionContext, AssetIn, MarkdownMetadataValue, MaterializeResult
-from ..configs import RawFilesConfig
+from dagster import asset, Output, AssetExecutionContext, AssetIn, MaterializeResult
+from ..configs import RawUploadConfig
 from ..resources import Mongo
 from .. import constants
+from ..operations.harmonization import Harmonizer, load_aliases, save_aliases
+from ..operations.normalization import prefix_match
+from ..operations.files import load_files, load_folder
+from ..operations.validation import PORTFOLIO_RULES, validate, rule_counts, failed_rows
+from ..operations.repair import REPAIR_COLUMNS, LOOKUP_KEYS, load_corrections, unique_values, repair
+from .. import partitions
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview, summary
+from ..operations.engine import get_transforms
+from ..operations.transforms import categorize
 import datetime
 import pandas as pd
 import os
@@ -9,18 +19,40 @@ import os
 @asset(
     compute_kind="Pandas",
     description="Load the portfolio data into a DataFrame.",
-    group_name="Portfolios_Upload"
+    group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions
 )
-def portfolios_file_data(context: AssetExecutionContext, config: RawFilesConfig) -> Output:
+@instrumented
+def portfolios_file_data(context: AssetExecutionContext, config: RawUploadConfig, mongo: Mongo) -> Output:
     
-    data = pd.read_csv(config.file_path)
-    context.log.info(f"Opened file {os.path.basename(config.file_path)}")
+    if config.folder_path:
+        data, files = load_folder(context, mongo.file_registry, config.folder_path, "portfolios", config.max_workers)
+        file_names = [file["file_name"] for file in files]
+    else:
+        data, _ = load_files(context, mongo.file_registry, [config.file_path], "portfolios")
+        file_names = [os.path.basename(config.file_path)]
+
+    context.log.info(f"Opened file(s) {'; '.join(file_names)}")
+
+    if len(data) == 0:
+        context.log.info("No new rows - the file(s) have already been uploaded")
+        return Output(data, metadata={"rows": 0, "file_name": "; ".join(file_names)})
+
+    # Keep only the rows of the current business date / fund partition (+ the rows without a known fund code in
+    # the catch-all partition - they go to HITL)
+    business_dates = pd.to_datetime(data["nx_date"]) - pd.offsets.BDay()
+    data = categorize(data.loc[partitions.partition_mask(context, business_dates, data["nt_pool_fund_code"])].reset_index(drop=True))
+
+    unknown_funds = int(partitions.unknown_funds(data["nt_pool_fund_code"]).sum())
+    if unknown_funds:
+        context.log.warning(f"{unknown_funds} row(s) without a known fund code")
     
     metadata = {
         "rows": len(data),
-        "preview": MarkdownMetadataValue(data.head(20).to_markdown(index=False)),
-        "file_name": os.path.basename(config.file_path),
-        "fund_codes": "; ".join(data["nt_pool_fund_code"].unique())
+        "unknown_funds": unknown_funds,
+        "file_name": "; ".join(file_names),
+        **preview(context, lambda rows: data.head(rows)),
+        **summary(context, lambda: data["nt_pool_fund_code"].unique(), "fund_codes")
     }
 
     return Output(data, metadata=metadata)
@@ -31,44 +63,27 @@ def portfolios_file_data(context: AssetExecutionContext, config: RawFilesConfig)
     compute_kind="Pandas",
     description="Prepare the raw data to be uploaded.",
     group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("portfolios_file_data")
     }
 )
+@instrumented
 def portfolios_raw_processed_data(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
 
-    def get_identifier(row: pd.Series) -> str:
-        """
-        Get the identifier for the current row
-        """
-        if not pd.isna(row["nt_figi_code"]):
-            return row["nt_figi_code"]
-        
-        bbg_id = row["nt_bloomberg_code"]
-        if pd.isna(bbg_id):
-            return row["nt_security_name"].replace(" ", "_")
-        
-        
-        if pd.isna(row["nt_bloomberg_code_of_underlying"]):
-            return bbg_id
-        
-        return bbg_id + "/" + row["nt_bloomberg_code_of_underlying"]
-
-    data["nx_date"] = pd.to_datetime(data["nx_date"])
-    data["date"] = data["nx_date"] - pd.offsets.BDay()
-    context.log.info("Fixed date columns")
-
-    initial_rows = len(data)    
-    data = data.drop_duplicates().reset_index(drop=True)
-    context.log.info(f"Dropped duplicates (from {initial_rows} to {len(data)})")
-
-    id = data["date"].dt.strftime("%Y-%m-%d") + "/" + data["nt_pool_fund_code"] + "/" + data["nt_issuer_country_code"] + "/" + data["nt_gti_code"] + "/" + data.apply(get_identifier, axis=1) + "/" + data["nt_quantity"].astype(str).str.replace("-", "NEG")
-    data.insert(0, "id", id)
-    context.log.info("Created unique ID")
+    if len(data) == 0:
+        context.log.info("No data found")
+        return Output(data)
+
+    # Fixed date columns, dropped the duplicates and created the unique ID
+    initial_rows = len(data)
+    data = get_transforms(context).portfolio_ids(data)
+    context.log.info(f"Created unique ID (dropped duplicates from {initial_rows} to {len(data)})")
 
     data["upload_timestamp"] = datetime.datetime.now()
     metadata = {
-        "preview": MarkdownMetadataValue(data.head(20).to_markdown(index=False))
+        "rows": len(data),
+        **preview(context, lambda rows: data.head(rows))
     }
 
     return Output(data, metadata=metadata)
@@ -79,14 +94,16 @@ def portfolios_raw_processed_data(context: AssetExecutionContext, data: pd.DataF
     compute_kind="Pandas",
     description="Create new columns.",
     group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("uploaded_raw_portfolios")
     }
 )
-def new_portfolio_columns(context: AssetExecutionContext, data: pd.DataFrame, country_codes: pd.DataFrame) -> Output:
+@instrumented
+def new_portfolio_columns(context: AssetExecutionContext, data: pd.DataFrame, country_codes: pd.DataFrame, mongo: Mongo) -> Output:
     
     if len(data) == 0:
-        context.log.info(f"No data found")
+        context.log.info("No data found")
         return Output(data)
     
     country_codes = country_codes.rename(columns={
@@ -120,17 +137,19 @@ def new_portfolio_columns(context: AssetExecutionContext, data: pd.DataFrame, co
         "short": int((data["long_short"] == "short").sum())
     })
 
-    # (4) Add country name
+    # (4) Harmonize the country codes - unknown codes are kept as they are
+    countries = Harmonizer.countries(load_aliases(mongo.harmonization_aliases, "countries"))
+    data["issuer_country_code"] = countries.resolve(data["issuer_country_code"]).fillna(data["issuer_country_code"])
+    metadata["learned_countries"] = save_aliases(mongo.harmonization_aliases, "countries", countries.learned)
+    metadata["suggested_countries"] = save_aliases(mongo.harmonization_aliases, "countries", countries.suggested, reviewed=False)
+    context.log.info("Harmonized country codes")
+
+    # (5) Add country name
     data = data.merge(country_codes, "left", "issuer_country_code")
-    metadata.update({
-        "preview": MarkdownMetadataValue(
-                data.groupby("issuer_country")\
-                    .count()["id"].reset_index()\
-                    .rename(columns={"id": "rows"})\
-                    .sort_values("issuer_country")\
-                    .to_markdown(index=False)
-            )
-    })
+    # Rows per country - one value count instead of counting every column per group
+    metadata.update(preview(context, lambda rows: data["issuer_country"].value_counts().head(rows).rename("rows").rename_axis("issuer_country").reset_index()))
+    metadata["rows"] = len(data)
+
     return Output(data, metadata=metadata)
 
 
@@ -139,85 +158,108 @@ def new_portfolio_columns(context: AssetExecutionContext, data: pd.DataFrame, co
     compute_kind="Pandas",
     description="Fill the missing description data for each FIGI.",
     group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("new_portfolio_columns")
     }
 )
+@instrumented
 def missing_portfolio_values(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
 
     if len(data) == 0:
-        context.log.info(f"No data found")
+        context.log.info("No data found")
         return Output(data)
 
-    for security_name, yellow_code in constants.MISSING_YELLOW_CODES.items():
-        query = data["security_name"].fillna("").str.upper().str.startswith(security_name)
-        data.loc[query, "yellow_key_code"] = yellow_code
-        context.log.info(f"Normalized {security_name}S")
-
-    figi_codes = data["figi_code"].dropna().unique().tolist()
-    
-    get_nan_columns = lambda df: df.columns[(df.isna().sum() > 0).to_frame().T.values[0]]
-    for figi_code in figi_codes:
-
-        current = data.loc[data["figi_code"] == figi_code]
-        for column in get_nan_columns(current):
-    
-            values = current[column].dropna().unique()
-            if not values:
-                continue
-            
-            data.loc[current.index, column] = values[0]
+    matched = prefix_match(data["security_name"], constants.MISSING_YELLOW_CODES.keys())
+    query = matched.notna()
+    data.loc[query, "yellow_key_code"] = matched.loc[query].map(constants.MISSING_YELLOW_CODES)
+    context.log.info(f"Normalized {', '.join(matched.dropna().unique())} Yellow Codes")
 
-        context.log.info(f"FIGI ({figi_code}) columns fixed")
+    # The missing values of a FIGI are filled from its other rows - one grouped pass instead of one pass per FIGI
+    missing = int(data.isna().sum().sum())
+    data = get_transforms(context).fill_by_figi(data)
+    context.log.info(f"Filled {missing - int(data.isna().sum().sum())} missing value(s) from the same FIGI")
     
     return Output(data)
 
 
 
 @asset(
-    compute_kind="Pandas",
-    description="Split the data into consistent and inconsistent.",
+    compute_kind="Mongodb",
+    description="Repair the missing values that can be derived before the rows are sent to the HITL.",
     group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("missing_portfolio_values")
     }
 )
-def filter_portfolios_data(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
+@instrumented
+def repaired_portfolio_values(context: AssetExecutionContext, data: pd.DataFrame, country_codes: pd.DataFrame, mongo: Mongo) -> Output:
 
     if len(data) == 0:
-        context.log.info(f"No data found")
-        return Output((pd.DataFrame(), pd.DataFrame()))
+        context.log.info("No data found")
+        return Output(data)
 
-    checks = {
-        "pool_fund_code": "No Fund Code found.",
-        "yellow_key_code": "No Bloomberg Yellow Key Code found.",
-        "issuer_country_code": "No country code found.",
-        "security_currency": "No security currency found."
+    missing = data[REPAIR_COLUMNS].isna().any(axis=1)
+    metadata = {
+        "missing": int(missing.sum())
     }
 
-    faulty = []
+    if metadata["missing"] == 0:
+        context.log.info("Nothing to repair")
+        return Output(data, metadata=metadata)
 
-    for column, comment in checks.items():
+    # Only the securities with missing values are looked up - one query per source
+    keys = {key: data.loc[missing, key].dropna().unique().tolist() for key in LOOKUP_KEYS}
+    corrections = load_corrections(mongo.hitl_corrections, data.loc[missing])
+    history = {key: unique_values(mongo.processed_portfolio, key, keys[key], REPAIR_COLUMNS) for key in LOOKUP_KEYS}
+    currencies = unique_values(mongo.security_master, "figi_code", keys["figi_code"], ["ccy"])["ccy"]
 
-        nans = data[column].isna()
+    data, repairs = repair(data, corrections, history, currencies)
 
-        if nans.sum() == 0:
-            continue
-        
-        current = data.loc[nans].reset_index(drop=True).copy()
-        current.insert(1, "column_name", column)
-        current.insert(2, "comment", comment)
-        faulty.append(current)
-    
-    faulty = pd.DataFrame() if not faulty else pd.concat(faulty, ignore_index=True).drop_duplicates().reset_index(drop=True)
+    # The country names of the repaired country codes
+    country_names = country_codes.drop_duplicates("country_code").set_index("country_code")["country_name"]
+    data["issuer_country"] = data["issuer_country"].fillna(data["issuer_country_code"].map(country_names))
+
+    metadata.update({
+        "repaired": int(metadata["missing"] - data[REPAIR_COLUMNS].isna().any(axis=1).sum()),
+        **repairs
+    })
+    context.log.info(f"Repaired {metadata['repaired']} of {metadata['missing']} row(s)")
+
+    return Output(data, metadata=metadata)
+
+
+
+@asset(
+    compute_kind="Pandas",
+    description="Split the data into consistent and inconsistent.",
+    group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
+    ins={
+        "data": AssetIn("repaired_portfolio_values")
+    }
+)
+@instrumented
+def filter_portfolios_data(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
+
+    if len(data) == 0:
+        context.log.info("No data found")
+        return Output((pd.DataFrame(), pd.DataFrame()))
+
+    # All of the rules are evaluated in one pass - bit `i` of a row's bitmask is set if rule `i` failed
+    failures, bitmask = validate(data, PORTFOLIO_RULES)
+
+    faulty = failed_rows(data, failures, PORTFOLIO_RULES).drop_duplicates().reset_index(drop=True)
     
-    query = ~data["id"].isin(faulty["id"])
-    consistent = data.loc[query].reset_index(drop=True).copy()
+    query = ~data["id"].isin(data.loc[bitmask != 0, "id"])
+    consistent = data.loc[query].reset_index(drop=True)
     
     metadata = {
         "total": len(data),
         "consistent": len(consistent),
-        "faulty": len(faulty)
+        "faulty": len(faulty),
+        **rule_counts(failures)
     }
 
     return Output((consistent, faulty), metadata=metadata)
@@ -228,10 +270,12 @@ def filter_portfolios_data(context: AssetExecutionContext, data: pd.DataFrame) -
     compute_kind="Mongodb",
     description="Upload the consistent portfolio data to the database",
     group_name="Portfolios_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
-        "data": AssetIn("filter_portfolios_data")
+        "data": AssetIn("filter_portfolios_data", metadata={"parts": [0]})
     }
 )
+@instrumented
 def new_portfolio_data(context: AssetExecutionContext, data: tuple[pd.DataFrame, pd.DataFrame], mongo: Mongo) -> MaterializeResult:
 
     consistent, _ = data
@@ -244,7 +288,7 @@ def new_portfolio_data(context: AssetExecutionContext, data: tuple[pd.DataFrame,
     }
 
     if not metadata["uploaded"]:
-        context.log.info(f"No new portfolio data")
+        context.log.info("No new portfolio data")
         return MaterializeResult(metadata=metadata)
     
     collection.insert_many(consistent.to_dict("records"))
@@ -1,36 +1,48 @@
-from dagster import asset, Output, AssetIn, MarkdownMetadataValue, AssetExecutionContext, MaterializeResult
+from dagster import asset, Output, AssetIn, AssetExecutionContext, MaterializeResult
 from .. import constants
-from ..resources import Mongo
+from ..resources import Mongo, DuckDB
+from ..operations.harmonization import Harmonizer, load_aliases, save_aliases
+from ..operations.normalization import prefix_match
+from .. import partitions
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview
+from ..operations.engine import get_transforms
+from ..operations import duckdb_master
+from ..operations.security_master import upsert_securities
 import pandas as pd
-import datetime
+
+# The raw portfolio columns of the security master (the only ones read from `uploaded_raw_portfolios`)
+INSTRUMENT_COLUMN_MAPPINGS = {
+    "nt_security_name": "security_name",
+    "nt_yellow_key_code": "yellow_key_code",
+    "nt_underlying_security_name": "underlying_security_name",
+    "nt_security_currency": "ccy",
+    "nt_figi_code": "figi_code",
+    "nt_bloomberg_code": "bbg_code",
+    "nt_bloomberg_code_of_underlying": "underlying_bbg_code",
+    "nt_gti_code": "gti_code",
+    "nt_second_quotation_currency": "second_quotation_ccy",
+    "nt_issuer_country_code": "issuer_country_code"
+}
 
 @asset(
     compute_kind="Pandas",
     description="Create the portfolio instruments that will be uploaded to the security master",
     group_name="Security_Master_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
-        "data": AssetIn("uploaded_raw_portfolios")
+        "data": AssetIn("uploaded_raw_portfolios", metadata={"columns": [*INSTRUMENT_COLUMN_MAPPINGS.keys(), "nt_quantity"]})
     }
 )
-def portfolio_instruments_rename(data: pd.DataFrame) -> Output:
-
-    column_mappings = {
-        "nt_security_name": "security_name",
-        "nt_yellow_key_code": "yellow_key_code",
-        "nt_underlying_security_name": "underlying_security_name",
-        "nt_security_currency": "ccy",
-        "nt_figi_code": "figi_code",
-        "nt_bloomberg_code": "bbg_code",
-        "nt_bloomberg_code_of_underlying": "underlying_bbg_code",
-        "nt_gti_code": "gti_code",
-        "nt_second_quotation_currency": "second_quotation_ccy",
-        "nt_issuer_country_code": "issuer_country_code"
-    }
-    
-    data = data.loc[data["nt_quantity"] != 0].reset_index(drop=True)
-    instruments = data[list(column_mappings.keys())]\
-                    .rename(columns=column_mappings)\
-                    .drop_duplicates().copy()
+@instrumented
+def portfolio_instruments_rename(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
+
+    column_mappings = INSTRUMENT_COLUMN_MAPPINGS
+
+    if len(data) == 0:
+        return Output(pd.DataFrame(columns=list(column_mappings.values())), metadata={"rows": 0})
+
+    instruments = get_transforms(context).portfolio_instruments(data, column_mappings)
 
     metadata = {
         "rows": len(instruments)
@@ -44,11 +56,13 @@ def portfolio_instruments_rename(data: pd.DataFrame) -> Output:
     compute_kind="Pandas",
     description="Process the new portfolio instruments for the security master",
     group_name="Security_Master_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "instruments": AssetIn("portfolio_instruments_rename")
     }
 )
-def processed_portfolio(context: AssetExecutionContext, instruments: pd.DataFrame) -> Output:
+@instrumented
+def processed_portfolio(context: AssetExecutionContext, instruments: pd.DataFrame, mongo: Mongo) -> Output:
 
     metadata = {
         "rows": len(instruments)
@@ -57,6 +71,13 @@ def processed_portfolio(context: AssetExecutionContext, instruments: pd.DataFram
     if len(instruments) == 0:
         return Output(instruments, metadata=metadata)
 
+    # (0) Harmonize the Bloomberg Yellow Codes - unknown codes are kept as they are
+    yellow_keys = Harmonizer.yellow_keys(load_aliases(mongo.harmonization_aliases, "yellow_keys"))
+    instruments["yellow_key_code"] = yellow_keys.resolve(instruments["yellow_key_code"]).fillna(instruments["yellow_key_code"])
+    metadata["learned_yellow_keys"] = save_aliases(mongo.harmonization_aliases, "yellow_keys", yellow_keys.learned)
+    metadata["suggested_yellow_keys"] = save_aliases(mongo.harmonization_aliases, "yellow_keys", yellow_keys.suggested, reviewed=False)
+    context.log.info("Harmonized Yellow Codes")
+
     # (1) Equities have the same underlying security name + bbg_code
     query = instruments["yellow_key_code"].isin(["Equity"])
     instruments.loc[query, "underlying_security_name"] = instruments.loc[query, "security_name"]
@@ -64,13 +85,15 @@ def processed_portfolio(context: AssetExecutionContext, instruments: pd.DataFram
     context.log.info(f"Normalized Equities")
     
     # (2) Fill missing Bloomberg Yellow Codes
-    for security_name, yellow_code in constants.MISSING_YELLOW_CODES.items():
-        query = instruments["security_name"].fillna("").str.upper().str.startswith(security_name)
-        instruments.loc[query, "yellow_key_code"] = yellow_code
-        metadata[security_name] = int(query.sum())
+    matched = prefix_match(instruments["security_name"], constants.MISSING_YELLOW_CODES.keys())
+    query = matched.notna()
+    instruments.loc[query, "yellow_key_code"] = matched.loc[query].map(constants.MISSING_YELLOW_CODES)
+
+    for security_name in constants.MISSING_YELLOW_CODES.keys():
+        metadata[security_name] = int((matched == security_name).sum())
         context.log.info(f"Normalized {security_name}S")
 
-    metadata["preview"] = MarkdownMetadataValue(instruments.head(20).to_markdown(index=False))
+    metadata.update(preview(context, lambda rows: instruments.head(rows)))
     
     return Output(instruments, metadata=metadata)
 
@@ -80,35 +103,23 @@ def processed_portfolio(context: AssetExecutionContext, instruments: pd.DataFram
     compute_kind="Pandas",
     description="Remove all FIGI duplicates",
     group_name="Security_Master_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "instruments": AssetIn("processed_portfolio")
     }
 )
+@instrumented
 def unique_instruments(context: AssetExecutionContext, instruments: pd.DataFrame) -> Output:
 
     if len(instruments) == 0:
         return Output(instruments)
 
-    figi_count = instruments.assign(count=1).groupby("figi_code").sum(["count"]).sort_values("count", ascending=False).reset_index().copy()
-    figi_duplicates = figi_count.loc[figi_count["count"] > 1, "figi_code"].to_list()
-    
-    duplicated = {}
-
-    for figi_code in figi_duplicates:
-
-        query = instruments["figi_code"] == figi_code
-        current: pd.DataFrame = instruments.loc[query].reset_index(drop=True).copy()
-
-        # Get the FIGI with the lowest number of NaNs
-        min_index = current.isna().sum(axis=1).idxmin()
-        duplicated[figi_code] = current.iloc[min_index].to_frame().T.reset_index(drop=True).copy()
-        context.log.info(f"Removed duplicates for {figi_code}")
-
-    instruments = instruments.loc[~instruments["figi_code"].isin(list(duplicated.keys()))].reset_index(drop=True)
-    instruments = pd.concat([instruments, *list(duplicated.values())], ignore_index=True).dropna(subset="yellow_key_code")
+    # Keep the FIGI with the lowest number of NaNs
+    instruments, duplicates = get_transforms(context).unique_figis(instruments)
+    context.log.info(f"Removed the duplicates of {duplicates} FIGI(s)")
 
     metadata = {
-        "duplicates": len(figi_duplicates)
+        "duplicates": duplicates
     }
     return Output(instruments, metadata=metadata)
 
@@ -118,8 +129,10 @@ def unique_instruments(context: AssetExecutionContext, instruments: pd.DataFrame
     compute_kind="Pandas",
     description="Assign a country name for every security",
     group_name="Security_Master_Upload",
+    partitions_def=partitions.date_fund_partitions,
 )
-def portfolio_security_master(unique_instruments: pd.DataFrame, country_codes: pd.DataFrame) -> Output:
+@instrumented
+def portfolio_security_master(context: AssetExecutionContext, unique_instruments: pd.DataFrame, country_codes: pd.DataFrame) -> Output:
 
     metadata = {
         "uploaded": len(unique_instruments) > 0,
@@ -128,9 +141,13 @@ def portfolio_security_master(unique_instruments: pd.DataFrame, country_codes: p
     if len(unique_instruments) == 0:
         return Output(pd.DataFrame(), metadata=metadata)
 
-    data = unique_instruments.merge(country_codes, "left", "issuer_country_code").copy()
+    country_codes = country_codes.rename(columns={
+        "country_name": "issuer_country",
+        "country_code": "issuer_country_code"
+    })
+    data = unique_instruments.merge(country_codes, "left", "issuer_country_code")
 
-    metadata["preview"] = MarkdownMetadataValue(data.head(20).to_markdown(index=False))
+    metadata.update(preview(context, lambda rows: data.head(rows)))
     
     return Output(data, metadata=metadata)
 
@@ -138,35 +155,79 @@ def portfolio_security_master(unique_instruments: pd.DataFrame, country_codes: p
 
 @asset(
     compute_kind="Mongodb",
-    description="Assign a country name for every security",
+    description="Insert the new securities and update the changed ones in the security master (one document per security)",
     group_name="Security_Master_Upload",
+    partitions_def=partitions.date_fund_partitions,
 )
-def new_securities(context: AssetExecutionContext, portfolio_security_master: pd.DataFrame, mongo: Mongo) -> Output:
+@instrumented
+def new_securities(context: AssetExecutionContext, portfolio_security_master: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
     collection = mongo.security_master
-    new_secs = []
-    
-    for row in portfolio_security_master.to_dict("records"):
-
-        row = {key: value if pd.notna(value) else None for key, value in row.items()}
-        
-        results = collection.count_documents(row)
-        
-        if results > 0:
-            continue
-        
-        context.log.info(f"Added {row}")
-        row["upload_timestamp"] = datetime.datetime.now()
-        new_secs.append(row)
-        
-    if new_secs:
-        context.log.info(f"Added {len(new_secs)} row(s)")
-        collection.insert_many(new_secs)
+
+    # Keyed by FIGI (or the fallback identifier) - only the inserts and the changed fields are written
+    counts, written = upsert_securities(mongo, portfolio_security_master.to_dict("records"))
+    context.log.info(f"Inserted {counts['inserted']} and updated {counts['updated']} security(ies), {counts['unchanged']} unchanged")
+
+    if counts["conflicts"]:
+        context.log.warning(f"{counts['conflicts']} security(ies) were changed by another run and were skipped")
 
     metadata = {
-        "uploaded": len(new_secs) > 0,
-        "rows": len(new_secs),
+        "uploaded": len(written) > 0,
+        "rows": len(written),
+        **counts,
         "collection": f"{collection.database.name}/{collection.name}"
     }
 
-    return MaterializeResult(metadata=metadata)
\ No newline at end of file
+    return MaterializeResult(metadata=metadata)
+
+
+
+@asset(
+    compute_kind="DuckDB",
+    description="Build the security master rows of a portfolio upload out of core and insert the new ones (same rows as `new_securities`)",
+    group_name="Security_Master_DuckDB",
+    partitions_def=partitions.date_fund_partitions,
+    ins={
+        "data": AssetIn("uploaded_raw_portfolios", metadata={"columns": [*INSTRUMENT_COLUMN_MAPPINGS.keys(), "nt_quantity"]})
+    }
+)
+@instrumented
+def duckdb_security_master(context: AssetExecutionContext, data: pd.DataFrame, country_codes: pd.DataFrame, mongo: Mongo, duckdb: DuckDB) -> MaterializeResult:
+
+    collection = mongo.security_master
+    snapshot_dir = duckdb.snapshot_path
+
+    metadata = {
+        "rows": len(data),
+        "collection": f"{collection.database.name}/{collection.name}"
+    }
+    if len(data) == 0:
+        return MaterializeResult(metadata={**metadata, "uploaded": False})
+
+    # The existing securities are compared with the Parquet snapshot instead of one Mongo query per row - the snapshot
+    # is synced with everything written to the security master since the last run (by any writer / host) first
+    metadata["synced"] = duckdb_master.sync_snapshot(collection, snapshot_dir)
+    context.log.info(f"Synced {metadata['synced']} security(ies) to the snapshot {snapshot_dir}")
+
+    with duckdb.connect() as connection:
+
+        table, build_metadata = duckdb_master.build_security_master(
+            connection, data, country_codes, INSTRUMENT_COLUMN_MAPPINGS, mongo.harmonization_aliases
+        )
+        metadata.update(build_metadata)
+        context.log.info(f"Built the security master rows of {build_metadata['instruments']} instrument(s)")
+
+        changes = duckdb_master.changed_securities(connection, table, snapshot_dir)
+        counts = duckdb_master.upload_changes(connection, changes, mongo, snapshot_dir)
+        context.log.info(f"Inserted {counts['inserted']} and updated {counts['updated']} security(ies) of {len(changes)} changed row(s)")
+
+        metadata["snapshot_parts"] = duckdb_master.compact_snapshot(connection, snapshot_dir)
+
+    metadata.update({
+        "uploaded": counts["inserted"] + counts["updated"] > 0,
+        "changed": len(changes),
+        **counts
+    })
+    metadata.update(preview(context, lambda rows: changes.head(rows)))
+
+    return MaterializeResult(metadata=metadata)
@@ -1,7 +1,13 @@
-from dagster import asset, Output, AssetExecutionContext, AssetIn, MarkdownMetadataValue, MaterializeResult
+from dagster import asset, Output, AssetExecutionContext, AssetIn, MaterializeResult
 from ..resources import Mongo
-from ..configs import RawFilesConfig
-from .. import constants
+from ..configs import RawUploadConfig
+from ..operations.harmonization import Harmonizer, load_aliases, save_aliases
+from ..operations.files import load_files, load_folder
+from .. import partitions
+from ..operations.instrumentation import instrumented
+from ..operations.metadata import preview, summary
+from ..operations.engine import get_transforms
+from ..operations.transforms import categorize
 import numpy as np
 import pandas as pd
 import os
@@ -10,24 +16,45 @@ import datetime
 @asset(
     compute_kind="Pandas",
     description="Load the trades data into a DataFrame.",
-    group_name="Trades_Upload"
+    group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions
 )
-def trades_file_data(context: AssetExecutionContext, config: RawFilesConfig) -> Output:
+@instrumented
+def trades_file_data(context: AssetExecutionContext, config: RawUploadConfig, mongo: Mongo) -> Output:
     
-    is_csv = config.file_path.endswith(".csv")
-    data = pd.read_csv(config.file_path) if is_csv else pd.read_excel(config.file_path)
+    if config.folder_path:
+        data, files = load_folder(context, mongo.file_registry, config.folder_path, "trades", config.max_workers)
+        file_names = [file["file_name"] for file in files]
+    else:
+        data, _ = load_files(context, mongo.file_registry, [config.file_path], "trades")
+        file_names = [os.path.basename(config.file_path)]
+
+    context.log.info(f"Opened file(s) {'; '.join(file_names)}")
 
-    context.log.info(f"Opened file {os.path.basename(config.file_path)}")
+    if len(data) == 0:
+        context.log.info("No new rows - the file(s) have already been uploaded")
+        return Output(data, metadata={"rows": 0, "file_name": "; ".join(file_names)})
 
+    # The only de-duplication of the trades - the later steps get unique rows
     initial_rows = len(data)
     data = data.dropna(subset="nt_trade_date").drop_duplicates()
     context.log.info(f"Dropped duplicates (from {initial_rows} to {len(data)})")
 
+    # Keep only the rows of the current trade date / fund partition (+ the rows without a known fund code in
+    # the catch-all partition)
+    trade_dates = pd.to_datetime(data["nt_trade_date"], format="%m/%d/%Y %H:%M:%S")
+    data = categorize(data.loc[partitions.partition_mask(context, trade_dates, data["nt_fund_code"])].reset_index(drop=True))
+
+    unknown_funds = int(partitions.unknown_funds(data["nt_fund_code"]).sum())
+    if unknown_funds:
+        context.log.warning(f"{unknown_funds} row(s) without a known fund code")
+
     metadata = {
         "rows": len(data),
-        "preview": MarkdownMetadataValue(data.head(20).to_markdown(index=False)),
-        "file_name": os.path.basename(config.file_path),
-        "fund_codes": "; ".join(data["nt_fund_code"].unique())
+        "unknown_funds": unknown_funds,
+        "file_name": "; ".join(file_names),
+        **preview(context, lambda rows: data.head(rows)),
+        **summary(context, lambda: data["nt_fund_code"].dropna().unique(), "fund_codes")
     }
 
     return Output(data, metadata=metadata)
@@ -38,38 +65,27 @@ def trades_file_data(context: AssetExecutionContext, config: RawFilesConfig) ->
     compute_kind="Pandas",
     description="Filter out the trades that have a price or quantity 0 / NaN. If a trade has the date but a different price, the trades are filtered out as well.",
     group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("trades_file_data")
     }
 )
+@instrumented
 def filter_trades_data(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
 
-    # Price / Quantity is NaN or 0
-    query = data["nt_transaction_quantity"].isna() | data["nt_transaction_price"].isna() | (data["nt_transaction_quantity"] == 0) | (data["nt_transaction_price"] == 0)
+    if len(data) == 0:
+        context.log.info("No data found...")
+        return Output((data, pd.DataFrame()), metadata={"total": 0})
 
     metadata = {
         "total": len(data)
     }
-    missing = data.loc[query].drop_duplicates().reset_index(drop=True).copy()
-    data = data.loc[~query].drop_duplicates().reset_index(drop=True).copy()
 
-    # Price for the same date is different
-    index_duplicates = []
-    for (bbg_code, ccy), group in data.groupby(["nt_bloomberg_code", "nt_security_currency"]):
-        transactions = group[["nt_trade_date", "nt_security_currency", "nt_transaction_price"]].copy()
+    # Price / Quantity is NaN or 0, or the price for the same date is different
+    data, missing, conflicting = get_transforms(context).trade_filter(data)
+    if len(conflicting) > 0:
+        context.log.info(conflicting[["nt_bloomberg_code", "nt_trade_date", "nt_security_currency", "nt_transaction_price"]].to_string(index=False))
 
-        duplicates = transactions["nt_trade_date"].duplicated(keep=False) & (~transactions["nt_transaction_price"].duplicated(keep=False))
-        if duplicates.sum() == 0:
-            continue
-        
-        context.log.info(transactions.loc[duplicates].to_string(index=False))
-        index_duplicates += transactions.loc[duplicates].index.to_list()
-    
-    if index_duplicates:
-        index_duplicates = list(set(index_duplicates))
-        missing = pd.concat([missing, data.iloc[index_duplicates]], ignore_index=True).drop_duplicates()
-
-    data = data.drop(index=index_duplicates).drop_duplicates().reset_index(drop=True)
     metadata.update({
         "missing": len(missing),
         "data": len(data),
@@ -83,10 +99,12 @@ def filter_trades_data(context: AssetExecutionContext, data: pd.DataFrame) -> Ou
     compute_kind="Pandas",
     description="Prepare the raw data to be uploaded.",
     group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
-        "trades": AssetIn("filter_trades_data")
+        "trades": AssetIn("filter_trades_data", metadata={"parts": [0]})
     }
 )
+@instrumented
 def trades_raw_processed_data(context: AssetExecutionContext, trades: tuple[pd.DataFrame, pd.DataFrame]) -> Output:
 
     data, _ = trades
@@ -95,36 +113,54 @@ def trades_raw_processed_data(context: AssetExecutionContext, trades: tuple[pd.D
         context.log.info("No data found...")
         return Output(pd.DataFrame())
     
-    data = data.drop_duplicates().reset_index(drop=True)
-
-    data = data.assign(
-        nx_date = pd.to_datetime(data["nx_date"], format="%m/%d/%Y"),
-        nt_accounting_date = pd.to_datetime(data["nx_date"], format="%m/%d/%Y"),
-        nt_trade_date = pd.to_datetime(data["nt_trade_date"], format="%m/%d/%Y %H:%M:%S")
-    )
-    context.log.info("Fixed date column")
-
-    id = data["nt_trade_date"].dt.strftime("%Y-%m-%d") + "/" + data["nt_accounting_date"].dt.strftime("%Y-%m-%d") + "/"+ data["nt_fund_code"] + "/" + data["nt_gti_code"] + "/" + data["nt_security_description"].str.replace(" ", "_") + "/" + data["nt_security_currency"] + "/" + data["nt_transaction_price"].astype(str) + "(" + data["nt_transaction_quantity"].astype(str).str.replace("-", "NEG") + ")"
-    data.insert(0, "id", id)
-    context.log.info("Created unique ID")
+    data = get_transforms(context).trade_ids(data)
+    context.log.info("Fixed date columns and created unique ID")
 
     data["upload_timestamp"] = datetime.datetime.now()
     metadata = {
-        "preview": MarkdownMetadataValue(data.head(20).to_markdown(index=False))
+        "rows": len(data),
+        **preview(context, lambda rows: data.head(rows))
     }
 
     return Output(data, metadata=metadata)
 
 
+def previous_prices(mongo: Mongo, data: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """
+    Get the prices of the previous business day (from `processed.prices`) of the traded securities
+
+    Parameters:
+        - `mongo` - the Mongo resource
+        - `data` - the trades of the partition (`trade_date`, `bloomberg_code`)
+
+    Output:
+        - the Bloomberg Code to its last price of the business day before the first trade date (`trade_date`, `bloomberg_code`,
+          `transaction_price`) - securities without a price that day are left out
+    """
+    previous_date = data["trade_date"].min() - pd.offsets.BDay()
+    query = {"date": previous_date.to_pydatetime(), "bbg_code": {"$in": data["bloomberg_code"].dropna().unique().tolist()}}
+
+    prices = pd.DataFrame(list(mongo.prices.find(query, {"_id": 0, "date": 1, "bbg_code": 1, "price": 1})), columns=["date", "bbg_code", "price"])\
+                .rename(columns={"date": "trade_date", "bbg_code": "bloomberg_code", "price": "transaction_price"})\
+                .dropna(subset="transaction_price")\
+                .drop_duplicates(subset="bloomberg_code", keep="last")
+
+    prices["trade_date"] = pd.to_datetime(prices["trade_date"])
+    return {bbg_code: price for bbg_code, price in prices.groupby("bloomberg_code")}
+
+
+
 @asset(
     compute_kind="Pandas",
     description="Prepare the raw data to be uploaded.",
     group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("uploaded_raw_trades")
     }
 )
-def new_trades_columns(context: AssetExecutionContext, data: pd.DataFrame) -> Output:
+@instrumented
+def new_trades_columns(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo) -> Output:
 
     if len(data) == 0:
         context.log.info("No data found...")
@@ -140,10 +176,14 @@ def new_trades_columns(context: AssetExecutionContext, data: pd.DataFrame) -> Ou
     data.loc[data["transaction_quantity"] < 0, "long_short"] = "short"
     context.log.info("Added long/short")
 
-    data["issuer_country_code"] = data["issuer_country_name"].map(constants.TRADES_COUNTRY_MAPPING)
-    context.log.info("Added country code")
+    countries = Harmonizer.countries(load_aliases(mongo.harmonization_aliases, "countries"))
+    data["issuer_country_code"] = countries.resolve(data["issuer_country_name"])
+    learned = save_aliases(mongo.harmonization_aliases, "countries", countries.learned)
+    suggested = save_aliases(mongo.harmonization_aliases, "countries", countries.suggested, reviewed=False)
+    context.log.info(f"Added country code ({learned} new country alias(es) learned, {suggested} fuzzy match(es) to review)")
 
     columns = ["trade_date", "bloomberg_code", "transaction_price"]
+    previous = previous_prices(mongo, data)
     prices = []
     
     for bbg_code, group in data.groupby("bloomberg_code"):
@@ -151,19 +191,21 @@ def new_trades_columns(context: AssetExecutionContext, data: pd.DataFrame) -> Ou
         start_date = group["trade_date"].min()
         end_date = group["trade_date"].max()
 
-        historical = pd.bdate_range(start_date, end_date)\
+        # The partition only holds one trade date - the change is computed from the previous business day's price
+        group = pd.concat([previous.get(bbg_code), group[columns]], ignore_index=True)
+
+        historical = pd.bdate_range(start_date - pd.offsets.BDay(), end_date)\
                     .to_frame(name="trade_date")\
                     .reset_index(drop=True)\
                     .merge(group, "left", "trade_date")[columns]\
-                    .drop_duplicates()\
-                    .copy()
+                    .drop_duplicates()
         
         historical = historical.assign(
             pct_change = historical["transaction_price"].fillna(0).pct_change().apply(lambda value: None if value == np.inf else value)
-        ).dropna(subset="bloomberg_code")\
-        .reset_index(drop=True)
+        ).dropna(subset="bloomberg_code")
+        historical = historical.loc[historical["trade_date"] >= start_date].reset_index(drop=True)
         
-        prices.append(historical.copy())
+        prices.append(historical)
 
     prices = pd.concat(prices, ignore_index=True)
     data = data.merge(prices, "left", columns)
@@ -177,10 +219,12 @@ def new_trades_columns(context: AssetExecutionContext, data: pd.DataFrame) -> Ou
     compute_kind="Pandas",
     description="Prepare the raw data to be uploaded.",
     group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
         "data": AssetIn("new_trades_columns")
     }
 )
+@instrumented
 def new_processed_trades(context: AssetExecutionContext, data: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
     collection = mongo.processed_trades
@@ -204,10 +248,12 @@ def new_processed_trades(context: AssetExecutionContext, data: pd.DataFrame, mon
     compute_kind="Mongodb",
     description="Prepare the raw data to be uploaded.",
     group_name="Trades_Upload",
+    partitions_def=partitions.date_fund_partitions,
     ins={
-        "trades": AssetIn("new_trades_columns")
+        "trades": AssetIn("new_trades_columns", metadata={"columns": ["trade_date", "bloomberg_code", "transaction_price", "security_currency", "issuer_country_code"]})
     }
 )
+@instrumented
 def new_prices(context: AssetExecutionContext, trades: pd.DataFrame, mongo: Mongo) -> MaterializeResult:
 
     collection = mongo.prices
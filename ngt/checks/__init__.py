@@ -0,0 +1,90 @@
+from dagster import AssetCheckExecutionContext
+from typing import Optional
+from ..operations.validation import Rule, validate
+from .. import partitions
+import pymongo.collection
+import pandas as pd
+import datetime
+
+def get_check_scope(context: AssetCheckExecutionContext) -> Optional[dict]:
+    """
+    Get the partition that the checked asset has just written (`None` if the run is not partitioned)
+
+    Parameters:
+        - `context` - the check's execution context
+
+    Output:
+        - see `partitions.get_partition_scope`
+    """
+    return partitions.get_run_partition_scope(context.run.tags)
+
+
+
+def get_run_start(context: AssetCheckExecutionContext) -> datetime.datetime:
+    """
+    Get the time the current run started (local time, like the `upload_timestamp`s)
+
+    Parameters:
+        - `context` - the check's execution context
+
+    Output:
+        - the start time
+    """
+    record = context.instance.get_run_record_by_id(context.run_id)
+    start_time = record.start_time or record.create_timestamp.timestamp()
+
+    return datetime.datetime.fromtimestamp(start_time)
+
+
+
+def duplicated_keys(collection: pymongo.collection.Collection, query: dict, keys: list[str], limit: int = 20) -> tuple[int, list[dict]]:
+    """
+    Find the key values that appear more than once
+
+    Parameters:
+        - `collection` - the checked collection
+        - `query` - the scope of the check (e.g. the partition)
+        - `keys` - the fields that must be unique together
+        - `limit` - the maximum number of returned samples
+
+    Output:
+        - the number of duplicated key values and a sample of them
+    """
+    pipeline = [
+        {"$match": query},
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "sample": [{"$limit": limit}]
+        }}
+    ]
+    result = next(collection.aggregate(pipeline), {"total": [], "sample": []})
+
+    total = result["total"][0]["count"] if result["total"] else 0
+    sample = [{**document["_id"], "count": document["count"]} for document in result["sample"]]
+
+    return total, sample
+
+
+
+def validate_documents(collection: pymongo.collection.Collection, query: dict, rules: list[Rule]) -> tuple[int, pd.DataFrame]:
+    """
+    Run the validation rules against the documents of a scope
+
+    Parameters:
+        - `collection` - the checked collection
+        - `query` - the scope of the check (e.g. the partition)
+        - `rules` - the rules
+
+    Output:
+        - the number of checked documents and the failure matrix (see `validate`)
+    """
+    project = {"_id": 0, **{rule.column: 1 for rule in rules}}
+    data = pd.DataFrame(collection.find(query, project))
+
+    # Fields that are missing in every document still need their column
+    data = data.reindex(columns=list(dict.fromkeys(rule.column for rule in rules)))
+    failures, _ = validate(data, rules)
+
+    return len(data), failures
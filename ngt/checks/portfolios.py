@@ -0,0 +1,69 @@
+from dagster import asset_check, AssetCheckExecutionContext, AssetCheckResult, AssetCheckSeverity, MetadataValue
+from ..resources import Mongo
+from ..operations.validation import PORTFOLIO_RULES, PORTFOLIO_DATE_RULES, rule_counts
+from .. import partitions
+from . import get_check_scope, duplicated_keys, validate_documents
+import pandas as pd
+
+@asset_check(
+    asset="new_raw_portfolios_data",
+    description="Every raw portfolio id of the partition is unique"
+)
+def raw_portfolio_id_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    query = partitions.scope_query(get_check_scope(context), "date", "nt_pool_fund_code")
+    duplicates, sample = duplicated_keys(mongo.raw_portfolio, query, ["id"])
+
+    return AssetCheckResult(
+        passed=duplicates == 0,
+        metadata={
+            "duplicates": duplicates,
+            "sample": MetadataValue.md(pd.DataFrame(sample).to_markdown(index=False)) if sample else ""
+        }
+    )
+
+
+
+@asset_check(
+    asset="new_portfolio_data",
+    description="Every processed portfolio id of the partition is unique"
+)
+def processed_portfolio_id_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    collection = mongo.processed_portfolio
+    collection.create_index([("date", 1), ("pool_fund_code", 1), ("id", 1)])
+
+    query = partitions.scope_query(get_check_scope(context), "date", "pool_fund_code")
+    duplicates, sample = duplicated_keys(collection, query, ["id"])
+
+    return AssetCheckResult(
+        passed=duplicates == 0,
+        metadata={
+            "duplicates": duplicates,
+            "sample": MetadataValue.md(pd.DataFrame(sample).to_markdown(index=False)) if sample else ""
+        }
+    )
+
+
+
+@asset_check(
+    asset="new_portfolio_data",
+    description="The processed portfolios of the partition pass the HITL rules and have sane dates"
+)
+def processed_portfolio_rules(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    # Same rules as `filter_portfolios_data` - nothing that fails them should have been uploaded
+    query = partitions.scope_query(get_check_scope(context), "date", "pool_fund_code")
+    rows, failures = validate_documents(mongo.processed_portfolio, query, PORTFOLIO_RULES + PORTFOLIO_DATE_RULES)
+
+    failed = int(failures.any(axis=1).sum())
+
+    return AssetCheckResult(
+        passed=failed == 0,
+        severity=AssetCheckSeverity.WARN,
+        metadata={
+            "rows": rows,
+            "failed": failed,
+            **rule_counts(failures)
+        }
+    )
@@ -0,0 +1,45 @@
+from dagster import asset_check, AssetCheckExecutionContext, AssetCheckResult, MetadataValue
+from ..resources import Mongo
+from . import get_run_start, duplicated_keys
+import pandas as pd
+
+def figi_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    collection = mongo.security_master
+    collection.create_index("upload_timestamp")
+
+    # Only the FIGIs that the run has written are checked against the whole security master
+    query = {"upload_timestamp": {"$gte": get_run_start(context)}, "figi_code": {"$ne": None}}
+    figis = collection.distinct("figi_code", query)
+
+    if not figis:
+        return AssetCheckResult(passed=True, metadata={"figis": 0, "duplicates": 0})
+
+    duplicates, sample = duplicated_keys(collection, {"figi_code": {"$in": figis}}, ["figi_code", "ccy"])
+
+    return AssetCheckResult(
+        passed=duplicates == 0,
+        metadata={
+            "figis": len(figis),
+            "duplicates": duplicates,
+            "sample": MetadataValue.md(pd.DataFrame(sample).to_markdown(index=False)) if sample else ""
+        }
+    )
+
+
+
+@asset_check(
+    asset="new_securities",
+    description="The FIGIs added by the run are unique (per currency) in the security master"
+)
+def security_master_figi_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+    return figi_unique(context, mongo)
+
+
+
+@asset_check(
+    asset="duckdb_security_master",
+    description="The FIGIs added by the run are unique (per currency) in the security master"
+)
+def duckdb_security_master_figi_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+    return figi_unique(context, mongo)
@@ -0,0 +1,68 @@
+from dagster import asset_check, AssetCheckExecutionContext, AssetCheckResult, AssetCheckSeverity, MetadataValue
+from ..resources import Mongo
+from ..operations.validation import TRADES_DATE_RULES, rule_counts
+from .. import partitions
+from . import get_check_scope, duplicated_keys, validate_documents
+import pandas as pd
+
+@asset_check(
+    asset="new_raw_trades_data",
+    description="Every raw trade id of the partition is unique"
+)
+def raw_trades_id_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    query = partitions.scope_query(get_check_scope(context), "nt_trade_date", "nt_fund_code")
+    duplicates, sample = duplicated_keys(mongo.raw_trades, query, ["id"])
+
+    return AssetCheckResult(
+        passed=duplicates == 0,
+        metadata={
+            "duplicates": duplicates,
+            "sample": MetadataValue.md(pd.DataFrame(sample).to_markdown(index=False)) if sample else ""
+        }
+    )
+
+
+
+@asset_check(
+    asset="new_processed_trades",
+    description="Every processed trade id of the partition is unique"
+)
+def processed_trades_id_unique(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    collection = mongo.processed_trades
+    collection.create_index([("trade_date", 1), ("fund_code", 1), ("id", 1)])
+
+    query = partitions.scope_query(get_check_scope(context), "trade_date", "fund_code")
+    duplicates, sample = duplicated_keys(collection, query, ["id"])
+
+    return AssetCheckResult(
+        passed=duplicates == 0,
+        metadata={
+            "duplicates": duplicates,
+            "sample": MetadataValue.md(pd.DataFrame(sample).to_markdown(index=False)) if sample else ""
+        }
+    )
+
+
+
+@asset_check(
+    asset="new_processed_trades",
+    description="The processed trades of the partition have sane trade / accounting dates"
+)
+def processed_trades_dates(context: AssetCheckExecutionContext, mongo: Mongo) -> AssetCheckResult:
+
+    query = partitions.scope_query(get_check_scope(context), "trade_date", "fund_code")
+    rows, failures = validate_documents(mongo.processed_trades, query, TRADES_DATE_RULES)
+
+    failed = int(failures.any(axis=1).sum())
+
+    return AssetCheckResult(
+        passed=failed == 0,
+        severity=AssetCheckSeverity.WARN,
+        metadata={
+            "rows": rows,
+            "failed": failed,
+            **rule_counts(failures)
+        }
+    )
@@ -5,14 +5,28 @@ from typing import Union, Optional
 class RawFilesConfig(Config):
     file_path: str = Field(description="The full file path of the portfolio file")
 
+class RawUploadConfig(RawFilesConfig):
+    file_path: Optional[str] = Field(default=None, description="The full file path of the raw file. Ignored if `folder_path` is given")
+    folder_path: Optional[str] = Field(default=None, description="The landing folder - all new files in it are uploaded as one batch")
+    max_workers: int = Field(default=4, description="The maximum number of processes used to read the landing folder's files")
+
 class Figi(Config):
     code: str = Field(description="The figi that will be looked up")
     ccy: Optional[str] = Field(description="The figi's currency that will be used as part of the search")
+    lease_id: Optional[str] = Field(default=None, description="The FIGI queue lease that the figi was claimed with")
 
 class FigiConfig(Config):
     figis: list[Figi] = Field(default=[], description="The figis that will be used to fetch additional data for the security master")
+    server_side: bool = Field(default=False, description="Join the OpenFIGI data into the security master inside the database ($merge)")
 
 class EmailConfig(Config):
     to: list[str] = Field(description="The TO emails")
     cc: Optional[list[str]] = Field(default=None, description="The CC emails")
-    file_path: Optional[str] = Field(default=None, description="The file that will be attached")
\ No newline at end of file
+    file_path: Optional[str] = Field(default=None, description="The file that will be attached")
+    digest: bool = Field(default=True, description="Leave the email to the periodic HITL digest instead of sending it straight away")
+
+class DigestConfig(Config):
+    to: list[str] = Field(description="The TO emails")
+    cc: Optional[list[str]] = Field(default=None, description="The CC emails")
+    folder_path: str = Field(description="The folder that the digest files are saved in")
+    extension: str = Field(default=".csv", description="The format of the digest files (.csv, .parquet or .xlsx)")
\ No newline at end of file
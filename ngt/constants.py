@@ -1,3 +1,5 @@
+import os
+
 MISSING_YELLOW_CODES = {
     "INTEREST RATE SWAP": "IRS",
     "PUT": "OPT",
@@ -7,6 +9,66 @@ MISSING_YELLOW_CODES = {
 
 HITL_PATH = r"C:\Users\Nikolai\Documents\GitHub\NGT-Financial-Data-Engineer\ngt\data\hitl"
 
+# When the new faulty rows are emailed (see `hitl_digest_schedule`)
+HITL_DIGEST_CRON = "0 9,13,17 * * 1-5"
+HITL_DIGEST_QUIET = 60 * 10 # The streamed digest waits until no new faulty row has arrived for 10 min
+HITL_DIGEST_MIN_INTERVAL = 60 * 60 # and never runs more than once an hour
+
+FUND_CODES = ["NGT2754", "NGT6144"]
+
+PARTITIONS_START_DATE = "2023-12-01"
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+COUNTRY_NAMES_PATH = os.path.join(DATA_PATH, "country_names.csv")
+
+# Bloomberg Yellow Keys (the same values are returned as `marketSector` by OpenFIGI)
+YELLOW_KEY_CODES = [
+    "Comdty", "Corp", "Curncy", "Equity", "Govt", "Index", "M-Mkt", "Mtge", "Muni", "Pfd",
+    *sorted(set(MISSING_YELLOW_CODES.values()))
+]
+
+# Bloomberg exchange code (e.g. "TSLA UW") to the country of the exchange
+BLOOMBERG_EXCHANGE_COUNTRIES = {
+    "US": "US", "UN": "US", "UW": "US", "UQ": "US", "UA": "US", "UR": "US", "UP": "US",
+    "CN": "CA", "CT": "CA", "CV": "CA",
+    "LN": "GB",
+    "JP": "JP", "JT": "JP",
+    "AU": "AU", "AT": "AU",
+    "NZ": "NZ",
+    "HK": "HK",
+    "SP": "SG",
+    "SW": "CH", "SE": "CH",
+    "FP": "FR",
+    "GR": "DE", "GY": "DE",
+    "NA": "NL",
+    "IM": "IT",
+    "SM": "ES", "SQ": "ES",
+    "SS": "SE",
+    "DC": "DK",
+    "NO": "NO",
+    "FH": "FI",
+    "BB": "BE",
+    "AV": "AT",
+    "PL": "PT",
+    "ID": "IE"
+}
+
+# OpenFIGI work queue - a leased FIGI becomes available again after the visibility timeout,
+# a failed FIGI is retried after BACKOFF * 2^(attempts - 1) seconds and dead-lettered after MAX_ATTEMPTS
+FIGI_QUEUE_VISIBILITY_TIMEOUT = 60 * 10
+FIGI_QUEUE_BACKOFF = 60
+FIGI_QUEUE_MAX_ATTEMPTS = 5
+
+# The OpenFIGI sensors stand down while the OpenFIGI worker has sent a heartbeat within this many seconds
+# (both would spend the same API rate limit)
+FIGI_WORKER_HEARTBEAT_TIMEOUT = 60 * 5
+
+# Email outbox - same semantics as the OpenFIGI queue
+EMAIL_OUTBOX_VISIBILITY_TIMEOUT = 60 * 5
+EMAIL_OUTBOX_BACKOFF = 30
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+
 TRADES_COUNTRY_MAPPING = {
     'AUSTRALIA': 'AU',
     'AUSTRIA': 'AT',
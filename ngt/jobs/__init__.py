@@ -1,14 +1,19 @@
-from dagster import define_asset_job, AssetSelection, RunConfig, EnvVar
-from ..configs import RawFilesConfig, EmailConfig
+from dagster import define_asset_job, AssetSelection, RunConfig, EnvVar, in_process_executor
+from ..configs import RawFilesConfig, RawUploadConfig, EmailConfig, DigestConfig
 from .. import resources
 from .. import constants
+from .. import partitions
+from ..operations.metadata import METADATA_TAG
+from ..operations.engine import ENGINE_TAG
 import os
 
 portfolio_upload_job = define_asset_job(
     name="portfolio_upload_job",
+    tags={METADATA_TAG: "sampled"},
     selection=AssetSelection.groups("Portfolios_Upload") | AssetSelection.groups("Security_Master_Upload") | AssetSelection.groups("Country_Codes_Upload") | AssetSelection.assets("figi_queue", "inconsistent_portfolios_email", "inconsistent_portfolios_data"),
+    partitions_def=partitions.date_fund_partitions,
     config=RunConfig(ops={
-        "portfolios_file_data": RawFilesConfig(
+        "portfolios_file_data": RawUploadConfig(
             file_path=EnvVar("PORTFOLIO_FILE_PATH")
         ),
         "country_codes": RawFilesConfig(
@@ -16,7 +21,7 @@ portfolio_upload_job = define_asset_job(
         ),
         "inconsistent_portfolios_email": EmailConfig(
             to=constants.EMAILS["to"], 
-            file_path=os.path.join(constants.HITL_PATH, "Faulty Portfolios.xlsx")
+            file_path=os.path.join(constants.HITL_PATH, "Faulty Portfolios.csv")
         ),
     },
     resources={
@@ -33,12 +38,14 @@ portfolio_upload_job = define_asset_job(
 
 trades_upload_job = define_asset_job(
     name="trades_upload_job",
+    tags={METADATA_TAG: "sampled"},
     selection=AssetSelection.groups("Trades_Upload") | AssetSelection.groups("Price_Upload") | AssetSelection.assets("inconsistent_trades_email", "inconsistent_trades_data"),
+    partitions_def=partitions.date_fund_partitions,
     config=RunConfig(ops={
-        "trades_file_data": RawFilesConfig(file_path=EnvVar("TRADES_FILE_PATH")),
+        "trades_file_data": RawUploadConfig(file_path=EnvVar("TRADES_FILE_PATH")),
         "inconsistent_trades_email": EmailConfig(
             to=constants.EMAILS["to"],
-            file_path=os.path.join(constants.HITL_PATH, "Faulty Trades.xlsx")
+            file_path=os.path.join(constants.HITL_PATH, "Faulty Trades.csv")
         ),
     },
     resources={
@@ -53,17 +60,92 @@ trades_upload_job = define_asset_job(
     })
 )
 
+# Same assets as `portfolio_upload_job` in one process - the DataFrames are passed in memory instead of through
+# files and no step pays for its own process. Every asset still gets its materialization / metadata.
+portfolio_fused_upload_job = define_asset_job(
+    name="portfolio_fused_upload_job",
+    tags={METADATA_TAG: "sampled"},
+    selection=portfolio_upload_job.selection,
+    partitions_def=partitions.date_fund_partitions,
+    executor_def=in_process_executor,
+    config=RunConfig(ops={
+        "portfolios_file_data": RawUploadConfig(
+            file_path=EnvVar("PORTFOLIO_FILE_PATH")
+        ),
+        "country_codes": RawFilesConfig(
+            file_path=EnvVar("COUNTRY_CODE_FILE_PATH")
+        ),
+        "inconsistent_portfolios_email": EmailConfig(
+            to=constants.EMAILS["to"], 
+            file_path=os.path.join(constants.HITL_PATH, "Faulty Portfolios.csv")
+        ),
+    },
+    resources={
+        "io_manager": resources.ArrowIOManager(memory=True)
+    })
+)
+
+# The landing folder jobs upload the biggest batches - only the counts are kept in the metadata, the
+# transformations run on the multi-threaded polars engine and the security master is built out of core (DuckDB)
+portfolio_folder_upload_job = define_asset_job(
+    name="portfolio_folder_upload_job",
+    tags={METADATA_TAG: "off", ENGINE_TAG: "polars"},
+    selection=(portfolio_upload_job.selection - AssetSelection.groups("Security_Master_Upload")) | AssetSelection.groups("Security_Master_DuckDB"),
+    partitions_def=partitions.date_fund_partitions,
+    config=RunConfig(ops={
+        "portfolios_file_data": RawUploadConfig(
+            folder_path=EnvVar("PORTFOLIO_FOLDER_PATH")
+        ),
+        "country_codes": RawFilesConfig(
+            file_path=EnvVar("COUNTRY_CODE_FILE_PATH")
+        ),
+        "inconsistent_portfolios_email": EmailConfig(
+            to=constants.EMAILS["to"], 
+            file_path=os.path.join(constants.HITL_PATH, "Faulty Portfolios.csv")
+        ),
+    })
+)
+
+trades_folder_upload_job = define_asset_job(
+    name="trades_folder_upload_job",
+    tags={METADATA_TAG: "off", ENGINE_TAG: "polars"},
+    selection=trades_upload_job.selection,
+    partitions_def=partitions.date_fund_partitions,
+    config=RunConfig(ops={
+        "trades_file_data": RawUploadConfig(folder_path=EnvVar("TRADES_FOLDER_PATH")),
+        "inconsistent_trades_email": EmailConfig(
+            to=constants.EMAILS["to"],
+            file_path=os.path.join(constants.HITL_PATH, "Faulty Trades.csv")
+        ),
+    })
+)
+
 open_figi_download_job = define_asset_job(
     name="open_figi_download_job",
+    tags={METADATA_TAG: "full"},
     selection=["new_figis"]
 )
 
 security_master_figi_update_job = define_asset_job(
     name="security_master_figi_update_job",
+    tags={METADATA_TAG: "full"},
     selection=["figi_security_master"]
 )
 
 upload_fixed_portfolio_data = define_asset_job(
     name="upload_fixed_portfolio_data",
+    tags={METADATA_TAG: "full"},
     selection=["fixed_inconsistent_portfolio_data"]
+)
+
+hitl_digest_job = define_asset_job(
+    name="hitl_digest_job",
+    tags={METADATA_TAG: "full"},
+    selection=["inconsistent_digest_email"],
+    config=RunConfig(ops={
+        "inconsistent_digest_email": DigestConfig(
+            to=constants.EMAILS["to"],
+            folder_path=os.path.join(constants.HITL_PATH, "digest")
+        )
+    })
 )
\ No newline at end of file
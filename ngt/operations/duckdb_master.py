@@ -0,0 +1,311 @@
+from .harmonization import Harmonizer, load_aliases, save_aliases
+from .security_master import SECURITY_ATTRIBUTES, security_key, upsert_securities
+from ..resources import Mongo
+from .. import constants
+import pymongo.collection
+import pandas as pd
+import datetime
+import glob
+import json
+import uuid
+import os
+
+# The columns of a built security master row
+MASTER_COLUMNS = SECURITY_ATTRIBUTES
+
+# The Parquet snapshot holds every written version of a security (the latest one is the current state)
+SNAPSHOT_COLUMNS = ["security_key", "version", "upload_timestamp", *MASTER_COLUMNS]
+
+# Same as `security_master.security_key`
+SECURITY_KEY_SQL = """
+    CASE
+        WHEN figi_code IS NOT NULL THEN figi_code
+        WHEN bbg_code IS NOT NULL THEN 'bbg:' || bbg_code || coalesce('/' || underlying_bbg_code, '')
+        ELSE 'name:' || coalesce(security_name, '') || '/' || coalesce(ccy, '')
+    END
+"""
+
+# The snapshot is rewritten as one file once it has more parts than this (every run appends up to two parts)
+MAX_SNAPSHOT_PARTS = 64
+
+# Every sync re-reads the securities written this long before the last sync - the writers stamp `upload_timestamp`
+# with their own clock (another host, a write that was committed a while after its timestamp)
+SNAPSHOT_OVERLAP = datetime.timedelta(hours=1)
+
+def snapshot_glob(snapshot_dir: str) -> str:
+    return os.path.join(snapshot_dir, "*.parquet")
+
+
+
+def watermark_path(snapshot_dir: str) -> str:
+    return os.path.join(snapshot_dir, "watermark.json")
+
+
+
+def snapshot_row(security: dict) -> dict:
+    """
+    Get the snapshot row of a security (the attributes as text like the built rows)
+    """
+    row = {column: None if security.get(column) is None else str(security[column]) for column in MASTER_COLUMNS}
+    return {
+        "security_key": security.get("security_key") or security_key(row),
+        "version": int(security.get("version") or 0),
+        "upload_timestamp": security.get("upload_timestamp"),
+        **row
+    }
+
+
+
+def latest_sql(source: str) -> str:
+    """
+    Get the query of the latest version of every security of the snapshot
+    """
+    return f"""
+        SELECT * FROM read_parquet({source}, union_by_name = true)
+        QUALIFY row_number() OVER (PARTITION BY security_key ORDER BY version DESC, upload_timestamp DESC NULLS LAST) = 1
+    """
+
+
+
+def sync_snapshot(collection: pymongo.collection.Collection, snapshot_dir: str, overlap: datetime.timedelta = SNAPSHOT_OVERLAP, batch_size: int = 100_000) -> int:
+    """
+    Bring the Parquet snapshot up to date with the security master - every security written since the last sync
+    (by any writer: `new_securities`, the FIGI enrichment, the runs of other hosts) is appended as one part in
+    batches (the master never has to fit in memory). The first sync of an empty folder exports the whole master.
+    The snapshot is only a pre-filter of `changed_securities` - Mongo stays the source of truth.
+
+    Parameters:
+        - `collection` - the security master collection
+        - `snapshot_dir` - the snapshot folder
+        - `overlap` - see `SNAPSHOT_OVERLAP`
+        - `batch_size` - the number of documents per row group
+
+    Output:
+        - the number of synced securities
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    started = datetime.datetime.now()
+
+    # Without a watermark (first sync / older snapshot) everything is read again
+    watermark = None
+    if os.path.exists(watermark_path(snapshot_dir)) and glob.glob(snapshot_glob(snapshot_dir)):
+        with open(watermark_path(snapshot_dir)) as file:
+            watermark = datetime.datetime.fromisoformat(json.load(file)["upload_timestamp"])
+
+    query = {} if watermark is None else {"upload_timestamp": {"$gte": watermark - overlap}}
+    types = {"version": pyarrow.int64(), "upload_timestamp": pyarrow.timestamp("ms")}
+    schema = pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in SNAPSHOT_COLUMNS])
+    path = os.path.join(snapshot_dir, f"sync-{started:%Y%m%d%H%M%S}-{uuid.uuid4().hex}.parquet")
+
+    synced = 0
+    cursor = collection.find(query, {"_id": 0, **{column: 1 for column in SNAPSHOT_COLUMNS}}, batch_size=batch_size)
+    with pyarrow.parquet.ParquetWriter(f"{path}.tmp", schema) as writer:
+
+        batch = []
+        # The built rows are strings (`CAST(... AS VARCHAR)`) - older documents can hold numbers
+        for document in cursor:
+            batch.append(snapshot_row(document))
+            if len(batch) == batch_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                synced += len(batch)
+                batch = []
+
+        # An empty master still gets a file so that the snapshot has a schema
+        writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+        synced += len(batch)
+
+    if synced or watermark is None:
+        os.replace(f"{path}.tmp", path)
+    else:
+        os.remove(f"{path}.tmp")
+
+    # The watermark is written last - a failed sync is repeated from the previous one
+    with open(f"{watermark_path(snapshot_dir)}.tmp", "w") as file:
+        json.dump({"upload_timestamp": started.isoformat()}, file)
+    os.replace(f"{watermark_path(snapshot_dir)}.tmp", watermark_path(snapshot_dir))
+
+    return synced
+
+
+
+def compact_snapshot(connection, snapshot_dir: str, max_parts: int = MAX_SNAPSHOT_PARTS) -> int:
+    """
+    Rewrite the snapshot as one file (the latest version of every security) once it has more than `max_parts` parts
+
+    Parameters:
+        - `connection` - a DuckDB connection (see `resources.DuckDB`)
+        - `snapshot_dir` - the snapshot folder
+        - `max_parts` - the number of parts that triggers the rewrite
+
+    Output:
+        - the number of parts after the compaction
+    """
+    parts = glob.glob(snapshot_glob(snapshot_dir))
+    if len(parts) <= max_parts:
+        return len(parts)
+
+    path = os.path.join(snapshot_dir, f"compacted-{uuid.uuid4().hex}.parquet")
+    files = ", ".join(f"'{part}'" for part in parts)
+    connection.execute(f"COPY ({latest_sql(f'[{files}]')}) TO '{path}.tmp' (FORMAT PARQUET)")
+    os.replace(f"{path}.tmp", path)
+
+    # A concurrent compaction might have removed a part already
+    for part in parts:
+        if os.path.exists(part):
+            os.remove(part)
+
+    return 1
+
+
+
+def build_security_master(connection, data: pd.DataFrame, country_codes: pd.DataFrame, column_mappings: dict[str, str], mongo_aliases: pymongo.collection.Collection) -> tuple[str, dict]:
+    """
+    Build the security master rows of the raw portfolio rows as one SQL query (same steps as `portfolio_instruments_rename`
+    -> `processed_portfolio` -> `unique_instruments` -> `portfolio_security_master`). DuckDB scans the DataFrame
+    without copying it and spills to disk when the query does not fit in its memory limit.
+
+    Parameters:
+        - `connection` - a DuckDB connection (see `resources.DuckDB`)
+        - `data` - the raw portfolio rows (the columns of `column_mappings` and `nt_quantity`)
+        - `country_codes` - the country codes (`country_name`, `country_code`)
+        - `column_mappings` - the raw column to the security master column
+        - `mongo_aliases` - the harmonization aliases collection
+
+    Output:
+        - the name of the temporary table that holds the built rows (`MASTER_COLUMNS`)
+        - the metadata (instruments, duplicated FIGIs, learned Yellow Keys)
+    """
+    # The row number breaks the ties of the best-row dedup like pandas (the first instrument wins)
+    connection.register("raw_portfolios", data.assign(row_position=range(len(data))))
+    connection.register("countries", country_codes.rename(columns={"country_name": "issuer_country", "country_code": "issuer_country_code"}))
+
+    renamed = ", ".join(f"CAST({column} AS VARCHAR) AS {name}" for column, name in column_mappings.items())
+    connection.execute(f"""
+        CREATE OR REPLACE TEMP TABLE instruments AS
+        SELECT {renamed}, min(row_position) AS row_position
+        FROM raw_portfolios
+        WHERE nt_quantity IS DISTINCT FROM 0
+        GROUP BY ALL
+    """)
+
+    # (0) The distinct Yellow Codes are harmonized in Python (aliases / fuzzy matching) and joined back
+    yellow_keys = Harmonizer.yellow_keys(load_aliases(mongo_aliases, "yellow_keys"))
+    raw_keys = connection.execute("SELECT DISTINCT yellow_key_code FROM instruments WHERE yellow_key_code IS NOT NULL").df()["yellow_key_code"]
+    connection.register("yellow_keys", pd.DataFrame({"raw": raw_keys, "canonical": yellow_keys.resolve(raw_keys)}))
+    connection.register("missing_yellow_codes", pd.DataFrame({
+        "prefix": list(constants.MISSING_YELLOW_CODES.keys()),
+        "yellow_key_code": list(constants.MISSING_YELLOW_CODES.values())
+    }))
+
+    missing = " + ".join(f"CAST({name} IS NULL AS INTEGER)" for name in column_mappings.values())
+    columns = ", ".join(f"r.{column}" for column in column_mappings.values())
+    connection.execute(f"""
+        CREATE OR REPLACE TEMP TABLE built AS
+        WITH harmonized AS (
+            SELECT i.* REPLACE (coalesce(y.canonical, i.yellow_key_code) AS yellow_key_code)
+            FROM instruments i
+            LEFT JOIN yellow_keys y ON i.yellow_key_code = y.raw
+        ),
+        -- (1) Equities have the same underlying security name + bbg_code
+        equities AS (
+            SELECT * REPLACE (
+                CASE WHEN yellow_key_code = 'Equity' THEN security_name ELSE underlying_security_name END AS underlying_security_name,
+                CASE WHEN yellow_key_code = 'Equity' THEN bbg_code ELSE underlying_bbg_code END AS underlying_bbg_code
+            )
+            FROM harmonized
+        ),
+        -- (2) Fill missing Bloomberg Yellow Codes - the longest matching prefix of every distinct name
+        matched AS (
+            SELECT e.security_name, arg_max(m.yellow_key_code, length(m.prefix)) AS yellow_key_code
+            FROM (SELECT DISTINCT security_name FROM equities WHERE security_name IS NOT NULL) e
+            JOIN missing_yellow_codes m ON starts_with(upper(e.security_name), m.prefix)
+            GROUP BY e.security_name
+        ),
+        processed AS (
+            SELECT e.* REPLACE (coalesce(m.yellow_key_code, e.yellow_key_code) AS yellow_key_code), {missing} AS missing
+            FROM equities e
+            LEFT JOIN matched m ON e.security_name = m.security_name
+        ),
+        -- (3) One instrument per FIGI - the one with the lowest number of NaNs
+        ranked AS (
+            SELECT *, CASE WHEN figi_code IS NULL THEN 1 ELSE row_number() OVER (PARTITION BY figi_code ORDER BY missing, row_position) END AS best
+            FROM processed
+        )
+        -- (4) Country names
+        SELECT {columns}, c.issuer_country
+        FROM ranked r
+        LEFT JOIN countries c ON r.issuer_country_code = c.issuer_country_code
+        WHERE r.best = 1 AND r.yellow_key_code IS NOT NULL
+    """)
+
+    instruments, = connection.execute("SELECT count(*) FROM instruments").fetchone()
+    duplicates, = connection.execute("""
+        SELECT count(*) FROM (
+            SELECT figi_code FROM instruments WHERE figi_code IS NOT NULL GROUP BY figi_code HAVING count(*) > 1
+        )
+    """).fetchone()
+
+    metadata = {
+        "instruments": instruments,
+        "duplicates": duplicates,
+        "learned_yellow_keys": save_aliases(mongo_aliases, "yellow_keys", yellow_keys.learned),
+        "suggested_yellow_keys": save_aliases(mongo_aliases, "yellow_keys", yellow_keys.suggested, reviewed=False)
+    }
+
+    return "built", metadata
+
+
+
+def changed_securities(connection, table: str, snapshot_dir: str) -> pd.DataFrame:
+    """
+    Get the built rows that differ from the latest snapshot version of their security (NULLs are equal) - the
+    others would not change the security master. Sync the snapshot first (see `sync_snapshot`), a row that only
+    looks changed because of a stale snapshot is diffed again by `security_master.upsert_securities`
+
+    Parameters:
+        - `connection` - a DuckDB connection
+        - `table` - the built rows (see `build_security_master`)
+        - `snapshot_dir` - the snapshot folder
+
+    Output:
+        - the changed / new securities (only these are loaded into pandas)
+    """
+    columns = ", ".join(MASTER_COLUMNS)
+    return connection.execute(f"""
+        SELECT {columns} FROM (
+            SELECT {SECURITY_KEY_SQL} AS security_key, {columns} FROM {table}
+            EXCEPT
+            SELECT security_key, {columns} FROM ({latest_sql(f"'{snapshot_glob(snapshot_dir)}'")})
+        )
+    """).df()
+
+
+
+def upload_changes(connection, changes: pd.DataFrame, mongo: Mongo, snapshot_dir: str) -> dict:
+    """
+    Write the changed securities to the security master (see `security_master.upsert_securities`) and append the
+    written versions to the snapshot
+
+    Parameters:
+        - `connection` - a DuckDB connection
+        - `changes` - see `changed_securities`
+        - `mongo` - the Mongo resource
+        - `snapshot_dir` - the snapshot folder
+
+    Output:
+        - the counts of `upsert_securities`
+    """
+    counts, written = upsert_securities(mongo, changes.to_dict("records"))
+    if not written:
+        return counts
+
+    # A part that is lost (failed write) only makes the next run compare more rows
+    path = os.path.join(snapshot_dir, f"part-{datetime.datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex}.parquet")
+    connection.register("written", pd.DataFrame([snapshot_row(security) for security in written], columns=SNAPSHOT_COLUMNS))
+    connection.execute(f"COPY written TO '{path}.tmp' (FORMAT PARQUET)")
+    os.replace(f"{path}.tmp", path)
+
+    return counts
@@ -0,0 +1,51 @@
+from dagster import AssetExecutionContext
+from typing import Optional
+from types import ModuleType
+from . import transforms, polars_transforms
+
+# The run tag that selects the engine of the DataFrame transformations (set per job in `jobs`, can be overridden per run)
+ENGINE_TAG = "ngt/engine"
+
+# - `pandas` - the reference implementation (`transforms`)
+# - `polars` - lazy, multi-threaded query plans (`polars_transforms`, needs `polars`) - the number of threads is
+#   set with `POLARS_MAX_THREADS` (all cores by default)
+ENGINES = {
+    "pandas": transforms,
+    "polars": polars_transforms
+}
+DEFAULT_ENGINE = "pandas"
+
+def get_engine(context: Optional[AssetExecutionContext]) -> str:
+    """
+    Get the engine of the current run
+
+    Parameters:
+        - `context` - the asset's execution context
+
+    Output:
+        - `pandas` or `polars` (`DEFAULT_ENGINE` if the tag is missing or unknown)
+    """
+    if context is None:
+        return DEFAULT_ENGINE
+
+    engine = context.run.tags.get(ENGINE_TAG, DEFAULT_ENGINE)
+    return engine if engine in ENGINES else DEFAULT_ENGINE
+
+
+
+def get_transforms(context: Optional[AssetExecutionContext]) -> ModuleType:
+    """
+    Get the transformations of the current run's engine
+
+    Parameters:
+        - `context` - the asset's execution context
+
+    Output:
+        - `transforms` or `polars_transforms` (same functions) - `transforms` if `polars` is not installed
+    """
+    engine = get_engine(context)
+    if engine == "polars" and polars_transforms.pl is None:
+        context.log.warning("`polars` is not installed - falling back to the pandas engine")
+        return transforms
+
+    return ENGINES[engine]
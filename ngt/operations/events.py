@@ -0,0 +1,134 @@
+from typing import Optional, Union
+from bson import json_util
+from .files import RAW_FILE_EXTENSIONS, discover_files
+import pymongo.collection
+import pymongo.database
+import pymongo.errors
+import threading
+import os
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError: # Optional - the folders are listed on every tick instead
+    Observer = None
+    FileSystemEventHandler = object
+
+def read_changes(source: Union[pymongo.collection.Collection, pymongo.database.Database], pipeline: list[dict], cursor: Optional[str], max_events: int = 1000, max_await_time_ms: int = 1000) -> tuple[list[dict], str, bool]:
+    """
+    Read the change stream events that happened since the last resume token.
+    Requires MongoDB to run as a replica set.
+
+    Parameters:
+        - `source` - the collection or database (e.g. `faulty`) that is watched
+        - `pipeline` - the change stream filter
+        - `cursor` - the last resume token (JSON) - `None` on the first run
+        - `max_events` - the maximum number of events returned at a time
+        - `max_await_time_ms` - how long the server waits for new events
+
+    Output:
+        - the events, the new resume token (JSON - the previous cursor if the stream returned no token) and whether
+          the stream has (re)started. A (re)started stream has no history, so the caller should do a full scan once.
+    """
+    resume_after = json_util.loads(cursor) if cursor else None
+    restarted = resume_after is None
+
+    try:
+        stream = source.watch(pipeline, resume_after=resume_after, full_document="updateLookup", max_await_time_ms=max_await_time_ms)
+    except pymongo.errors.OperationFailure:
+        # The resume token is no longer in the oplog
+        stream = source.watch(pipeline, full_document="updateLookup", max_await_time_ms=max_await_time_ms)
+        restarted = True
+
+    events = []
+    with stream:
+        while stream.alive and len(events) < max_events:
+            event = stream.try_next()
+            if event is None:
+                break
+            events.append(event)
+
+        token = stream.resume_token
+
+    # Never store "null" - the next tick would resume from nowhere without knowing it
+    return events, json_util.dumps(token) if token is not None else cursor, restarted
+
+
+
+class FolderWatcher(FileSystemEventHandler):
+
+    def __init__(self, folder_path: str, extensions: tuple[str, ...] = RAW_FILE_EXTENSIONS):
+        """
+        Collect the files that are created / moved / modified in a folder.
+        Uses the OS file system events (inotify, ReadDirectoryChangesW, ...) when `watchdog` is installed,
+        otherwise the folder is listed on every call. The candidates are filtered by the file registry
+        (see `files.unseen_files`), not by their timestamps.
+
+        Parameters:
+            - `folder_path` - the watched folder
+            - `extensions` - the allowed file extensions
+        """
+        self.folder_path = folder_path
+        self.extensions = extensions
+        os.makedirs(folder_path, exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__changed: set[str] = set()
+        self.__scanned = False
+        self.__observer = None
+
+        if Observer is not None:
+            self.__observer = Observer()
+            self.__observer.schedule(self, folder_path, recursive=False)
+            self.__observer.daemon = True
+            self.__observer.start()
+
+
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("created", "moved", "modified"):
+            return
+
+        with self.__lock:
+            self.__changed.add(getattr(event, "dest_path", None) or event.src_path)
+
+
+
+    def changes(self) -> list[str]:
+        """
+        Get the files that have been created / moved / modified since the last call
+
+        Output:
+            - the candidate files (all of them without file system events or on the first call)
+        """
+        if self.__observer is None or not self.__scanned:
+            self.__scanned = True
+            with self.__lock:
+                self.__changed = set()
+            return discover_files(self.folder_path, self.extensions)
+
+        with self.__lock:
+            candidates, self.__changed = self.__changed, set()
+
+        allowed = set(discover_files(self.folder_path, self.extensions)) if candidates else set()
+        return sorted(path for path in candidates if path in allowed)
+
+
+
+_watchers: dict[str, FolderWatcher] = {}
+
+def get_folder_watcher(folder_path: str, extensions: tuple[str, ...] = RAW_FILE_EXTENSIONS) -> FolderWatcher:
+    """
+    Get the (process wide) watcher of a folder
+
+    Parameters:
+        - `folder_path` - the watched folder
+        - `extensions` - the allowed file extensions (only used when the watcher is created)
+
+    Output:
+        - the folder's watcher
+    """
+    if folder_path not in _watchers:
+        _watchers[folder_path] = FolderWatcher(folder_path, extensions)
+
+    return _watchers[folder_path]
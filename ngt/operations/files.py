@@ -0,0 +1,359 @@
+from dagster import AssetExecutionContext
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Optional
+import pymongo
+import pymongo.collection
+import pandas as pd
+import hashlib
+import datetime
+import os
+
+RAW_FILE_EXTENSIONS = (".csv", ".xlsx", ".xls")
+
+def fingerprint(file_path: str, prefix_size: Optional[int] = None, chunk_size: int = 1024 * 1024) -> dict:
+    """
+    Get the fingerprint of a file. The content is hashed in chunks so that large files are never fully loaded in memory.
+
+    Parameters:
+        - `file_path` - the full file path
+        - `prefix_size` - also hash the first `prefix_size` bytes (used to check if a file has only been appended to)
+        - `chunk_size` - the number of bytes read at a time
+
+    Output:
+        - the file's path, name, size (bytes), modification time, SHA-256 content hash and the prefix hash (if requested)
+    """
+    sha256 = hashlib.sha256()
+    prefix_hash = None
+    position = 0
+
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+
+            if prefix_size is not None and position < prefix_size <= position + len(chunk):
+                prefix = sha256.copy()
+                prefix.update(chunk[:prefix_size - position])
+                prefix_hash = prefix.hexdigest()
+
+            sha256.update(chunk)
+            position += len(chunk)
+
+    return {
+        "file_path": file_path,
+        "file_name": os.path.basename(file_path),
+        "size": os.path.getsize(file_path),
+        "mtime": os.path.getmtime(file_path),
+        "hash": sha256.hexdigest(),
+        "prefix_hash": prefix_hash
+    }
+
+
+
+def read_raw_file(file_path: str, offset: int = 0, skip_rows: int = 0) -> pd.DataFrame:
+    """
+    Read a raw CSV / Excel / Parquet file
+
+    Parameters:
+        - `file_path` - the full file path
+        - `offset` - CSV only - start reading the rows from this byte (the header is always read from the top)
+        - `skip_rows` - Excel / Parquet only - the number of rows to skip after the header
+
+    Output:
+        - the file's data
+    """
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path).iloc[skip_rows:].reset_index(drop=True)
+
+    if not file_path.endswith(".csv"):
+        return pd.read_excel(file_path).iloc[skip_rows:].reset_index(drop=True)
+
+    if offset == 0:
+        return pd.read_csv(file_path)
+
+    with open(file_path, "rb") as file:
+        columns = pd.read_csv(file, nrows=0).columns
+        file.seek(offset)
+
+        try:
+            return pd.read_csv(file, header=None, names=columns)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame(columns=columns)
+
+
+
+def discover_files(folder_path: str, extensions: tuple[str, ...] = RAW_FILE_EXTENSIONS) -> list[str]:
+    """
+    Get all of the raw files in a landing folder. Sub folders and temporary Office files (`~$`) are ignored.
+
+    Parameters:
+        - `folder_path` - the landing folder
+        - `extensions` - the allowed file extensions
+
+    Output:
+        - the full file paths, sorted by name
+    """
+    os.makedirs(folder_path, exist_ok=True)
+
+    file_paths = []
+    for file_name in sorted(os.listdir(folder_path)):
+
+        file_path = os.path.join(folder_path, file_name)
+        if file_name.startswith("~$") or os.path.isdir(file_path) or not file_name.endswith(extensions):
+            continue
+
+        file_paths.append(file_path)
+
+    return file_paths
+
+
+
+def unseen_files(registry: pymongo.collection.Collection, file_paths: list[str], mode: str) -> list[dict]:
+    """
+    Get the files whose content has not been seen yet - a file is only hashed if its path / size / modification
+    time is not in the registry, and it is new if no seen file has the same content hash. No timestamp is compared
+    with a watermark, so a file that is moved into the folder with an old modification time is still picked up.
+
+    Parameters:
+        - `registry` - the file registry collection
+        - `file_paths` - the candidate files (e.g. `discover_files`)
+        - `mode` - the registry mode of the folder (e.g. `hitl/portfolios`)
+
+    Output:
+        - the fingerprints of the new files (see `mark_seen`)
+    """
+    if not file_paths:
+        return []
+
+    registry.create_index([("mode", 1), ("partition_key", 1), ("file_path", 1), ("status", 1)])
+    registry.create_index([("mode", 1), ("partition_key", 1), ("hash", 1)])
+
+    query = {
+        "mode": mode,
+        "partition_key": None,
+        "status": "seen",
+        "file_path": {"$in": file_paths}
+    }
+    seen = {
+        (document["file_path"], document["size"], document["mtime"])
+        for document in registry.find(query, {"_id": 0, "file_path": 1, "size": 1, "mtime": 1})
+    }
+
+    candidates = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError: # Moved away since the folder was listed
+            continue
+
+        if (file_path, stat.st_size, stat.st_mtime) not in seen:
+            candidates.append(fingerprint(file_path))
+
+    if not candidates:
+        return []
+
+    query = {
+        "mode": mode,
+        "partition_key": None,
+        "status": "seen",
+        "hash": {"$in": [file["hash"] for file in candidates]}
+    }
+    hashes = set(registry.distinct("hash", query))
+
+    # The known content under a new path / modification time is recorded so that it is not hashed again
+    mark_seen(registry, [file for file in candidates if file["hash"] in hashes], mode)
+
+    return [file for file in candidates if file["hash"] not in hashes]
+
+
+
+def mark_seen(registry: pymongo.collection.Collection, files: list[dict], mode: str):
+    """
+    Record the fingerprints of the files that have been handled (see `unseen_files`)
+
+    Parameters:
+        - `registry` - the file registry collection
+        - `files` - the fingerprints
+        - `mode` - the registry mode of the folder
+    """
+    if not files:
+        return
+
+    now = datetime.datetime.now()
+    registry.insert_many([
+        {**file, "mode": mode, "partition_key": None, "status": "seen", "seen_timestamp": now}
+        for file in files
+    ])
+
+
+
+def get_uploaded_files(registry: pymongo.collection.Collection, mode: str, partition_key: Optional[str], file_paths: list[str]) -> dict[str, dict]:
+    """
+    Get the latest completed upload of every file
+
+    Parameters:
+        - `registry` - the file registry collection
+        - `mode` - either `portfolios` or `trades`
+        - `partition_key` - the current partition (`None` if the run is not partitioned)
+        - `file_paths` - the full file paths
+
+    Output:
+        - the file path to the latest registry document mapping
+    """
+    query = {
+        "mode": mode,
+        "partition_key": partition_key,
+        "status": "completed",
+        "file_path": {"$in": file_paths}
+    }
+    documents = registry.find(query, {"_id": 0}).sort("completed_timestamp", pymongo.ASCENDING)
+
+    return {document["file_path"]: document for document in documents}
+
+
+
+def load_files(context: AssetExecutionContext, registry: pymongo.collection.Collection, file_paths: list[str], mode: str, max_workers: int = 1) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    Load the new content of the given files as one batch. Every file is checked against the file registry:
+        - (1) same size and modification time as its last upload - skipped without being read
+        - (2) same content hash as any uploaded file - skipped
+        - (3) the previously uploaded bytes are unchanged (the file was appended to) - only the new rows are read
+        - (4) otherwise the whole file is read
+    Hashing and parsing run concurrently in a process pool when `max_workers` > 1.
+    The loaded files are registered as `pending` under the current run id.
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `registry` - the file registry collection
+        - `file_paths` - the full file paths
+        - `mode` - either `portfolios` or `trades`
+        - `max_workers` - the maximum number of worker processes
+
+    Output:
+        - the data of all new rows and the fingerprints of the loaded files
+    """
+    if not file_paths:
+        return pd.DataFrame(), []
+
+    registry.create_index([("mode", 1), ("partition_key", 1), ("file_path", 1), ("status", 1)])
+    registry.create_index([("mode", 1), ("partition_key", 1), ("hash", 1)])
+    registry.create_index("run_id")
+
+    partition_key: Optional[str] = context.partition_key if context.has_partition_key else None
+    uploaded = get_uploaded_files(registry, mode, partition_key, file_paths)
+
+    # (1) Unchanged size and modification time
+    changed = []
+    for file_path in file_paths:
+        previous = uploaded.get(file_path)
+        if previous and previous["size"] == os.path.getsize(file_path) and previous.get("mtime") == os.path.getmtime(file_path):
+            continue
+        changed.append(file_path)
+
+    context.log.info(f"Found {len(file_paths)} file(s), {len(file_paths) - len(changed)} unchanged")
+    if not changed:
+        return pd.DataFrame(), []
+
+    workers = max(1, min(max_workers, len(changed)))
+    with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as executor:
+
+        map_files = executor.map if executor else map
+
+        prefix_sizes = []
+        for file_path in changed:
+            previous = uploaded.get(file_path)
+            prefix_sizes.append(previous["size"] if previous and os.path.getsize(file_path) > previous["size"] else None)
+
+        fingerprints = list(map_files(fingerprint, changed, prefix_sizes))
+
+        # (2) Identical content
+        query = {
+            "mode": mode,
+            "partition_key": partition_key,
+            "status": "completed",
+            "hash": {"$in": [file["hash"] for file in fingerprints]}
+        }
+        completed = set(registry.distinct("hash", query))
+
+        files = []
+        for file in fingerprints:
+
+            if file["hash"] in completed:
+                continue
+
+            # (3) Appended file - (4) New file
+            previous = uploaded.get(file["file_path"])
+            appended = previous is not None and file["prefix_hash"] == previous["hash"]
+
+            file["offset"] = previous["size"] if appended else 0
+            file["skip_rows"] = previous.get("rows", 0) if appended else 0
+            files.append(file)
+
+        context.log.info(f"Loading {len(files)} file(s), {sum(file['offset'] > 0 for file in files)} appended")
+        if not files:
+            return pd.DataFrame(), []
+
+        data = list(map_files(
+            read_raw_file,
+            [file["file_path"] for file in files],
+            [file["offset"] for file in files],
+            [file["skip_rows"] for file in files]
+        ))
+
+    now = datetime.datetime.now()
+    for file, current in zip(files, data):
+        file.update({
+            "rows": file["skip_rows"] + len(current),
+            "mode": mode,
+            "partition_key": partition_key,
+            "run_id": context.run_id,
+            "status": "pending",
+            "upload_timestamp": now
+        })
+
+    registry.insert_many([{**file} for file in files])
+
+    return pd.concat(data, ignore_index=True), files
+
+
+
+def load_folder(context: AssetExecutionContext, registry: pymongo.collection.Collection, folder_path: str, mode: str, max_workers: int) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    Load all of the new files of a landing folder as one batch (see `load_files`)
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `registry` - the file registry collection
+        - `folder_path` - the landing folder
+        - `mode` - either `portfolios` or `trades`
+        - `max_workers` - the maximum number of worker processes
+
+    Output:
+        - the data of all new rows and the fingerprints of the loaded files
+    """
+    return load_files(context, registry, discover_files(folder_path), mode, max_workers)
+
+
+
+def complete_files(context: AssetExecutionContext, registry: pymongo.collection.Collection) -> int:
+    """
+    Mark the files registered by the current run as uploaded
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `registry` - the file registry collection
+
+    Output:
+        - the number of completed files
+    """
+    query = {
+        "run_id": context.run_id,
+        "status": "pending"
+    }
+    update = {
+        "$set": {
+            "status": "completed",
+            "completed_timestamp": datetime.datetime.now()
+        }
+    }
+
+    return registry.update_many(query, update).modified_count
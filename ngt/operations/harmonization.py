@@ -0,0 +1,235 @@
+from typing import Optional
+from .. import constants
+from .normalization import map_unique
+import pymongo
+import pymongo.collection
+import pandas as pd
+import unicodedata
+import difflib
+import datetime
+import re
+
+STOP_WORDS = {"THE", "OF", "AND", "ISLAND", "ISLANDS", "REPUBLIC"}
+
+class Harmonizer:
+
+    def __init__(self, vocabulary: dict[str, str], aliases: Optional[dict[str, str]] = None, cutoff: float = 0.85, min_fuzzy_length: int = 4):
+        """
+        Resolve raw categorical values (countries, yellow keys, ...) to their canonical value.
+        Every value goes through exact -> normalized -> fuzzy matching and every distinct value
+        is resolved only once per instance.
+
+        Parameters:
+            - `vocabulary` - the known spellings mapped to their canonical value (e.g. `{"United States": "US"}`)
+            - `aliases` - previously learned spellings mapped to their canonical value
+            - `cutoff` - the minimum similarity ratio (0 - 1) for a fuzzy match
+            - `min_fuzzy_length` - values with a shorter normalized key are never fuzzy matched
+        """
+        self.cutoff = cutoff
+        self.min_fuzzy_length = min_fuzzy_length
+
+        self.__exact = {**vocabulary, **(aliases or {})}
+        self.__normalized = self.__build_index(vocabulary)
+        self.__keys = list(self.__normalized.keys())
+
+        self.__cache: dict[str, tuple[Optional[str], Optional[str]]] = {}
+        self.learned: dict[str, str] = {} # The normalized matches - safe to persist
+        self.suggested: dict[str, str] = {} # The fuzzy matches - only persisted for review (see `save_aliases`)
+
+
+
+    @classmethod
+    def countries(cls, aliases: Optional[dict[str, str]] = None, file_path: str = constants.COUNTRY_NAMES_PATH) -> "Harmonizer":
+        """
+        Build a harmonizer that resolves country names and codes to the country code (2 digits)
+
+        Parameters:
+            - `aliases` - previously learned spellings mapped to their country code
+            - `file_path` - the country names file (`Name`, `Code` columns)
+
+        Output:
+            - the country harmonizer
+        """
+        data = pd.read_csv(file_path, keep_default_na=False).drop_duplicates()
+
+        vocabulary = {code: code for code in data["Code"]}
+        vocabulary.update(data.set_index("Name")["Code"].to_dict())
+        vocabulary.update(constants.TRADES_COUNTRY_MAPPING)
+
+        return cls(vocabulary, aliases)
+
+
+
+    @classmethod
+    def yellow_keys(cls, aliases: Optional[dict[str, str]] = None) -> "Harmonizer":
+        """
+        Build a harmonizer for the Bloomberg Yellow Keys / OpenFIGI market sectors
+
+        Parameters:
+            - `aliases` - previously learned spellings mapped to their yellow key
+
+        Output:
+            - the yellow key harmonizer
+        """
+        return cls({code: code for code in constants.YELLOW_KEY_CODES}, aliases)
+
+
+
+    @staticmethod
+    def normalize(value: str) -> str:
+        """
+        Normalize a raw value - strip accents, remove brackets, punctuation and stop words,
+        upper case and sort the remaining tokens
+
+        Parameters:
+            - `value` - the raw value
+
+        Output:
+            - the normalized key
+        """
+        value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
+        value = re.sub(r"\(.*?\)", " ", value.upper())
+        tokens = [token for token in re.split(r"[^A-Z0-9]+", value) if token and token not in STOP_WORDS]
+
+        return " ".join(sorted(tokens))
+
+
+
+    def __build_index(self, vocabulary: dict[str, str]) -> dict[str, str]:
+        """
+        Create the normalized key to canonical value index.
+        Keys that point to more than one canonical value are ambiguous and are dropped.
+
+        Parameters:
+            - `vocabulary` - the known spellings mapped to their canonical value
+
+        Output:
+            - the normalized key to canonical value index
+        """
+        index = {}
+        ambiguous = set()
+
+        for name, value in vocabulary.items():
+            key = self.normalize(name)
+            if not key:
+                continue
+
+            if key in index and index[key] != value:
+                ambiguous.add(key)
+            index[key] = value
+
+        return {key: value for key, value in index.items() if key not in ambiguous}
+
+
+
+    def resolve_one(self, value: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+        """
+        Resolve a single raw value
+
+        Parameters:
+            - `value` - the raw value
+
+        Output:
+            - the canonical value (or `None`) and the method that found it (`exact`, `normalized`, `fuzzy` or `None`)
+        """
+        if not isinstance(value, str):
+            return None, None
+
+        if value in self.__cache:
+            return self.__cache[value]
+
+        result = (None, None)
+        key = self.normalize(value)
+
+        if value in self.__exact:
+            result = (self.__exact[value], "exact")
+
+        elif key in self.__normalized:
+            result = (self.__normalized[key], "normalized")
+
+        elif len(key) >= self.min_fuzzy_length:
+            matches = difflib.get_close_matches(key, self.__keys, n=1, cutoff=self.cutoff)
+            if matches:
+                result = (self.__normalized[matches[0]], "fuzzy")
+
+        # A fuzzy match can be wrong (e.g. "AUSTRIA" -> "AUSTRALIA") - it is never learned automatically
+        if result[1] == "normalized":
+            self.learned[value] = result[0]
+        elif result[1] == "fuzzy":
+            self.suggested[value] = result[0]
+
+        self.__cache[value] = result
+        return result
+
+
+
+    def resolve(self, values: pd.Series) -> pd.Series:
+        """
+        Resolve a column of raw values. The column is factorized so that every
+        distinct value is resolved once and broadcast back to the rows.
+
+        Parameters:
+            - `values` - the raw values
+
+        Output:
+            - the canonical values (`NaN` if a value could not be resolved)
+        """
+        return map_unique(values, lambda value: self.resolve_one(value)[0])
+
+
+
+def load_aliases(collection: pymongo.collection.Collection, vocabulary: str) -> dict[str, str]:
+    """
+    Load the learned aliases of a vocabulary (the unreviewed suggestions are skipped)
+
+    Parameters:
+        - `collection` - the aliases collection
+        - `vocabulary` - the vocabulary name (e.g. `countries`)
+
+    Output:
+        - the alias to canonical value mapping
+    """
+    project = {
+        "_id": 0,
+        "alias": 1,
+        "value": 1
+    }
+
+    query = {
+        "vocabulary": vocabulary,
+        "reviewed": {"$ne": False}
+    }
+
+    return {row["alias"]: row["value"] for row in collection.find(query, project)}
+
+
+
+def save_aliases(collection: pymongo.collection.Collection, vocabulary: str, aliases: dict[str, str], reviewed: bool = True) -> int:
+    """
+    Persist newly learned aliases so that every spelling is resolved only once
+
+    Parameters:
+        - `collection` - the aliases collection
+        - `vocabulary` - the vocabulary name (e.g. `countries`)
+        - `aliases` - the alias to canonical value mapping
+        - `reviewed` - `False` for the fuzzy suggestions - they are only loaded once `reviewed` is set to `True`
+
+    Output:
+        - the number of new aliases
+    """
+    if not aliases:
+        return 0
+
+    collection.create_index([("vocabulary", 1), ("alias", 1)], unique=True)
+
+    now = datetime.datetime.now()
+    requests = [
+        pymongo.UpdateOne(
+            {"vocabulary": vocabulary, "alias": alias},
+            {"$setOnInsert": {"value": value, "reviewed": reviewed, "upload_timestamp": now}},
+            upsert=True
+        )
+        for alias, value in aliases.items()
+    ]
+
+    return collection.bulk_write(requests, ordered=False).upserted_count
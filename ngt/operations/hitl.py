@@ -0,0 +1,237 @@
+from typing import Optional
+import pandas as pd
+import pymongo
+import pymongo.collection
+import datetime
+import hashlib
+import os
+
+HITL_FILE_EXTENSIONS = (".csv", ".parquet", ".xlsx", ".xls")
+HITL_COLUMNS = ["column_name", "comment", "faulty_id"]
+
+# Only used to track the faulty rows in the database - never exported
+TRACKING_COLUMNS = ["_id", "faulty_id", "status", "completed_timestamp", "emailed_timestamp"]
+
+# The datetime columns of the HITL files - CSV has no types, so these are parsed back on read
+DATETIME_COLUMNS = ["date", "nx_date", "upload_timestamp", "completed_timestamp", "emailed_timestamp"]
+
+def write_hitl_file(data: pd.DataFrame, file_path: str):
+    """
+    Write the faulty rows that will be fixed manually. The format is picked from the extension:
+        - `.csv` / `.parquet` - columnar formats, written without any Excel overhead
+        - `.xlsx` - written row by row with `xlsxwriter` (constant memory) when it is installed
+
+    Parameters:
+        - `data` - the faulty rows
+        - `file_path` - the full file path
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+
+    if file_path.endswith(".csv"):
+        data.to_csv(file_path, index=False)
+        return
+
+    if file_path.endswith(".parquet"):
+        data.to_parquet(file_path, index=False)
+        return
+
+    try:
+        import xlsxwriter # noqa: F401
+    except ImportError: # Optional - fall back to the default (openpyxl) writer
+        data.to_excel(file_path, index=False)
+        return
+
+    with pd.ExcelWriter(file_path, engine="xlsxwriter", engine_kwargs={"options": {"constant_memory": True}}) as writer:
+        data.to_excel(writer, index=False)
+
+
+
+def read_hitl_file(file_path: str) -> pd.DataFrame:
+    """
+    Read a fixed HITL file (see `write_hitl_file`). The `DATETIME_COLUMNS` of a CSV file are parsed,
+    so that the fixed rows are inserted with the same types as the rows of the pipeline.
+
+    Parameters:
+        - `file_path` - the full file path
+
+    Output:
+        - the fixed rows
+    """
+    if file_path.endswith(".csv"):
+        header = pd.read_csv(file_path, nrows=0).columns
+        return pd.read_csv(file_path, parse_dates=[column for column in DATETIME_COLUMNS if column in header])
+
+    if file_path.endswith(".parquet"):
+        return pd.read_parquet(file_path)
+
+    return pd.read_excel(file_path)
+
+
+
+def apply_corrections(data: pd.DataFrame, key: str = "id") -> pd.DataFrame:
+    """
+    Collapse the HITL rows into the fixed rows. Every faulty column has its own row, so the
+    corrections of an id are filled forward / backward within the id and the copies are dropped.
+
+    Parameters:
+        - `data` - the fixed HITL rows
+        - `key` - the column that groups the rows of one record
+
+    Output:
+        - one row per fixed record
+    """
+    if len(data) == 0:
+        return data
+
+    data = data.drop(columns=[column for column in HITL_COLUMNS if column in data.columns])
+
+    # All of the ids are filled at once instead of one group at a time
+    keys = data[key]
+    filled = data.drop(columns=key).groupby(keys, sort=False).ffill()
+    filled = filled.groupby(keys, sort=False).bfill()
+    filled[key] = keys
+
+    return filled[data.columns].drop_duplicates().reset_index(drop=True)
+
+
+
+def canonical_value(value) -> str:
+    """
+    Get the text of a value that does not depend on its dtype (e.g. `1`, `1.0` and `"1"` are the same,
+    missing values are empty and the dates are ISO 8601)
+    """
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item() # NumPy scalars
+
+    if value is None or (not isinstance(value, (str, bytes, list, dict)) and pd.isna(value)):
+        return ""
+
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return pd.Timestamp(value).isoformat()
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value).strip()
+
+
+
+def faulty_ids(faulty: pd.DataFrame, columns: Optional[list[str]] = None) -> pd.Series:
+    """
+    Identify the faulty rows by their content, so that the same problem always gets the same id.
+    The id is the SHA-256 of the canonical text of the columns (see `canonical_value`), so it does not
+    change with the dtypes of a run (e.g. categorical vs object, int vs float after a NaN).
+
+    Parameters:
+        - `faulty` - the faulty rows
+        - `columns` - the columns that identify a faulty row (all of them by default)
+
+    Output:
+        - the faulty ids
+    """
+    columns = columns or faulty.columns.to_list()
+    texts = faulty[columns].astype(object).apply(lambda column: column.map(canonical_value))
+
+    return texts.apply(lambda row: hashlib.sha256("\x1f".join(row).encode()).hexdigest(), axis=1).astype(str)
+
+
+
+def content_key(ids: pd.Series) -> str:
+    """
+    Create one key for a set of faulty ids (e.g. to send a set of rows only once)
+
+    Parameters:
+        - `ids` - the faulty ids
+
+    Output:
+        - the SHA-256 of the sorted ids
+    """
+    return hashlib.sha256("|".join(sorted(ids.astype(str))).encode()).hexdigest()
+
+
+
+def new_faulty(collection: pymongo.collection.Collection, faulty: pd.DataFrame) -> pd.DataFrame:
+    """
+    Filter out the faulty rows that are already tracked (pending or completed)
+
+    Parameters:
+        - `collection` - the faulty collection
+        - `faulty` - the faulty rows with their `faulty_id`
+
+    Output:
+        - the faulty rows that have not been reported yet
+    """
+    if len(faulty) == 0:
+        return faulty
+
+    query = {"faulty_id": {"$in": faulty["faulty_id"].drop_duplicates().to_list()}}
+    tracked = {document["faulty_id"] for document in collection.find(query, {"_id": 0, "faulty_id": 1})}
+
+    return faulty.loc[~faulty["faulty_id"].isin(tracked)].drop_duplicates(subset="faulty_id").reset_index(drop=True)
+
+
+
+def insert_faulty(collection: pymongo.collection.Collection, faulty: pd.DataFrame) -> int:
+    """
+    Track the new faulty rows. Every faulty id is only inserted once (unique index),
+    so re-running the same partition never duplicates the pending rows.
+
+    Parameters:
+        - `collection` - the faulty collection
+        - `faulty` - the faulty rows with their `faulty_id`
+
+    Output:
+        - the number of newly tracked rows
+    """
+    if len(faulty) == 0:
+        return 0
+
+    # Rows tracked before the faulty ids existed have no id and are ignored by the index
+    collection.create_index("faulty_id", unique=True, partialFilterExpression={"faulty_id": {"$exists": True}})
+    collection.create_index([("status", 1), ("emailed_timestamp", 1)])
+
+    requests = [
+        pymongo.UpdateOne({"faulty_id": document["faulty_id"]}, {"$setOnInsert": document}, upsert=True)
+        for document in faulty.to_dict("records")
+    ]
+
+    return collection.bulk_write(requests, ordered=False).upserted_count
+
+
+
+def pending_digest(collection: pymongo.collection.Collection) -> pd.DataFrame:
+    """
+    Get the pending faulty rows that have not been emailed yet
+
+    Parameters:
+        - `collection` - the faulty collection
+
+    Output:
+        - the faulty rows (with their `faulty_id`)
+    """
+    query = {
+        "status": "pending",
+        "emailed_timestamp": None,
+        "faulty_id": {"$exists": True}
+    }
+
+    return pd.DataFrame(collection.find(query, {"_id": 0, "completed_timestamp": 0}))
+
+
+
+def mark_emailed(collection: pymongo.collection.Collection, ids: list[str], now: datetime.datetime) -> int:
+    """
+    Mark the faulty rows as emailed so that they are not part of the next digest
+
+    Parameters:
+        - `collection` - the faulty collection
+        - `ids` - the faulty ids
+        - `now` - the email timestamp
+
+    Output:
+        - the number of updated rows
+    """
+    if not ids:
+        return 0
+
+    return collection.update_many({"faulty_id": {"$in": ids}}, {"$set": {"emailed_timestamp": now}}).modified_count
@@ -0,0 +1,413 @@
+from dagster import AssetExecutionContext, MarkdownMetadataValue
+from contextlib import contextmanager
+from typing import Callable, Optional
+from . import metrics
+from .metadata import DEFAULT_POLICY, MAX_VALUES, get_policy
+import pymongo.monitoring
+import pandas as pd
+import functools
+import threading
+import inspect
+import tracemalloc
+import cProfile
+import pstats
+import bson
+import time
+import io
+
+# The run tag that turns the profiler on - "*" for every asset or a comma separated list of asset names
+PROFILE_TAG = "ngt/profile"
+
+# The run tag that turns the memory profile (tracemalloc peak) on - same values as `PROFILE_TAG`
+MEMORY_TAG = "ngt/memory"
+
+# Copy-on-Write (pandas >= 2) - inside the assets, selections, `reset_index`, `rename`, `drop`, `assign`... share the
+# buffers of their input until one of them is written to, so the assets do not pay for a full copy of the rows at every
+# step. It is scoped to the assets (see `instrumented`) rather than set globally when `ngt` is imported
+COPY_ON_WRITE = "mode.copy_on_write"
+
+class Stats:
+
+    def __init__(self):
+        """
+        Thread safe counters of remote calls (round trips, bytes and latency) per target / operation
+        """
+        self.__calls: dict[tuple[str, str], dict] = {}
+        self.__lock = threading.Lock()
+
+    def record(self, target: str, operation: str, latency_ms: float, request_bytes: int = 0, reply_bytes: int = 0, failed: bool = False):
+        """
+        Record one call
+
+        Parameters:
+            - `target` - what has been called (e.g. the collection `processed/portfolio` or the host `api.openfigi.com`)
+            - `operation` - the command / endpoint (e.g. `insert` or `search`)
+            - `latency_ms` - the duration of the call
+            - `request_bytes` - the size of the request
+            - `reply_bytes` - the size of the reply
+            - `failed` - whether the call failed
+        """
+        with self.__lock:
+            calls = self.__calls.setdefault((target, operation), {"calls": 0, "failed": 0, "latency_ms": 0.0, "request_bytes": 0, "reply_bytes": 0})
+            calls["calls"] += 1
+            calls["failed"] += int(failed)
+            calls["latency_ms"] += latency_ms
+            calls["request_bytes"] += request_bytes
+            calls["reply_bytes"] += reply_bytes
+
+    def snapshot(self) -> dict[tuple[str, str], dict]:
+        """
+        Copy the current counters
+        """
+        with self.__lock:
+            return {key: dict(calls) for key, calls in self.__calls.items()}
+
+    def since(self, snapshot: dict[tuple[str, str], dict]) -> pd.DataFrame:
+        """
+        Get the calls that have been recorded after `snapshot`
+
+        Parameters:
+            - `snapshot` - see `snapshot`
+
+        Output:
+            - one row per target / operation (`target`, `operation`, `calls`, `failed`, `latency_ms`, `request_bytes`, `reply_bytes`)
+        """
+        rows = []
+        for key, calls in self.snapshot().items():
+            before = snapshot.get(key, {})
+            delta = {name: value - before.get(name, 0) for name, value in calls.items()}
+            if delta["calls"] > 0:
+                rows.append({"target": key[0], "operation": key[1], **delta})
+
+        columns = ["target", "operation", "calls", "failed", "latency_ms", "request_bytes", "reply_bytes"]
+        return pd.DataFrame(rows, columns=columns).sort_values("latency_ms", ascending=False, ignore_index=True)
+
+
+
+MONGO_STATS = Stats()
+HTTP_STATS = Stats()
+
+
+
+class MongoCommandListener(pymongo.monitoring.CommandListener):
+
+    def __init__(self, stats: Stats = MONGO_STATS):
+        """
+        Record every command of a Mongo client (round trip and latency per collection / command). The BSON size is
+        only measured inside `measure_bytes` (re-encoding every command and reply is not free)
+
+        Parameters:
+            - `stats` - where the commands are recorded
+        """
+        self.stats = stats
+        self.__pending: dict[tuple, tuple[str, int]] = {}
+        self.__lock = threading.Lock()
+        self.__measuring = 0
+
+    @contextmanager
+    def measure_bytes(self):
+        """
+        Measure the request / reply bytes of the commands sent inside the block (e.g. of an asset profiled
+        with the `ngt/profile` run tag) - the listener is shared, so the commands of concurrent threads are measured too
+        """
+        with self.__lock:
+            self.__measuring += 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__measuring -= 1
+
+    @staticmethod
+    def target(event: pymongo.monitoring.CommandStartedEvent) -> str:
+        """
+        Get the collection of a command (`database/collection`), the database for the other commands
+        """
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            return f"{event.database_name}/{collection}"
+
+        return event.database_name
+
+    def started(self, event):
+        key = (event.connection_id, event.request_id)
+        request_bytes = len(bson.encode(event.command)) if self.__measuring else 0
+        with self.__lock:
+            self.__pending[key] = (self.target(event), request_bytes)
+
+    def __finish(self, event, reply_bytes: int, failed: bool):
+        with self.__lock:
+            target, request_bytes = self.__pending.pop((event.connection_id, event.request_id), (event.database_name, 0))
+
+        self.stats.record(target, event.command_name, event.duration_micros / 1000, request_bytes, reply_bytes, failed)
+
+    def succeeded(self, event):
+        self.__finish(event, len(bson.encode(event.reply)) if self.__measuring else 0, False)
+
+    def failed(self, event):
+        self.__finish(event, 0, True)
+
+
+
+MONGO_LISTENER = MongoCommandListener()
+
+
+
+def summarize(calls: pd.DataFrame, prefix: str, policy: str = DEFAULT_POLICY) -> dict:
+    """
+    Turn the calls of an asset into Dagster metadata
+
+    Parameters:
+        - `calls` - see `Stats.since`
+        - `prefix` - the prefix of the metadata keys (e.g. `mongo`)
+        - `policy` - the metadata policy (see `operations.metadata`) - `off` leaves out the breakdown, `sampled` caps it
+
+    Output:
+        - the total round trips, failures, latency and bytes (if measured - see `MongoCommandListener.measure_bytes`),
+          and the per target / operation breakdown
+    """
+    if len(calls) == 0:
+        return {f"{prefix}_round_trips": 0}
+
+    metadata = {
+        f"{prefix}_round_trips": int(calls["calls"].sum()),
+        f"{prefix}_failed": int(calls["failed"].sum()),
+        f"{prefix}_latency_ms": round(float(calls["latency_ms"].sum()), 1)
+    }
+
+    total_bytes = int(calls["request_bytes"].sum() + calls["reply_bytes"].sum())
+    if total_bytes:
+        metadata[f"{prefix}_bytes"] = total_bytes
+
+    if policy == "off":
+        return metadata
+
+    table = calls.head(MAX_VALUES[policy]).assign(latency_ms=calls["latency_ms"].round(1))
+    metadata[f"{prefix}_calls"] = MarkdownMetadataValue(table.to_markdown(index=False))
+
+    return metadata
+
+
+
+def profiling_enabled(context: AssetExecutionContext, tag: str = PROFILE_TAG) -> bool:
+    """
+    Check whether the current asset has been selected for profiling with the `ngt/profile` (or `ngt/memory`) run tag
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `tag` - `PROFILE_TAG` or `MEMORY_TAG`
+
+    Output:
+        - `True` if the asset should be profiled
+    """
+    selected = context.run.tags.get(tag)
+    if not selected:
+        return False
+
+    names = {name.strip() for name in selected.split(",")}
+    return "*" in names or context.asset_key.path[-1] in names
+
+
+
+@contextmanager
+def profile(top: int = 25):
+    """
+    Profile the block with pyinstrument (if installed) or cProfile
+
+    Parameters:
+        - `top` - the number of functions in the cProfile report
+
+    Output:
+        - a dictionary that holds the text report (`report`) once the block has finished
+    """
+    result = {}
+
+    try:
+        from pyinstrument import Profiler
+    except ImportError: # Optional - fall back to the standard library
+        Profiler = None
+
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield result
+        finally:
+            profiler.stop()
+            result["report"] = profiler.output_text(unicode=True, color=False)
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        result["report"] = report.getvalue()
+
+
+
+@contextmanager
+def trace_memory():
+    """
+    Measure the memory allocated by the block with tracemalloc (the numpy buffers of pandas are included, the Arrow
+    buffers are not) - tracing slows the block down, so it is opt-in
+
+    Output:
+        - a dictionary that holds the peak (`peak_mb`) and the memory still allocated at the end (`retained_mb`) -
+          both on top of what was allocated before the block
+    """
+    result = {}
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    try:
+        yield result
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        result["peak_mb"] = round((peak - before) / 2 ** 20, 1)
+        result["retained_mb"] = round((current - before) / 2 ** 20, 1)
+        if started:
+            tracemalloc.stop()
+
+
+
+@contextmanager
+def nullprofile():
+    """
+    Stand-in for `profile` / `trace_memory` when the asset is not profiled
+    """
+    yield {}
+
+
+
+@contextmanager
+def instrument(context: Optional[AssetExecutionContext], name: Optional[str] = None):
+    """
+    Measure the Mongo commands and HTTP calls of the block (and profile it / measure its Mongo bytes / trace its memory
+    if requested with the `ngt/profile` / `ngt/memory` run tags), add them to the metadata of the asset and feed the exported metrics
+    (see `operations.metrics`)
+
+    Parameters:
+        - `context` - the asset's execution context (no metadata is added if `None`)
+        - `name` - the asset name used by the metrics
+
+    Output:
+        - a dictionary that the block can set the number of produced `rows` in
+    """
+    mongo, http = MONGO_STATS.snapshot(), HTTP_STATS.snapshot()
+    profiled = context is not None and profiling_enabled(context)
+    traced = context is not None and profiling_enabled(context, MEMORY_TAG)
+    measured = {"rows": None}
+    start = time.perf_counter()
+
+    try:
+        with profile() if profiled else nullprofile() as report, trace_memory() if traced else nullprofile() as memory, \
+                MONGO_LISTENER.measure_bytes() if profiled else nullprofile():
+            yield measured
+    except Exception:
+        metrics.ASSET_FAILURES.labels(name).inc()
+        raise
+
+    seconds = time.perf_counter() - start
+    mongo_calls = MONGO_STATS.since(mongo)
+    metrics.observe_asset(name, measured["rows"], seconds, mongo_calls)
+
+    if context is None:
+        return
+
+    policy = get_policy(context)
+    metadata = {
+        "compute_s": round(seconds, 3),
+        **summarize(mongo_calls, "mongo", policy),
+        **summarize(HTTP_STATS.since(http), "http", policy)
+    }
+    if profiled:
+        metadata["profile"] = MarkdownMetadataValue(f"```\n{report['report']}\n```")
+
+    if traced:
+        metadata.update({"peak_traced_mb": memory["peak_mb"], "retained_traced_mb": memory["retained_mb"]})
+
+    context.add_output_metadata(metadata)
+
+
+
+def output_rows(output) -> Optional[int]:
+    """
+    Get the number of rows an asset has returned - its `rows` metadata, else the length of its DataFrame(s)
+
+    Parameters:
+        - `output` - the returned `Output` / `MaterializeResult`
+
+    Output:
+        - the number of rows (`None` if unknown)
+    """
+    metadata = getattr(output, "metadata", None) or {}
+    if isinstance(metadata.get("rows"), int):
+        return metadata["rows"]
+
+    value = getattr(output, "value", None)
+    frames = value if isinstance(value, tuple) else (value,)
+    if all(isinstance(frame, pd.DataFrame) for frame in frames):
+        return sum(len(frame) for frame in frames)
+
+    return None
+
+
+
+def instrumented(func: Callable) -> Callable:
+    """
+    Decorate an asset function (below `@asset`) so that its Mongo commands, HTTP calls and (opt-in) profile
+    are added to its metadata and its throughput is exported - the asset runs with pandas Copy-on-Write (see `COPY_ON_WRITE`)
+
+    Parameters:
+        - `func` - the asset function
+
+    Output:
+        - the decorated function (same signature)
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        context = signature.bind_partial(*args, **kwargs).arguments.get("context")
+        name = context.asset_key.path[-1] if context is not None else func.__name__
+
+        with pd.option_context(COPY_ON_WRITE, True), instrument(context, name) as measured:
+            output = func(*args, **kwargs)
+            measured["rows"] = output_rows(output)
+
+        return output
+
+    return wrapper
+
+
+
+# The metadata that is summarized per asset at the end of a run
+SUMMARY_COLUMNS = ["rows", "compute_s", "peak_traced_mb", "mongo_round_trips", "mongo_latency_ms", "mongo_bytes", "http_round_trips", "http_latency_ms"]
+
+def run_summary(materializations: list) -> pd.DataFrame:
+    """
+    Create the summary table of a run from the metadata of its materializations
+
+    Parameters:
+        - `materializations` - the run's `AssetMaterialization`s
+
+    Output:
+        - one row per asset, slowest first
+    """
+    rows = []
+    for materialization in materializations:
+        metadata = materialization.metadata
+        rows.append({
+            "asset": materialization.asset_key.to_user_string(),
+            **{column: metadata[column].value for column in SUMMARY_COLUMNS if column in metadata}
+        })
+
+    summary = pd.DataFrame(rows, columns=["asset", *SUMMARY_COLUMNS])
+    return summary.sort_values("compute_s", ascending=False, ignore_index=True)
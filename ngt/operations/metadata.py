@@ -0,0 +1,90 @@
+from dagster import AssetExecutionContext, MarkdownMetadataValue
+from typing import Callable, Iterable, Optional
+import pandas as pd
+
+# The run tag that selects how much metadata the assets write (set per job in `jobs`, can be overridden per run)
+METADATA_TAG = "ngt/metadata"
+
+# - `off` - only the counts (no previews / summaries)
+# - `sampled` - small previews and capped summaries
+# - `full` - the full previews (still capped so that the event log stays small)
+POLICIES = ("off", "sampled", "full")
+DEFAULT_POLICY = "sampled"
+
+PREVIEW_ROWS = {"sampled": 5, "full": 20}
+MAX_CHARACTERS = {"sampled": 2_000, "full": 20_000}
+MAX_VALUES = {"sampled": 10, "full": 100}
+
+def get_policy(context: Optional[AssetExecutionContext]) -> str:
+    """
+    Get the metadata policy of the current run
+
+    Parameters:
+        - `context` - the asset's execution context
+
+    Output:
+        - `off`, `sampled` or `full` (`DEFAULT_POLICY` if the tag is missing or unknown)
+    """
+    if context is None:
+        return DEFAULT_POLICY
+
+    policy = context.run.tags.get(METADATA_TAG, DEFAULT_POLICY)
+    return policy if policy in POLICIES else DEFAULT_POLICY
+
+
+
+def cap(text: str, characters: int) -> str:
+    """
+    Cut a text at the last complete line within `characters`
+    """
+    if len(text) <= characters:
+        return text
+
+    end = text.rfind("\n", 0, characters) + 1 or characters
+    return text[:end] + f"... ({len(text) - end} more characters)"
+
+
+
+def preview(context: AssetExecutionContext, build: Callable[[int], pd.DataFrame], key: str = "preview") -> dict:
+    """
+    Create a markdown preview - `build` is only called if the policy asks for a preview
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `build` - returns the previewed table given the number of rows (e.g. `lambda rows: data.head(rows)`)
+        - `key` - the metadata key
+
+    Output:
+        - the metadata (empty if the policy is `off`)
+    """
+    policy = get_policy(context)
+    if policy == "off":
+        return {}
+
+    table = build(PREVIEW_ROWS[policy]).head(PREVIEW_ROWS[policy])
+    return {key: MarkdownMetadataValue(cap(table.to_markdown(index=False), MAX_CHARACTERS[policy]))}
+
+
+
+def summary(context: AssetExecutionContext, values: Callable[[], Iterable], key: str) -> dict:
+    """
+    Join values (e.g. the fund codes of a file) into one text - `values` is only called if the policy asks for summaries
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `values` - returns the values
+        - `key` - the metadata key
+
+    Output:
+        - the metadata (empty if the policy is `off`)
+    """
+    policy = get_policy(context)
+    if policy == "off":
+        return {}
+
+    values = [str(value) for value in values()]
+    text = "; ".join(values[:MAX_VALUES[policy]])
+    if len(values) > MAX_VALUES[policy]:
+        text += f" (+{len(values) - MAX_VALUES[policy]} more)"
+
+    return {key: text}
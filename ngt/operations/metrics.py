@@ -0,0 +1,212 @@
+from typing import Optional
+import datetime
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError: # Optional - the metrics are no-ops without it
+    prometheus_client = None
+
+# The Dagster steps run in their own processes - set `PROMETHEUS_MULTIPROC_DIR` (an empty, shared folder) for the
+# Dagster processes, the workers and the exporter so that the exporter sees the metrics of all of them
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class NoopMetric:
+    """
+    Stand-in for a metric when `prometheus_client` is not installed
+    """
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def set(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+
+
+def counter(name: str, description: str, labels: tuple = ()):
+    """
+    Create a counter (a no-op without `prometheus_client`)
+    """
+    return prometheus_client.Counter(name, description, labels) if prometheus_client else NoopMetric()
+
+
+
+def histogram(name: str, description: str, labels: tuple = (), buckets: tuple = DURATION_BUCKETS):
+    """
+    Create a histogram (a no-op without `prometheus_client`)
+    """
+    return prometheus_client.Histogram(name, description, labels, buckets=buckets) if prometheus_client else NoopMetric()
+
+
+
+def gauge(name: str, description: str, labels: tuple = (), multiprocess_mode: str = "livemin"):
+    """
+    Create a gauge (a no-op without `prometheus_client`) - `multiprocess_mode` combines the values of several processes
+    """
+    return prometheus_client.Gauge(name, description, labels, multiprocess_mode=multiprocess_mode) if prometheus_client else NoopMetric()
+
+
+
+# Assets (see `operations.instrumentation.instrumented`) - rows/s = rate(rows_total) / rate(compute_seconds_sum)
+ASSET_ROWS = counter("ngt_asset_rows", "Rows returned by an asset", ("asset",))
+ASSET_COMPUTE_SECONDS = histogram("ngt_asset_compute_seconds", "Compute time of an asset", ("asset",))
+ASSET_FAILURES = counter("ngt_asset_failures", "Failed asset computations", ("asset",))
+MONGO_COMMANDS = counter("ngt_mongo_commands", "Mongo commands sent by the assets", ("target", "operation"))
+MONGO_COMMAND_SECONDS = counter("ngt_mongo_command_seconds", "Time spent in the Mongo commands of the assets", ("target", "operation"))
+
+# Resources
+HTTP_REQUESTS = counter("ngt_http_requests", "HTTP requests", ("host", "endpoint", "status"))
+HTTP_REQUEST_SECONDS = histogram("ngt_http_request_seconds", "HTTP request latency", ("host", "endpoint"), LATENCY_BUCKETS)
+OPENFIGI_RATELIMIT_REMAINING = gauge("ngt_openfigi_ratelimit_remaining", "Requests left in the current OpenFIGI rate limit window")
+FIGIS_LEASED = counter("ngt_figis_leased", "FIGIs leased from the OpenFIGI queue")
+
+# Workers
+FIGIS_FETCHED = counter("ngt_figis_fetched", "FIGIs fetched by the OpenFIGI worker", ("result",))
+EMAILS_SENT = counter("ngt_emails_sent", "Outbox emails handled by the sender", ("result",))
+
+
+
+def observe_asset(asset: str, rows: Optional[int], seconds: float, mongo_calls=None):
+    """
+    Record one asset computation
+
+    Parameters:
+        - `asset` - the asset name
+        - `rows` - the number of returned rows (`None` if unknown)
+        - `seconds` - the compute time
+        - `mongo_calls` - the asset's Mongo commands (see `instrumentation.Stats.since`)
+    """
+    ASSET_COMPUTE_SECONDS.labels(asset).observe(seconds)
+    if rows:
+        ASSET_ROWS.labels(asset).inc(rows)
+
+    if mongo_calls is None:
+        return
+
+    for call in mongo_calls.itertuples(index=False):
+        MONGO_COMMANDS.labels(call.target, call.operation).inc(call.calls)
+        MONGO_COMMAND_SECONDS.labels(call.target, call.operation).inc(call.latency_ms / 1000)
+
+
+
+def observe_http(host: str, endpoint: str, status: str, seconds: float, headers: Optional[dict] = None):
+    """
+    Record one HTTP request (and the OpenFIGI rate limit headroom of its response)
+
+    Parameters:
+        - `host` - the API host
+        - `endpoint` - the endpoint (e.g. `search`)
+        - `status` - the HTTP status code (`error` if there was no response)
+        - `seconds` - the request latency
+        - `headers` - the response headers
+    """
+    HTTP_REQUESTS.labels(host, endpoint, status).inc()
+    HTTP_REQUEST_SECONDS.labels(host, endpoint).observe(seconds)
+
+    if not headers:
+        return
+
+    remaining = headers.get("ratelimit-remaining", headers.get("x-ratelimit-remaining"))
+    if remaining is not None:
+        OPENFIGI_RATELIMIT_REMAINING.set(float(remaining))
+
+
+
+class QueueCollector:
+
+    def __init__(self, mongo):
+        """
+        Read the queue depths and ages from Mongo on every scrape - the numbers are always current,
+        no matter whether a sensor or a worker has looked at the queues recently
+
+        Parameters:
+            - `mongo` - the Mongo resource
+        """
+        self.mongo = mongo
+
+    @staticmethod
+    def backlog(collection, query: dict, group) -> list[dict]:
+        """
+        Get the number of documents and the oldest `upload_timestamp` per `group` (an aggregation expression) value
+        """
+        pipeline = [
+            {"$match": query},
+            {"$group": {"_id": group, "count": {"$sum": 1}, "oldest": {"$min": "$upload_timestamp"}}}
+        ]
+        return list(collection.aggregate(pipeline))
+
+    @staticmethod
+    def age(oldest: Optional[datetime.datetime], now: datetime.datetime) -> float:
+        return (now - oldest).total_seconds() if oldest else 0.0
+
+    def collect(self):
+        now = datetime.datetime.now()
+
+        depth = GaugeMetricFamily("ngt_figi_queue_depth", "FIGIs waiting for the OpenFIGI API", labels=["status"])
+        age = GaugeMetricFamily("ngt_figi_queue_oldest_seconds", "Age of the oldest waiting FIGI", labels=["status"])
+        for group in self.backlog(self.mongo.figi_queue, {"completed_timestamp": None}, "$status"):
+            depth.add_metric([str(group["_id"])], group["count"])
+            age.add_metric([str(group["_id"])], self.age(group["oldest"], now))
+        yield depth
+        yield age
+
+        outbox_depth = GaugeMetricFamily("ngt_email_outbox_depth", "Outbox emails that have not been sent", labels=["status"])
+        outbox_age = GaugeMetricFamily("ngt_email_outbox_oldest_seconds", "Age of the oldest unsent outbox email", labels=["status"])
+        for group in self.backlog(self.mongo.email_outbox, {"status": {"$ne": "sent"}}, "$status"):
+            outbox_depth.add_metric([str(group["_id"])], group["count"])
+            outbox_age.add_metric([str(group["_id"])], self.age(group["oldest"], now))
+        yield outbox_depth
+        yield outbox_age
+
+        pending = GaugeMetricFamily("ngt_hitl_pending", "Faulty rows waiting for a human", labels=["mode", "emailed"])
+        pending_age = GaugeMetricFamily("ngt_hitl_oldest_pending_seconds", "Age of the oldest faulty row waiting for a human", labels=["mode"])
+        for mode, collection in (("portfolios", self.mongo.inconsistent_portfolio), ("trades", self.mongo.inconsistent_trades)):
+
+            oldest = None
+            emailed = {"$cond": [{"$ifNull": ["$emailed_timestamp", False]}, "true", "false"]}
+            for group in self.backlog(collection, {"status": "pending"}, emailed):
+                pending.add_metric([mode, group["_id"]], group["count"])
+                oldest = min(filter(None, [oldest, group["oldest"]]), default=None)
+
+            pending_age.add_metric([mode], self.age(oldest, now))
+        yield pending
+        yield pending_age
+
+
+
+def get_registry(mongo=None):
+    """
+    Create the registry that is exported - the metrics of all processes (multiprocess mode) or of this process,
+    plus the queue metrics
+
+    Parameters:
+        - `mongo` - the Mongo resource (no queue metrics if `None`)
+
+    Output:
+        - the registry
+    """
+    if prometheus_client is None:
+        raise ImportError("Install `prometheus_client` to export the metrics")
+
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+
+    if mongo is not None:
+        registry.register(QueueCollector(mongo))
+
+    return registry
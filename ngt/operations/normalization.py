@@ -0,0 +1,112 @@
+from typing import Any, Callable, Iterable, Optional
+import pandas as pd
+
+
+class PrefixTrie:
+
+    def __init__(self, prefixes: Iterable[str]):
+        """
+        Character trie used to match a value against many prefixes in a single pass
+
+        Parameters:
+            - `prefixes` - the prefixes that will be matched
+        """
+        self.__root: dict = {}
+
+        for prefix in prefixes:
+            node = self.__root
+            for character in prefix:
+                node = node.setdefault(character, {})
+            node[None] = prefix
+
+
+
+    def match(self, value: str) -> Optional[str]:
+        """
+        Find the longest prefix of `value`
+
+        Parameters:
+            - `value` - the value to be matched
+
+        Output:
+            - the longest matching prefix or `None`
+        """
+        node = self.__root
+        found = node.get(None)
+
+        for character in value:
+            node = node.get(character)
+            if node is None:
+                break
+            found = node.get(None, found)
+
+        return found
+
+
+
+def map_unique(values: pd.Series, func: Callable[[Any], Any]) -> pd.Series:
+    """
+    Apply `func` once per distinct value of the column and broadcast the results back to the rows.
+    Missing values are not passed to `func` and stay missing.
+
+    Parameters:
+        - `values` - the column to be mapped
+        - `func` - the function applied to every distinct value
+
+    Output:
+        - the mapped column (same index as `values`)
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = pd.Series([func(value) for value in uniques], dtype=object)
+
+    return pd.Series(mapped.reindex(codes).to_numpy(), index=values.index, name=values.name)
+
+
+
+def prefix_match(values: pd.Series, prefixes: Iterable[str], upper: bool = True) -> pd.Series:
+    """
+    Match every value against all prefixes at once (replaces one `.str.startswith` pass per prefix)
+
+    Parameters:
+        - `values` - the column to be matched
+        - `prefixes` - the prefixes that will be matched
+        - `upper` - upper case the values before matching
+
+    Output:
+        - the longest matching prefix for every row (`NaN` if nothing matched)
+    """
+    trie = PrefixTrie(prefixes)
+    normalize = (lambda value: str(value).upper()) if upper else str
+
+    return map_unique(values, lambda value: trie.match(normalize(value)))
+
+
+
+def replace_unique(values: pd.Series, old: str, new: str) -> pd.Series:
+    """
+    `str.replace` computed once per distinct value
+
+    Parameters:
+        - `values` - the string column
+        - `old` - the substring to be replaced
+        - `new` - the replacement
+
+    Output:
+        - the replaced column
+    """
+    return map_unique(values, lambda value: value.replace(old, new))
+
+
+
+def strftime_unique(values: pd.Series, format: str = "%Y-%m-%d") -> pd.Series:
+    """
+    `dt.strftime` computed once per distinct date
+
+    Parameters:
+        - `values` - the datetime column
+        - `format` - the output date format
+
+    Output:
+        - the formatted dates
+    """
+    return map_unique(values, lambda value: value.strftime(format))
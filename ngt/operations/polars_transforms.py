@@ -0,0 +1,171 @@
+from typing import Optional
+import pandas as pd
+
+try:
+    import polars as pl
+except ImportError: # Optional - only needed by the `polars` engine (see `engine`)
+    pl = None
+
+# The transformations of `transforms` as lazy, multi-threaded Polars query plans - the rows go in and come out as pandas
+# (the assets and the I/O managers stay pandas), everything in between is one optimized plan per call.
+# Missing values come out as `None` in the string columns (pandas: `NaN`)
+
+def lazy(data: pd.DataFrame) -> "pl.LazyFrame":
+    """
+    Turn the rows into a lazy frame (`NaN` becomes null so that `is_null` matches pandas' `isna`)
+    """
+    return pl.from_pandas(data, nan_to_null=True).lazy()
+
+
+
+def parse_datetime(data: pd.DataFrame, column: str, format: Optional[str] = None) -> "pl.Expr":
+    """
+    Parse a date column like `pd.to_datetime` (the Excel files already have datetimes)
+
+    Parameters:
+        - `data` - the rows
+        - `column` - the date column
+        - `format` - the date format (inferred if `None`)
+
+    Output:
+        - the expression of the parsed column
+    """
+    if pd.api.types.is_datetime64_any_dtype(data[column]):
+        return pl.col(column).cast(pl.Datetime("ns"))
+
+    return pl.col(column).str.to_datetime(format, time_unit="ns")
+
+
+
+def to_text(column: str) -> "pl.Expr":
+    """
+    `astype(str)` of a number column (missing values are "nan" like in pandas) with "-" replaced by "NEG"
+    """
+    return pl.col(column).cast(pl.Utf8).fill_null("nan").str.replace_all("-", "NEG", literal=True)
+
+
+
+def portfolio_ids(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    See `transforms.portfolio_ids`
+    """
+    bbg_id = pl.concat_str([pl.col("nt_bloomberg_code"), pl.col("nt_bloomberg_code_of_underlying")], separator="/").fill_null(pl.col("nt_bloomberg_code"))
+    identifier = pl.col("nt_figi_code").fill_null(bbg_id).fill_null(pl.col("nt_security_name").str.replace_all(" ", "_", literal=True))
+
+    # `roll="forward"` makes a weekend date go back to the Friday like `- pd.offsets.BDay()`
+    plan = lazy(data)\
+        .with_columns(parse_datetime(data, "nx_date"))\
+        .with_columns(date=pl.col("nx_date").dt.add_business_days(-1, roll="forward"))\
+        .unique(keep="first", maintain_order=True)\
+        .with_columns(id=pl.concat_str([
+            pl.col("date").dt.strftime("%Y-%m-%d"), pl.col("nt_pool_fund_code"), pl.col("nt_issuer_country_code"),
+            pl.col("nt_gti_code").cast(pl.Utf8), identifier, to_text("nt_quantity")
+        ], separator="/"))\
+        .select("id", pl.exclude("id"))
+
+    return plan.collect().to_pandas()
+
+
+
+def fill_by_figi(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    See `transforms.fill_by_figi`
+    """
+    has_figi = pl.col("figi_code").is_not_null()
+    first = lambda column: pl.col(column).drop_nulls().first().over("figi_code")
+
+    plan = lazy(data).with_columns([
+        pl.when(has_figi).then(pl.col(column).fill_null(first(column))).otherwise(pl.col(column)).alias(column)
+        for column in data.columns if column != "figi_code"
+    ])
+
+    return plan.collect().to_pandas()
+
+
+
+def trade_filter(data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    See `transforms.trade_filter`
+    """
+    quantity, price = pl.col("nt_transaction_quantity"), pl.col("nt_transaction_price")
+    invalid = quantity.is_null() | price.is_null() | (quantity == 0) | (price == 0)
+
+    rows = lazy(data)
+    missing = rows.filter(invalid)
+    valid = rows.filter(~invalid)
+
+    # Null Bloomberg codes / currencies are not a group (pandas drops them from `groupby`)
+    groups = ["nt_bloomberg_code", "nt_security_currency"]
+    conflict = pl.all_horizontal(pl.col(groups).is_not_null())\
+        & (pl.len().over([*groups, "nt_trade_date"]) > 1)\
+        & (pl.len().over([*groups, "nt_transaction_price"]) == 1)
+
+    valid = valid.with_columns(conflict.alias("conflict"))
+    conflicting = valid.filter(pl.col("conflict")).drop("conflict")
+    missing = pl.concat([missing, conflicting])
+
+    # One run for the three outputs - the shared part of the plans is only computed once
+    data, missing, conflicting = pl.collect_all([valid.filter(~pl.col("conflict")).drop("conflict"), missing, conflicting])
+
+    return data.to_pandas(), missing.to_pandas(), conflicting.to_pandas()
+
+
+
+def trade_ids(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    See `transforms.trade_ids`
+    """
+    trade_id = pl.concat_str([
+        pl.col("nt_trade_date").dt.strftime("%Y-%m-%d"), pl.col("nt_accounting_date").dt.strftime("%Y-%m-%d"),
+        pl.col("nt_fund_code"), pl.col("nt_gti_code").cast(pl.Utf8), pl.col("nt_security_description").str.replace_all(" ", "_", literal=True),
+        pl.col("nt_security_currency"), pl.col("nt_transaction_price").cast(pl.Utf8)
+    ], separator="/")
+
+    plan = lazy(data)\
+        .with_columns(
+            parse_datetime(data, "nx_date", "%m/%d/%Y"),
+            parse_datetime(data, "nx_date", "%m/%d/%Y").alias("nt_accounting_date"),
+            parse_datetime(data, "nt_trade_date", "%m/%d/%Y %H:%M:%S")
+        )\
+        .with_columns(id=pl.concat_str([trade_id, pl.lit("("), to_text("nt_transaction_quantity"), pl.lit(")")]))\
+        .select("id", pl.exclude("id"))
+
+    return plan.collect().to_pandas()
+
+
+
+def portfolio_instruments(data: pd.DataFrame, column_mappings: dict[str, str]) -> pd.DataFrame:
+    """
+    See `transforms.portfolio_instruments`
+    """
+    # `ne_missing` keeps the rows without a quantity like pandas' `NaN != 0`
+    plan = lazy(data)\
+        .filter(pl.col("nt_quantity").ne_missing(0))\
+        .select([pl.col(column).alias(name) for column, name in column_mappings.items()])\
+        .unique(keep="first", maintain_order=True)
+
+    return plan.collect().to_pandas()
+
+
+
+def unique_figis(instruments: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """
+    See `transforms.unique_figis`
+    """
+    nulls = pl.sum_horizontal([pl.col(column).is_null().cast(pl.UInt32) for column in instruments.columns])
+    rows = lazy(instruments).with_columns(
+        nulls.alias("nulls"),
+        pl.int_range(pl.len()).alias("row"),
+        (pl.col("figi_code").is_not_null() & (pl.len().over("figi_code") > 1)).alias("duplicated")
+    )
+
+    best = pl.col("row").sort_by(["nulls", "row"]).first().over("figi_code")
+    unique = rows\
+        .filter(~pl.col("duplicated") | (pl.col("row") == best))\
+        .filter(pl.col("yellow_key_code").is_not_null())\
+        .drop("nulls", "row", "duplicated")
+    duplicates = rows.filter(pl.col("duplicated")).select(pl.col("figi_code").n_unique())
+
+    unique, duplicates = pl.collect_all([unique, duplicates])
+
+    return unique.to_pandas(), duplicates.item()
@@ -0,0 +1,198 @@
+from typing import Optional
+from .normalization import map_unique
+from .. import constants
+import pandas as pd
+import pymongo
+import pymongo.collection
+import datetime
+
+# The columns that send a portfolio row to the HITL when they are missing
+REPAIR_COLUMNS = ["yellow_key_code", "issuer_country_code", "security_currency"]
+
+# The columns that identify the same security across portfolios
+LOOKUP_KEYS = ["figi_code", "bloomberg_code"]
+
+def exchange_code(bloomberg_codes: pd.Series) -> pd.Series:
+    """
+    Get the exchange code of the Bloomberg codes (e.g. `UW` for "TSLA UW")
+
+    Parameters:
+        - `bloomberg_codes` - the Bloomberg codes
+
+    Output:
+        - the known exchange codes (missing otherwise)
+    """
+    def get_exchange(code: str) -> Optional[str]:
+        tokens = str(code).split()
+        if len(tokens) != 2 or tokens[1] not in constants.BLOOMBERG_EXCHANGE_COUNTRIES:
+            return None
+        return tokens[1]
+
+    return map_unique(bloomberg_codes, get_exchange)
+
+
+
+def unique_values(collection: pymongo.collection.Collection, key: str, values: list, columns: list[str]) -> dict[str, dict]:
+    """
+    Get the value of every column that is unambiguous (exactly one distinct non-missing value) per key.
+    One aggregation per key, backed by an index on the key.
+
+    Parameters:
+        - `collection` - the collection with the clean rows
+        - `key` - the lookup column (e.g. `figi_code`)
+        - `values` - the key values that are looked up
+        - `columns` - the columns that will be returned
+
+    Output:
+        - the column to the key value to column value mappings
+    """
+    lookups = {column: {} for column in columns}
+    if not values:
+        return lookups
+
+    collection.create_index(key)
+
+    pipeline = [
+        {"$match": {key: {"$in": values}}},
+        {"$group": {
+            "_id": f"${key}",
+            **{column: {"$addToSet": f"${column}"} for column in columns}
+        }}
+    ]
+
+    for document in collection.aggregate(pipeline):
+        for column in columns:
+            found = [value for value in document[column] if value is not None and value == value]
+            if len(found) == 1:
+                lookups[column][document["_id"]] = found[0]
+
+    return lookups
+
+
+
+def load_corrections(collection: pymongo.collection.Collection, data: pd.DataFrame) -> dict[str, dict[str, dict]]:
+    """
+    Get the corrections that have been learned from the completed HITL rows
+
+    Parameters:
+        - `collection` - the HITL corrections collection
+        - `data` - the rows that will be repaired
+
+    Output:
+        - the key to column to key value to correction mappings
+    """
+    corrections = {key: {column: {} for column in REPAIR_COLUMNS} for key in LOOKUP_KEYS}
+
+    query = {"$or": [
+        {"key": key, "value": {"$in": data[key].dropna().unique().tolist()}} for key in LOOKUP_KEYS if key in data.columns
+    ]}
+    if not query["$or"]:
+        return corrections
+
+    for document in collection.find(query, {"_id": 0}):
+        corrections[document["key"]][document["column"]][document["value"]] = document["correction"]
+
+    return corrections
+
+
+
+def save_corrections(collection: pymongo.collection.Collection, fixed: pd.DataFrame) -> int:
+    """
+    Learn the corrections of a fixed HITL file - every fixed column of a security is stored
+    under its FIGI / Bloomberg code so that the next occurrence is repaired automatically
+
+    Parameters:
+        - `collection` - the HITL corrections collection
+        - `fixed` - the fixed HITL rows (with their `column_name`)
+
+    Output:
+        - the number of new / changed corrections
+    """
+    if len(fixed) == 0 or "column_name" not in fixed.columns:
+        return 0
+
+    collection.create_index([("key", 1), ("value", 1), ("column", 1)], unique=True)
+
+    now = datetime.datetime.now()
+    requests = []
+
+    for column in REPAIR_COLUMNS:
+
+        if column not in fixed.columns:
+            continue
+
+        rows = fixed.loc[(fixed["column_name"] == column) & fixed[column].notna()]
+
+        for key in LOOKUP_KEYS:
+            if key not in rows.columns:
+                continue
+
+            pairs = rows[[key, column]].dropna().drop_duplicates(subset=key, keep="last")
+            requests += [
+                pymongo.UpdateOne(
+                    {"key": key, "value": value, "column": column},
+                    {"$set": {"correction": correction, "upload_timestamp": now}},
+                    upsert=True
+                )
+                for value, correction in pairs.itertuples(index=False)
+            ]
+
+    if not requests:
+        return 0
+
+    result = collection.bulk_write(requests, ordered=False)
+    return result.upserted_count + result.modified_count
+
+
+
+def repair(data: pd.DataFrame, corrections: dict, history: dict, currencies: dict) -> tuple[pd.DataFrame, dict]:
+    """
+    Fill the missing HITL columns before the rows are sent to humans. Every source only fills
+    what is still missing, in this order:
+        - (1) the corrections learned from the completed HITL rows
+        - (2) the unambiguous value of the same security in the clean portfolios
+        - (3) the rules - security master currency by FIGI, country / yellow key from the Bloomberg exchange code
+
+    A missing fund code is never filled from the partition - those rows run in the catch-all partition
+    (see `partitions.CATCH_ALL_FUND`), not in the partition of their fund.
+
+    Parameters:
+        - `data` - the rows that will be repaired
+        - `corrections` - see `load_corrections`
+        - `history` - the key to `unique_values` of the clean portfolios
+        - `currencies` - the FIGI to security master currency mapping
+
+    Output:
+        - the repaired rows and the number of repairs per column / source
+    """
+    repairs = {}
+
+    def fill(column: str, source: str, values: pd.Series):
+        missing = data[column].isna() & values.notna()
+        if missing.sum() == 0:
+            return
+
+        data.loc[missing, column] = values.loc[missing]
+        repairs[f"{column}/{source}"] = int(missing.sum())
+
+    for column in REPAIR_COLUMNS:
+
+        if column not in data.columns or data[column].isna().sum() == 0:
+            continue
+
+        # (1) Learned corrections - (2) History
+        for source, lookups in (("corrections", corrections), ("history", history)):
+            for key in LOOKUP_KEYS:
+                if key in data.columns:
+                    fill(column, f"{source}/{key}", data[key].map(lookups[key][column]))
+
+    # (3) Rules
+    if "security_currency" in data.columns and "figi_code" in data.columns:
+        fill("security_currency", "security_master", data["figi_code"].map(currencies))
+
+    if "bloomberg_code" in data.columns:
+        exchange = exchange_code(data["bloomberg_code"])
+        fill("issuer_country_code", "exchange", exchange.map(constants.BLOOMBERG_EXCHANGE_COUNTRIES))
+        fill("yellow_key_code", "exchange", exchange.notna().map({True: "Equity", False: None}))
+
+    return data, repairs
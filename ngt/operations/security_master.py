@@ -0,0 +1,528 @@
+from typing import Optional
+from ..resources import Mongo
+import pandas as pd
+import pymongo
+import pymongo.collection
+import pymongo.errors
+import datetime
+import hashlib
+import json
+import uuid
+
+API_FIELDS = {
+    "security_type": "securityType",
+    "yellow_key_code": "marketSector",
+    "security_type_2": "securityType2"
+}
+
+# The attributes of a security that come from the uploads (the OpenFIGI fields are added by the enrichment)
+SECURITY_ATTRIBUTES = [
+    "security_name", "yellow_key_code", "underlying_security_name", "ccy", "figi_code", "bbg_code",
+    "underlying_bbg_code", "gti_code", "second_quotation_ccy", "issuer_country_code", "issuer_country"
+]
+
+def mark_enriched(mongo: Mongo, figis: list[tuple[str, Optional[str]]], now: datetime.datetime):
+    """
+    Set the security master timestamp of the queued FIGIs with a single bulk write
+
+    Parameters:
+        - `mongo` - the Mongo resource
+        - `figis` - the (FIGI, currency) pairs
+        - `now` - the security master timestamp
+    """
+    if not figis:
+        return
+
+    requests = [
+        pymongo.UpdateMany(
+            {"nt_figi_code": code, "nt_security_currency": ccy},
+            {"$set": {"security_master_timestamp": now}}
+        )
+        for code, ccy in figis
+    ]
+    mongo.figi_queue.bulk_write(requests, ordered=False)
+
+
+
+def enriched_version(security: dict, update: dict, now: datetime.datetime) -> tuple[dict, Optional[dict]]:
+    """
+    Version the enrichment of a keyed security like an upload (see `write_securities`) - the attributes hash is
+    recomputed and the version is bumped if any field changes
+
+    Parameters:
+        - `security` - the security master document before the enrichment
+        - `update` - the enriched fields
+        - `now` - the upload timestamp
+
+    Output:
+        - the fields to set (with `attributes_hash` / `version` for a keyed security)
+        - the history version (`None` if nothing changed or the security has no key yet)
+    """
+    if security.get("security_key") is None:
+        return update, None
+
+    changes = {field: value for field, value in update.items() if field != "upload_timestamp" and value != security.get(field)}
+    digest = attributes_hash({**security, **update})
+    if not changes:
+        return {**update, "attributes_hash": digest}, None
+
+    version = (security.get("version") or 0) + 1
+    history = {
+        "security_key": security["security_key"],
+        "version": version,
+        "changes": changes,
+        "previous": {field: security.get(field) for field in changes},
+        "attributes_hash": digest,
+        "timestamp": now
+    }
+
+    return {**update, "attributes_hash": digest, "version": version}, history
+
+
+
+def enrich_security_master(mongo: Mongo, figis: list[tuple[str, Optional[str]]], attempts: int = 3) -> dict:
+    """
+    Add the FIGI info from the OpenFIGI API data to the security master.
+    The API data and the securities are read with one `$in` query each and written with one bulk write.
+    The enriched securities get a new attributes hash / version (see `enriched_version`) - a security changed by a
+    concurrent writer in the meantime is read and enriched again, up to `attempts` times.
+
+    Parameters:
+        - `mongo` - the Mongo resource
+        - `figis` - the (FIGI, currency) pairs that will be enriched
+        - `attempts` - the number of read / write rounds
+
+    Output:
+        - the number of updated and skipped securities
+    """
+    metadata = {
+        "updates": 0,
+        "skips": 0
+    }
+    if not figis:
+        return metadata
+
+    now = datetime.datetime.now()
+    pairs = set(figis)
+    codes = list({code for code, _ in pairs})
+
+    # (1) The first API result of every (FIGI, currency)
+    api_data = {}
+    for document in mongo.open_figi.find({"figi": {"$in": codes}}):
+        key = (document["figi"], document.get("ccy"))
+        if key in pairs and key not in api_data:
+            api_data[key] = document
+
+    # (2) The securities of the found FIGIs
+    securities = [
+        security for security in mongo.security_master.find({"figi_code": {"$in": codes}})
+        if (security["figi_code"], security.get("ccy")) in api_data
+    ]
+    enriched = {(security["figi_code"], security.get("ccy")) for security in securities}
+
+    versions = []
+    for _ in range(attempts):
+
+        # Every write of this round carries the same ID - a re-read tells the applied writes from the lost ones
+        write_id = uuid.uuid4().hex
+        requests, plans = [], {}
+        for security in securities:
+
+            data = api_data[(security["figi_code"], security.get("ccy"))]
+            update = {field: data.get(api_field) for field, api_field in API_FIELDS.items()}
+            update["upload_timestamp"] = now
+
+            if not security.get("security_name"):
+                update["security_name"] = data.get("ticker")
+
+            update, plans[security["_id"]] = enriched_version(security, update, now)
+            requests.append(pymongo.UpdateOne({"_id": security["_id"], "version": security.get("version")}, {"$set": {**update, "write_id": write_id}}))
+
+        if not requests:
+            break
+
+        mongo.security_master.bulk_write(requests, ordered=False)
+        applied = {document["_id"] for document in mongo.security_master.find({"_id": {"$in": list(plans)}, "write_id": write_id}, {"_id": 1})}
+
+        metadata["updates"] += len(applied)
+        versions += [version for _id, version in plans.items() if _id in applied and version is not None]
+
+        missed = [_id for _id in plans if _id not in applied]
+        securities = list(mongo.security_master.find({"_id": {"$in": missed}})) if missed else []
+
+    if versions:
+        mongo.security_master_history.insert_many(versions)
+
+    mark_enriched(mongo, list(pairs), now)
+    metadata["skips"] = len(pairs - enriched)
+
+    return metadata
+
+
+
+def enrich_security_master_server_side(mongo: Mongo, figis: list[tuple[str, Optional[str]]]) -> dict:
+    """
+    Same as `enrich_security_master` but the join is done by the database - the API data is grouped
+    per (FIGI, currency) and `$merge`d into the security master, so no API documents are sent to the client.
+    The target securities are resolved first and merged `on` `_id`, so no unique index is needed on the security
+    master (it holds FIGI-less rows and legacy duplicates). The hash of the attributes cannot be computed by the
+    database - the keyed targets are read again after the merge and get their new hash / version (see `enriched_version`).
+
+    Parameters:
+        - `mongo` - the Mongo resource
+        - `figis` - the (FIGI, currency) pairs that will be enriched
+
+    Output:
+        - the number of enriched FIGIs and target securities
+    """
+    metadata = {
+        "figis": len(set(figis)),
+        "securities": 0
+    }
+    if not figis:
+        return metadata
+
+    now = datetime.datetime.now()
+    pairs = set(figis)
+    security_master = mongo.security_master
+
+    # (1) The securities of the FIGIs (the currency is always set so that `null` matches `null`)
+    projection = [*SECURITY_ATTRIBUTES, *API_FIELDS.keys(), "security_key", "version"]
+    securities = {
+        security["_id"]: security
+        for security in security_master.find({"figi_code": {"$in": list({code for code, _ in pairs})}}, projection)
+        if (security["figi_code"], security.get("ccy")) in pairs
+    }
+    targets = [{"_id": _id, "figi_code": security["figi_code"], "ccy": security.get("ccy")} for _id, security in securities.items()]
+    metadata["securities"] = len(targets)
+
+    # (2) The API data of every (FIGI, currency) is merged into each of its securities
+    if targets:
+        pipeline = [
+            {"$match": {"$or": [{"figi": code, "ccy": ccy} for code, ccy in pairs]}},
+            {"$group": {
+                "_id": {"figi_code": "$figi", "ccy": "$ccy"},
+                "ticker": {"$first": "$ticker"},
+                **{field: {"$first": f"${api_field}"} for field, api_field in API_FIELDS.items()}
+            }},
+            {"$set": {"targets": {"$filter": {
+                "input": {"$literal": targets},
+                "as": "target",
+                "cond": {"$and": [
+                    {"$eq": ["$$target.figi_code", "$_id.figi_code"]},
+                    {"$eq": ["$$target.ccy", "$_id.ccy"]}
+                ]}
+            }}}},
+            {"$unwind": "$targets"},
+            {"$project": {
+                "_id": "$targets._id",
+                "ticker": 1,
+                **{field: 1 for field in API_FIELDS.keys()}
+            }},
+            {"$merge": {
+                "into": {"db": security_master.database.name, "coll": security_master.name},
+                "on": "_id",
+                "whenMatched": [{"$set": {
+                    "security_name": {"$cond": [
+                        {"$eq": [{"$ifNull": ["$security_name", ""]}, ""]}, "$$new.ticker", "$security_name"
+                    ]},
+                    **{field: f"$$new.{field}" for field in API_FIELDS.keys()},
+                    "upload_timestamp": now
+                }}],
+                "whenNotMatched": "discard"
+            }}
+        ]
+        mongo.open_figi.aggregate(pipeline)
+
+    # (3) The new hash / version of the keyed targets - a target changed by a concurrent writer since (1) keeps the
+    # hash / version of that writer (the write ID tells the applied writes from the lost ones)
+    keyed = [_id for _id, security in securities.items() if security.get("security_key") is not None]
+    write_id = uuid.uuid4().hex
+    requests, versions = [], {}
+    for merged in (security_master.find({"_id": {"$in": keyed}}, projection) if keyed else []):
+
+        security = securities[merged["_id"]]
+        update, versions[merged["_id"]] = enriched_version(security, {field: merged.get(field) for field in [*API_FIELDS.keys(), "security_name"]}, now)
+        requests.append(pymongo.UpdateOne({"_id": merged["_id"], "version": security.get("version")}, {"$set": {**update, "write_id": write_id}}))
+
+    if requests:
+        security_master.bulk_write(requests, ordered=False)
+        applied = {document["_id"] for document in security_master.find({"_id": {"$in": keyed}, "write_id": write_id}, {"_id": 1})}
+        history = [version for _id, version in versions.items() if _id in applied and version is not None]
+        if history:
+            mongo.security_master_history.insert_many(history)
+
+    mark_enriched(mongo, list(pairs), now)
+
+    return metadata
+
+
+
+def clean_value(value):
+    """
+    `None` for the missing values (`NaN`, `NaT`, `pd.NA`)
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+
+
+def security_key(attributes: dict) -> str:
+    """
+    Get the key of a security in the security master (same as `duckdb_master.SECURITY_KEY_SQL`)
+
+    Parameters:
+        - `attributes` - the security's attributes (missing values are `None`)
+
+    Output:
+        - the FIGI, else `bbg:` + Bloomberg Code (+ "/" + underlying Bloomberg Code), else `name:` + security name + "/" + currency
+    """
+    if attributes.get("figi_code") is not None:
+        return str(attributes["figi_code"])
+
+    if attributes.get("bbg_code") is not None:
+        underlying = attributes.get("underlying_bbg_code")
+        return f"bbg:{attributes['bbg_code']}" + (f"/{underlying}" if underlying is not None else "")
+
+    return f"name:{attributes.get('security_name') or ''}/{attributes.get('ccy') or ''}"
+
+
+
+def attributes_hash(attributes: dict) -> str:
+    """
+    Hash the upload attributes of a security - the values are compared as text, so the pandas and DuckDB builds
+    (`CAST(... AS VARCHAR)`) of the same row get the same hash
+    """
+    values = [None if attributes.get(column) is None else str(attributes[column]) for column in SECURITY_ATTRIBUTES]
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()
+
+
+
+def known_securities(collection: pymongo.collection.Collection, securities: list[dict]) -> dict[str, dict]:
+    """
+    Merge the securities of an upload into their known attributes (see `upsert_securities`)
+
+    Parameters:
+        - `collection` - the security master collection
+        - `securities` - the cleaned securities (`SECURITY_ATTRIBUTES`)
+
+    Output:
+        - the known document, the merged attributes and the changed fields of every security key
+    """
+    keys = list(dict.fromkeys(security_key(security) for security in securities))
+
+    # The known securities - one `$in` query (+ one for the legacy documents without a key)
+    projection = [*SECURITY_ATTRIBUTES, "security_key", "attributes_hash", "version"]
+    documents = {document["security_key"]: document for document in collection.find({"security_key": {"$in": keys}}, projection)}
+
+    # The legacy documents are matched by the attributes of their key (FIGI, else Bloomberg Code, else name) and the key
+    # is computed again, e.g. a legacy document with the Bloomberg Code but another underlying is not adopted
+    legacy = [security for security in securities if security_key(security) not in documents]
+    if legacy:
+        figis = list({security["figi_code"] for security in legacy if security["figi_code"] is not None})
+        bbg_codes = list({security["bbg_code"] for security in legacy if security["figi_code"] is None and security["bbg_code"] is not None})
+        names = list({security["security_name"] for security in legacy if security["figi_code"] is None and security["bbg_code"] is None})
+
+        # The old uploads could store `NaN` for the missing values - the keys are filtered once cleaned
+        query = {"security_key": None, "$or": [
+            {"figi_code": {"$in": figis}},
+            {"bbg_code": {"$in": bbg_codes}},
+            {"security_name": {"$in": names}}
+        ]}
+        wanted = {security_key(security) for security in legacy}
+        for document in collection.find(query, projection).sort("upload_timestamp", pymongo.ASCENDING):
+            key = security_key({column: clean_value(document.get(column)) for column in SECURITY_ATTRIBUTES})
+            if key in wanted:
+                documents[key] = document
+
+    # A key can be uploaded more than once
+    states = {}
+    for security in securities:
+
+        key = security_key(security)
+        if key not in states:
+            document = documents.get(key)
+            attributes = {column: document.get(column) for column in SECURITY_ATTRIBUTES} if document else None
+            states[key] = {"document": document, "attributes": attributes, "changes": {}}
+
+        state = states[key]
+        if state["attributes"] is None:
+            state["attributes"] = dict(security)
+            continue
+
+        if state["document"] is not None and attributes_hash(security) == state["document"].get("attributes_hash"):
+            continue
+
+        for column, value in security.items():
+            current = state["attributes"][column]
+            if value is not None and (current is None or str(value) != str(current)):
+                state["attributes"][column] = value
+                state["changes"][column] = value
+
+    return states
+
+
+
+def write_securities(collection: pymongo.collection.Collection, states: dict[str, dict], now: datetime.datetime, metadata: dict) -> tuple[list[dict], list[dict], set[str]]:
+    """
+    Write the inserts / changed fields of the merged securities with one bulk write and find out which of them
+    have actually been applied (see `upsert_securities`)
+
+    Parameters:
+        - `collection` - the security master collection
+        - `states` - see `known_securities`
+        - `now` - the upload timestamp
+        - `metadata` - the counts (updated in place with the applied writes)
+
+    Output:
+        - the history versions and the written securities of the applied writes
+        - the keys that have to be merged again (a concurrent writer got there first)
+    """
+    # Every write of this call carries the same ID - a re-read tells the applied writes from the lost ones
+    write_id = uuid.uuid4().hex
+
+    requests, plans, unchanged = [], [], 0
+    for key, state in states.items():
+
+        document, attributes, changes = state["document"], state["attributes"], state["changes"]
+        digest = attributes_hash(attributes)
+
+        if document is None:
+            requests.append(pymongo.UpdateOne(
+                {"security_key": key},
+                {"$setOnInsert": {**attributes, "security_key": key, "attributes_hash": digest, "version": 1, "upload_timestamp": now, "write_id": write_id}},
+                upsert=True
+            ))
+            plans.append({
+                "key": key,
+                "_id": None,
+                "version": {"security_key": key, "version": 1, "changes": attributes, "previous": {}, "attributes_hash": digest, "timestamp": now},
+                "written": {**attributes, "security_key": key, "version": 1, "upload_timestamp": now},
+                "adopted": False
+            })
+            continue
+
+        adopted = "security_key" not in document
+        if not changes and not adopted:
+            unchanged += 1
+            continue
+
+        version = (document.get("version") or 0) + (1 if changes else 0)
+        requests.append(pymongo.UpdateOne(
+            {"_id": document["_id"], "version": document.get("version")},
+            {"$set": {**changes, "security_key": key, "attributes_hash": digest, "version": version, "upload_timestamp": now, "write_id": write_id}}
+        ))
+        plans.append({
+            "key": key,
+            "_id": document["_id"],
+            "version": {
+                "security_key": key,
+                "version": version,
+                "changes": changes,
+                "previous": {column: document.get(column) for column in changes},
+                "attributes_hash": digest,
+                "timestamp": now
+            } if changes else None,
+            "written": {**attributes, "security_key": key, "version": version, "upload_timestamp": now},
+            "adopted": adopted
+        })
+
+    metadata["unchanged"] += unchanged
+    if not requests:
+        return [], [], set()
+
+    # A duplicate key (a concurrent insert / adoption of the same key) only fails its own request
+    try:
+        upserted = collection.bulk_write(requests, ordered=False).upserted_ids
+    except pymongo.errors.BulkWriteError as error:
+        if any(write_error["code"] != 11000 for write_error in error.details["writeErrors"]):
+            raise
+        upserted = {document["index"]: document["_id"] for document in error.details["upserted"]}
+
+    # An update is applied if its document carries this call's write ID (a version miss matched nothing)
+    ids = [plan["_id"] for plan in plans if plan["_id"] is not None]
+    updated = {document["_id"] for document in collection.find({"_id": {"$in": ids}, "write_id": write_id}, {"_id": 1})} if ids else set()
+
+    versions, written, retry = [], [], set()
+    for index, plan in enumerate(plans):
+
+        inserted = plan["_id"] is None
+        if (inserted and index not in upserted) or (not inserted and plan["_id"] not in updated):
+            retry.add(plan["key"])
+            continue
+
+        written.append(plan["written"])
+        if plan["version"] is not None:
+            versions.append(plan["version"])
+
+        if inserted:
+            metadata["inserted"] += 1
+        elif plan["version"] is not None:
+            metadata["updated"] += 1
+        metadata["adopted"] += int(plan["adopted"])
+
+    return versions, written, retry
+
+
+
+def upsert_securities(mongo: Mongo, securities: list[dict], now: Optional[datetime.datetime] = None, attempts: int = 3) -> tuple[dict, list[dict]]:
+    """
+    Write the securities of an upload to the security master - one document per security key (see `security_key`).
+    A security that is already known is skipped if its attributes hash did not change, else only its changed fields
+    are set. A missing value never erases a known one (the files of the funds are not equally complete) and every
+    applied insert / change is recorded in the history collection as one version with the changed fields only.
+
+    The documents written before the security keys are adopted (the latest document of the FIGI / Bloomberg Code /
+    name and currency gets the key - the older near-duplicates are left as they are).
+
+    A write that loses against a concurrent writer (a changed version, an insert / adoption of the same key) is
+    not recorded - its security is merged into the new state and written again, up to `attempts` times.
+
+    Parameters:
+        - `mongo` - the Mongo resource
+        - `securities` - the securities (`SECURITY_ATTRIBUTES`)
+        - `now` - the upload timestamp
+        - `attempts` - the number of merge / write rounds
+
+    Output:
+        - the counts (inserted, updated, unchanged, adopted, conflicts - the securities that were never written)
+        - the attributes / key / version / upload timestamp of every written security
+    """
+    now = now or datetime.datetime.now()
+    collection = mongo.security_master
+    history = mongo.security_master_history
+
+    metadata = {
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "adopted": 0,
+        "conflicts": 0
+    }
+    if not securities:
+        return metadata, []
+
+    # The legacy documents have no key - the unique index only covers the keyed ones
+    collection.create_index("security_key", unique=True, partialFilterExpression={"security_key": {"$type": "string"}})
+    history.create_index([("security_key", 1), ("version", 1)])
+
+    pending = [{column: clean_value(security.get(column)) for column in SECURITY_ATTRIBUTES} for security in securities]
+    versions, written = [], []
+
+    for _ in range(attempts):
+
+        applied_versions, applied, retry = write_securities(collection, known_securities(collection, pending), now, metadata)
+        versions += applied_versions
+        written += applied
+
+        pending = [security for security in pending if security_key(security) in retry]
+        if not pending:
+            break
+
+    metadata["conflicts"] = len({security_key(security) for security in pending})
+
+    if versions:
+        history.insert_many(versions)
+
+    return metadata, written
@@ -0,0 +1,169 @@
+from .normalization import replace_unique, strftime_unique
+import pandas as pd
+
+# The DataFrame transformations of the upload assets that do not touch Mongo - the reference (pandas) engine.
+# `polars_transforms` implements the same functions as lazy Polars query plans (see `engine`)
+
+# The raw columns with few distinct values that are never written to after loading - stored as categories
+# (one code per row instead of one string per row). The repaired / harmonized columns (currency, country code,
+# Yellow Code, fund code) stay strings because new values cannot be assigned to a category
+CATEGORY_COLUMNS = ["nt_gti_code", "nt_quotation_code", "nt_quotation_name", "nt_second_quotation_currency", "nt_issuer_country_name"]
+
+def categorize(data: pd.DataFrame, columns: list[str] = CATEGORY_COLUMNS) -> pd.DataFrame:
+    """
+    Turn the low cardinality columns into categories (in place)
+
+    Parameters:
+        - `data` - the raw rows
+        - `columns` - the columns (the missing ones are skipped)
+
+    Output:
+        - the same DataFrame
+    """
+    for column in columns:
+        if column in data.columns and data[column].dtype == object:
+            data[column] = data[column].astype("category")
+
+    return data
+
+
+
+def portfolio_ids(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse the report date, drop the duplicated rows and create the unique ID of every portfolio row
+
+    Parameters:
+        - `data` - the raw portfolio rows
+
+    Output:
+        - the unique rows with `date` (the business day before `nx_date`) and `id` (first column)
+    """
+    data = data.assign(nx_date=pd.to_datetime(data["nx_date"]))
+    data["date"] = data["nx_date"] - pd.offsets.BDay()
+    data = data.drop_duplicates().reset_index(drop=True)
+
+    # FIGI, else Bloomberg Code (+ "/" + underlying Bloomberg Code), else security name
+    # A code column with only numbers (or no values) is read as float - its values are joined as text like in polars
+    underlying = data["nt_bloomberg_code_of_underlying"]
+    underlying = underlying.astype(object).where(underlying.isna(), underlying.astype(str))
+    bbg_id = (data["nt_bloomberg_code"] + "/" + underlying).fillna(data["nt_bloomberg_code"])
+    identifier = data["nt_figi_code"].fillna(bbg_id).fillna(replace_unique(data["nt_security_name"], " ", "_"))
+
+    id = strftime_unique(data["date"]) + "/" + data["nt_pool_fund_code"] + "/" + data["nt_issuer_country_code"] + "/" + data["nt_gti_code"].astype(object) + "/" + identifier + "/" + data["nt_quantity"].astype(str).str.replace("-", "NEG")
+    data.insert(0, "id", id)
+
+    return data
+
+
+
+def fill_by_figi(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fill the missing values of every row with the first known value of its FIGI (rows without a FIGI are kept as they are)
+
+    Parameters:
+        - `data` - the portfolio rows
+
+    Output:
+        - the filled rows
+    """
+    columns = data.columns.drop("figi_code")
+    firsts = data.groupby("figi_code")[columns].transform("first")
+
+    return data.fillna(firsts)
+
+
+
+def trade_filter(data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Split the trades into the valid and the missing ones - a trade is missing if its price or quantity is 0 / NaN,
+    or if another trade of the same security / currency has the same date but a different price
+
+    Parameters:
+        - `data` - the unique raw trades (`trades_file_data` is the only place where the trades are de-duplicated)
+
+    Output:
+        - the valid trades
+        - the missing trades
+        - the trades with a conflicting price (included in the missing trades)
+    """
+    query = data["nt_transaction_quantity"].isna() | data["nt_transaction_price"].isna() | (data["nt_transaction_quantity"] == 0) | (data["nt_transaction_price"] == 0)
+
+    missing = data.loc[query].reset_index(drop=True)
+    data = data.loc[~query].reset_index(drop=True)
+
+    # The groups without a Bloomberg code / currency have no size (NaN > 1 is False)
+    groups = ["nt_bloomberg_code", "nt_security_currency"]
+    same_date = data.groupby([*groups, "nt_trade_date"])["nt_trade_date"].transform("size") > 1
+    same_price = data.groupby([*groups, "nt_transaction_price"])["nt_transaction_price"].transform("size") > 1
+    conflicts = same_date & ~same_price
+
+    conflicting = data.loc[conflicts].reset_index(drop=True)
+    missing = pd.concat([missing, conflicting], ignore_index=True)
+
+    return data.loc[~conflicts].reset_index(drop=True), missing, conflicting
+
+
+
+def trade_ids(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse the dates and create the unique ID of every trade
+
+    Parameters:
+        - `data` - the valid trades (see `trade_filter`)
+
+    Output:
+        - the trades with the parsed dates (`nt_accounting_date` is the booking date `nx_date`) and `id` (first column)
+    """
+    data = data.assign(
+        nx_date = pd.to_datetime(data["nx_date"], format="%m/%d/%Y"),
+        nt_accounting_date = pd.to_datetime(data["nx_date"], format="%m/%d/%Y"),
+        nt_trade_date = pd.to_datetime(data["nt_trade_date"], format="%m/%d/%Y %H:%M:%S")
+    )
+
+    id = strftime_unique(data["nt_trade_date"]) + "/" + strftime_unique(data["nt_accounting_date"]) + "/"+ data["nt_fund_code"] + "/" + data["nt_gti_code"].astype(object) + "/" + replace_unique(data["nt_security_description"], " ", "_") + "/" + data["nt_security_currency"] + "/" + data["nt_transaction_price"].astype(str) + "(" + data["nt_transaction_quantity"].astype(str).str.replace("-", "NEG") + ")"
+    data.insert(0, "id", id)
+
+    return data
+
+
+
+def portfolio_instruments(data: pd.DataFrame, column_mappings: dict[str, str]) -> pd.DataFrame:
+    """
+    Get the distinct instruments of the portfolio rows with a quantity
+
+    Parameters:
+        - `data` - the raw portfolio rows
+        - `column_mappings` - the raw column to the security master column
+
+    Output:
+        - the distinct instruments
+    """
+    data = data.loc[data["nt_quantity"] != 0]
+
+    return data[list(column_mappings.keys())].rename(columns=column_mappings).drop_duplicates().reset_index(drop=True)
+
+
+
+def unique_figis(instruments: pd.DataFrame) -> tuple[pd.DataFrame, int]:
+    """
+    Keep one instrument per FIGI - the one with the fewest missing values (the first one on a tie) - and drop the
+    instruments without a Yellow Code
+
+    Parameters:
+        - `instruments` - the instruments
+
+    Output:
+        - the unique instruments (in their original order)
+        - the number of FIGIs that had duplicates
+    """
+    instruments = instruments.reset_index(drop=True)
+
+    # The instruments without a FIGI have no size (NaN > 1 is False) and are all kept
+    duplicated = instruments.groupby("figi_code")["figi_code"].transform("size") > 1
+    nulls = instruments.isna().sum(axis=1)
+    best = nulls.loc[duplicated].groupby(instruments.loc[duplicated, "figi_code"]).idxmin()
+
+    keep = ~duplicated
+    keep.loc[best] = True
+
+    return instruments.loc[keep].dropna(subset="yellow_key_code").reset_index(drop=True), len(best)
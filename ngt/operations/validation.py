@@ -0,0 +1,99 @@
+from typing import Callable, NamedTuple
+import numpy as np
+import pandas as pd
+import datetime
+
+class Rule(NamedTuple):
+    """
+    A validation rule - `valid` returns `True` for every row that passes
+    """
+    name: str
+    column: str
+    comment: str
+    valid: Callable[[pd.DataFrame], pd.Series]
+
+
+
+def not_missing(name: str, column: str, comment: str) -> Rule:
+    """
+    Create a rule that fails the rows where `column` is missing
+    """
+    return Rule(name, column, comment, lambda data: data[column].notna())
+
+
+
+# The rows that fail any of these are sent to the HITL
+PORTFOLIO_RULES = [
+    not_missing("pool_fund_code", "pool_fund_code", "No Fund Code found."),
+    not_missing("yellow_key_code", "yellow_key_code", "No Bloomberg Yellow Key Code found."),
+    not_missing("issuer_country_code", "issuer_country_code", "No country code found."),
+    not_missing("security_currency", "security_currency", "No security currency found.")
+]
+
+PORTFOLIO_DATE_RULES = [
+    Rule("business_day", "date", "The business date is a weekend.", lambda data: pd.to_datetime(data["date"]).dt.dayofweek < 5),
+    Rule("not_in_future", "date", "The business date is in the future.", lambda data: pd.to_datetime(data["date"]) <= datetime.datetime.now())
+]
+
+TRADES_DATE_RULES = [
+    Rule("not_in_future", "trade_date", "The trade date is in the future.", lambda data: pd.to_datetime(data["trade_date"]) <= datetime.datetime.now()),
+    Rule("accounting_after_trade", "accounting_date", "The accounting date is before the trade date.", lambda data: pd.to_datetime(data["accounting_date"]) >= pd.to_datetime(data["trade_date"]).dt.normalize())
+]
+
+def validate(data: pd.DataFrame, rules: list[Rule]) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    Evaluate all of the rules at once
+
+    Parameters:
+        - `data` - the rows that will be validated
+        - `rules` - the rules (at most 63)
+
+    Output:
+        - the failure matrix (one boolean column per rule, `True` = failed) and the failure bitmask of every row
+          (bit `i` is set if rule `i` failed, 0 = valid)
+    """
+    failures = pd.DataFrame(
+        {rule.name: ~rule.valid(data).fillna(False).astype(bool).to_numpy() for rule in rules},
+        index=data.index
+    )
+
+    weights = np.left_shift(1, np.arange(len(rules), dtype=np.int64))
+    bitmask = pd.Series(failures.to_numpy(dtype=np.int64) @ weights, index=data.index)
+
+    return failures, bitmask
+
+
+
+def rule_counts(failures: pd.DataFrame) -> dict[str, int]:
+    """
+    Get the number of failed rows per rule
+
+    Parameters:
+        - `failures` - the failure matrix (see `validate`)
+
+    Output:
+        - the rule name to failed rows mapping
+    """
+    return {name: int(count) for name, count in failures.sum().items()}
+
+
+
+def failed_rows(data: pd.DataFrame, failures: pd.DataFrame, rules: list[Rule]) -> pd.DataFrame:
+    """
+    Get one row per failed rule and row with the failed `column_name` and `comment` (the HITL format)
+
+    Parameters:
+        - `data` - the validated rows
+        - `failures` - the failure matrix (see `validate`)
+        - `rules` - the rules that created the matrix
+
+    Output:
+        - the failed rows, grouped by rule
+    """
+    rule_index, row_index = np.nonzero(failures.to_numpy().T)
+
+    faulty = data.iloc[row_index].reset_index(drop=True)
+    faulty.insert(1, "column_name", np.array([rule.column for rule in rules], dtype=object)[rule_index])
+    faulty.insert(2, "comment", np.array([rule.comment for rule in rules], dtype=object)[rule_index])
+
+    return faulty
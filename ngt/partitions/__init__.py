@@ -0,0 +1,173 @@
+from dagster import DailyPartitionsDefinition, StaticPartitionsDefinition, MultiPartitionsDefinition, MultiPartitionKey, AssetExecutionContext
+from typing import Mapping, Optional
+from .. import constants
+import datetime
+import pandas as pd
+
+daily_partitions = DailyPartitionsDefinition(start_date=constants.PARTITIONS_START_DATE)
+
+fund_partitions = StaticPartitionsDefinition(constants.FUND_CODES)
+
+date_fund_partitions = MultiPartitionsDefinition({
+    "date": daily_partitions,
+    "fund": fund_partitions
+})
+
+# The rows without a known fund code (missing or not one of `constants.FUND_CODES`) belong to the partition of
+# this fund - otherwise they would belong to no partition and never reach the validation / HITL
+CATCH_ALL_FUND = constants.FUND_CODES[0]
+
+
+
+def get_partition_scope(context: AssetExecutionContext) -> Optional[dict]:
+    """
+    Get the business date range and fund code of the current partition
+
+    Parameters:
+        - `context` - the asset's execution context
+
+    Output:
+        - `start` (inclusive), `end` (exclusive) and `fund` of the partition or `None` if the run is not partitioned
+    """
+    if not context.has_partition_key:
+        return None
+
+    keys = context.partition_key.keys_by_dimension
+    start = datetime.datetime.strptime(keys["date"], "%Y-%m-%d")
+
+    return {
+        "start": start,
+        "end": start + datetime.timedelta(days=1),
+        "fund": keys["fund"]
+    }
+
+
+
+def partition_mask(context: AssetExecutionContext, dates: pd.Series, funds: pd.Series) -> pd.Series:
+    """
+    Get the rows that belong to the current partition
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `dates` - the business dates of the rows
+        - `funds` - the fund codes of the rows
+
+    Output:
+        - `True` for every row within the partition (all rows if the run is not partitioned)
+    """
+    scope = get_partition_scope(context)
+    if scope is None:
+        return pd.Series(True, index=dates.index)
+
+    if scope["fund"] == CATCH_ALL_FUND:
+        in_fund = ~funds.isin(other_funds(scope["fund"]))
+    else:
+        in_fund = funds == scope["fund"]
+
+    return (dates >= scope["start"]) & (dates < scope["end"]) & in_fund
+
+
+
+def other_funds(fund: str) -> list[str]:
+    """
+    Get the fund codes of the other partitions
+    """
+    return [code for code in constants.FUND_CODES if code != fund]
+
+
+
+def unknown_funds(funds: pd.Series) -> pd.Series:
+    """
+    Get the rows without a known fund code (see `CATCH_ALL_FUND`)
+    """
+    return ~funds.isin(constants.FUND_CODES)
+
+
+
+def partition_query(context: AssetExecutionContext, date_field: str, fund_field: str) -> dict:
+    """
+    Get the Mongo query that scopes a collection to the current partition
+
+    Parameters:
+        - `context` - the asset's execution context
+        - `date_field` - the business date field
+        - `fund_field` - the fund code field
+
+    Output:
+        - the query (empty if the run is not partitioned)
+    """
+    return scope_query(get_partition_scope(context), date_field, fund_field)
+
+
+
+def get_run_partition_scope(tags: Mapping[str, str]) -> Optional[dict]:
+    """
+    Get the partition scope from the run's tags (e.g. inside an asset check, which has no partition key)
+
+    Parameters:
+        - `tags` - the run's tags
+
+    Output:
+        - see `get_partition_scope`
+    """
+    date = tags.get("dagster/partition/date")
+    fund = tags.get("dagster/partition/fund")
+    if date is None or fund is None:
+        return None
+
+    start = datetime.datetime.strptime(date, "%Y-%m-%d")
+
+    return {
+        "start": start,
+        "end": start + datetime.timedelta(days=1),
+        "fund": fund
+    }
+
+
+
+def scope_query(scope: Optional[dict], date_field: str, fund_field: str) -> dict:
+    """
+    Get the Mongo query of a partition scope
+
+    Parameters:
+        - `scope` - see `get_partition_scope`
+        - `date_field` - the business date field
+        - `fund_field` - the fund code field
+
+    Output:
+        - the query (empty if there is no scope)
+    """
+    if scope is None:
+        return {}
+
+    # `$nin` also matches the missing / null fund codes
+    fund = {"$nin": other_funds(scope["fund"])} if scope["fund"] == CATCH_ALL_FUND else scope["fund"]
+
+    return {
+        date_field: {"$gte": scope["start"], "$lt": scope["end"]},
+        fund_field: fund
+    }
+
+
+
+def get_partition_keys(dates: pd.Series, funds: pd.Series) -> list[MultiPartitionKey]:
+    """
+    Get all of the partitions that the rows of a file fall into (the rows without a known fund code fall into
+    the `CATCH_ALL_FUND` partition)
+
+    Parameters:
+        - `dates` - the business dates of the rows
+        - `funds` - the fund codes of the rows
+
+    Output:
+        - the (date, fund) partition keys
+    """
+    funds = funds.astype(object).where(~unknown_funds(funds), CATCH_ALL_FUND)
+    keys = pd.DataFrame({"date": dates.dt.strftime("%Y-%m-%d"), "fund": funds})\
+                .dropna()\
+                .drop_duplicates()\
+                .sort_values(["date", "fund"])
+
+    keys = keys.loc[keys["date"] >= constants.PARTITIONS_START_DATE]
+
+    return [MultiPartitionKey({"date": date, "fund": fund}) for date, fund in keys.itertuples(index=False)]
@@ -1,18 +1,39 @@
-from dagster import ConfigurableResource
-from typing import Optional, Union
+from dagster import ConfigurableResource, ConfigurableIOManager, InputContext, OutputContext, InitResourceContext
+from typing import Callable, Optional, Union
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import smtplib
+import tempfile
+import pickle
+import json
 import os
 import pandas as pd
 import requests
 import pymongo
 import pymongo.collection
+import pymongo.database
+import datetime
+import uuid
+import time
+from .. import constants
+from ..operations.instrumentation import MONGO_LISTENER, HTTP_STATS, COPY_ON_WRITE
+from ..operations import metrics
+from ..operations.hitl import mark_emailed
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError: # Optional - `ArrowIOManager` pickles the outputs without it
+    pyarrow = None
 
 class Mongo(ConfigurableResource):
 
     url: str
+    monitor: bool = True # Record the round trips / latency of every command and the bytes of the profiled assets (see `operations.instrumentation`)
+    database_prefix: str = "" # Prepended to every database name (e.g. `benchmark_` keeps the benchmarks out of the pipeline's databases)
 
     __client: Optional[pymongo.collection.Collection] = None
 
@@ -20,55 +41,462 @@ class Mongo(ConfigurableResource):
         if self.__client:
             return self.__client
         
-        self.__client = pymongo.MongoClient(self.url)
+        self.__client = pymongo.MongoClient(self.url, event_listeners=[MONGO_LISTENER] if self.monitor else [])
         return self.__client
 
+    def database(self, name: str) -> pymongo.database.Database:
+        return self.connect()[f"{self.database_prefix}{name}"]
+
     @property
     def raw_portfolio(self) -> pymongo.collection.Collection:
-        return self.connect()["raw"]["portfolio"]
+        return self.database("raw")["portfolio"]
     
     @property
     def raw_trades(self) -> pymongo.collection.Collection:
-        return self.connect()["raw"]["trades"]
+        return self.database("raw")["trades"]
     
     @property
     def processed_portfolio(self) -> pymongo.collection.Collection:
-        return self.connect()["processed"]["portfolio"]
+        return self.database("processed")["portfolio"]
     
     @property
     def inconsistent_portfolio(self) -> pymongo.collection.Collection:
-        return self.connect()["faulty"]["portfolio"]
+        return self.database("faulty")["portfolio"]
 
     @property
     def processed_trades(self) -> pymongo.collection.Collection:
-        return self.connect()["processed"]["trades"]
+        return self.database("processed")["trades"]
 
     @property
     def inconsistent_trades(self) -> pymongo.collection.Collection:
-        return self.connect()["faulty"]["trades"]
+        return self.database("faulty")["trades"]
 
     @property
     def open_figi(self) -> pymongo.collection.Collection:
-        return self.connect()["api"]["open_figi"]
+        return self.database("api")["open_figi"]
     
+    @property
+    def file_registry(self) -> pymongo.collection.Collection:
+        return self.database("raw")["file_registry"]
+
     @property
     def figi_queue(self) -> pymongo.collection.Collection:
-        return self.connect()["raw"]["figi_queue"]
+        return self.database("raw")["figi_queue"]
+
+    @property
+    def figi_dead_letter(self) -> pymongo.collection.Collection:
+        return self.database("raw")["figi_dead_letter"]
 
     @property
     def security_master(self) -> pymongo.collection.Collection:
-        return self.connect()["processed"]["security_master"]
+        return self.database("processed")["security_master"]
+
+    @property
+    def security_master_history(self) -> pymongo.collection.Collection:
+        return self.database("processed")["security_master_history"]
     
     @property
     def prices(self) -> pymongo.collection.Collection:
-        return self.connect()["processed"]["prices"]
+        return self.database("processed")["prices"]
     
     @property
     def country_codes(self) -> pymongo.collection.Collection:
-        return self.connect()["processed"]["country_mappings"]
+        return self.database("processed")["country_mappings"]
+
+    @property
+    def harmonization_aliases(self) -> pymongo.collection.Collection:
+        return self.database("processed")["harmonization_aliases"]
+
+    @property
+    def hitl_corrections(self) -> pymongo.collection.Collection:
+        return self.database("processed")["hitl_corrections"]
+
+    @property
+    def email_outbox(self) -> pymongo.collection.Collection:
+        return self.database("outbox")["email"]
+
+    @property
+    def run_summaries(self) -> pymongo.collection.Collection:
+        return self.database("monitoring")["run_summaries"]
+
+    @property
+    def worker_heartbeats(self) -> pymongo.collection.Collection:
+        return self.database("monitoring")["worker_heartbeats"]
+
+
+
+    def enqueue_figis(self, figis: list[dict]) -> int:
+        """
+        Add FIGIs to the OpenFIGI queue. Every (FIGI, currency) is queued only once,
+        so enqueueing an already queued FIGI is a no-op.
+
+        Parameters:
+            - `figis` - the `nt_figi_code`, `nt_security_currency` and `upload_timestamp` of every FIGI
+
+        Output:
+            - the number of newly queued FIGIs
+        """
+        if not figis:
+            return 0
+
+        collection = self.figi_queue
+        collection.create_index([("nt_figi_code", 1), ("nt_security_currency", 1)], unique=True)
+        collection.create_index([("completed_timestamp", 1), ("status", 1), ("available_at", 1)])
+        collection.create_index([("found", 1), ("security_master_timestamp", 1), ("completed_timestamp", 1)])
+
+        now = datetime.datetime.now()
+        requests = [
+            pymongo.UpdateOne(
+                {"nt_figi_code": figi["nt_figi_code"], "nt_security_currency": figi["nt_security_currency"]},
+                {"$setOnInsert": {
+                    "upload_timestamp": figi.get("upload_timestamp", now),
+                    "completed_timestamp": None,
+                    "status": "pending",
+                    "attempts": 0,
+                    "available_at": now
+                }},
+                upsert=True
+            )
+            for figi in figis
+        ]
+
+        return collection.bulk_write(requests, ordered=False).upserted_count
+
+
+
+    def lease_figis(self, limit: int, visibility_timeout: int = constants.FIGI_QUEUE_VISIBILITY_TIMEOUT) -> list[dict]:
+        """
+        Atomically claim up to `limit` available FIGIs. A claimed FIGI is invisible to other
+        consumers until it is completed, failed or its lease expires.
+
+        Parameters:
+            - `limit` - the maximum number of FIGIs to claim
+            - `visibility_timeout` - the lease duration (seconds)
+
+        Output:
+            - the `code`, `ccy`, `lease_id` and `attempts` of every claimed FIGI
+        """
+        lease_id = str(uuid.uuid4())
+        leased = []
+
+        while len(leased) < limit:
+
+            now = datetime.datetime.now()
+            query = {
+                "completed_timestamp": None,
+                "status": {"$nin": ["dead"]},
+                "$or": [{"available_at": {"$lte": now}}, {"available_at": {"$exists": False}}]
+            }
+            update = {
+                "$set": {
+                    "status": "leased",
+                    "lease_id": lease_id,
+                    "available_at": now + datetime.timedelta(seconds=visibility_timeout)
+                },
+                "$inc": {"attempts": 1}
+            }
+
+            figi = self.figi_queue.find_one_and_update(
+                query, update,
+                sort=[("available_at", pymongo.ASCENDING)],
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if not figi:
+                break
+
+            leased.append({
+                "code": figi["nt_figi_code"],
+                "ccy": figi["nt_security_currency"],
+                "lease_id": lease_id,
+                "attempts": figi["attempts"]
+            })
+
+        metrics.FIGIS_LEASED.inc(len(leased))
+        return leased
+
+
+
+    def release_figis(self, lease_id: str) -> int:
+        """
+        Give back the FIGIs of a lease that have not been processed (e.g. on shutdown)
+
+        Parameters:
+            - `lease_id` - the lease
+
+        Output:
+            - the number of released FIGIs
+        """
+        query = {
+            "lease_id": lease_id,
+            "status": "leased"
+        }
+        update = {
+            "$set": {
+                "status": "pending",
+                "available_at": datetime.datetime.now()
+            },
+            "$unset": {"lease_id": ""},
+            "$inc": {"attempts": -1}
+        }
+
+        return self.figi_queue.update_many(query, update).modified_count
+
+
+
+    def complete_figi(self, code: str, ccy: Optional[str], found: bool, lease_id: Optional[str] = None) -> bool:
+        """
+        Mark a FIGI as fetched from the OpenFIGI API
+
+        Parameters:
+            - `code` - the FIGI
+            - `ccy` - the FIGI's currency
+            - `found` - whether the API returned any data
+            - `lease_id` - the lease that the FIGI was claimed with - nothing is done if the lease has expired and
+              the FIGI has been claimed by another consumer since
+
+        Output:
+            - `True` if the FIGI has been completed
+        """
+        query = {
+            "nt_figi_code": code,
+            "nt_security_currency": ccy,
+            **({"lease_id": lease_id} if lease_id else {})
+        }
+        update = {
+            "$set": {
+                "status": "completed",
+                "completed_timestamp": datetime.datetime.now(),
+                "found": found
+            },
+            "$unset": {"lease_id": "", "error": ""}
+        }
+
+        return self.figi_queue.update_many(query, update).modified_count > 0
+
+
+
+    def fail_figi(self, code: str, ccy: Optional[str], error: str, max_attempts: int = constants.FIGI_QUEUE_MAX_ATTEMPTS, backoff: int = constants.FIGI_QUEUE_BACKOFF, lease_id: Optional[str] = None) -> bool:
+        """
+        Release a FIGI that could not be fetched. It is retried with an exponential backoff
+        and moved to the dead letter collection after `max_attempts` attempts.
+
+        Parameters:
+            - `code` - the FIGI
+            - `ccy` - the FIGI's currency
+            - `error` - the failure reason
+            - `max_attempts` - the number of attempts before the FIGI is dead-lettered
+            - `backoff` - the base retry delay (seconds)
+            - `lease_id` - the lease that the FIGI was claimed with (see `complete_figi`)
+
+        Output:
+            - `True` if the FIGI has been dead-lettered
+        """
+        query = {
+            "nt_figi_code": code,
+            "nt_security_currency": ccy,
+            **({"lease_id": lease_id} if lease_id else {})
+        }
+        figi = self.figi_queue.find_one(query)
+        if not figi:
+            return False
+
+        now = datetime.datetime.now()
+        attempts = figi.get("attempts", 1)
+        dead = attempts >= max_attempts
+
+        update = {
+            "status": "dead" if dead else "pending",
+            "error": error,
+            "available_at": now + datetime.timedelta(seconds=backoff * 2 ** max(attempts - 1, 0))
+        }
+        result = self.figi_queue.update_one({"_id": figi["_id"], "lease_id": figi.get("lease_id")}, {"$set": update, "$unset": {"lease_id": ""}})
+        if result.modified_count == 0:
+            return False
+
+        if dead:
+            figi.update(update)
+            figi["dead_timestamp"] = now
+            self.figi_dead_letter.replace_one({"_id": figi["_id"]}, figi, upsert=True)
+
+        return dead
+
+
+
+    def heartbeat(self, worker: str, alive: bool = True):
+        """
+        Record that a long running worker is alive (or remove its heartbeat when it stops)
+
+        Parameters:
+            - `worker` - the worker name (e.g. `figi`)
+            - `alive` - `False` when the worker stops
+        """
+        if alive:
+            self.worker_heartbeats.update_one({"_id": worker}, {"$set": {"heartbeat": datetime.datetime.now()}}, upsert=True)
+        else:
+            self.worker_heartbeats.delete_one({"_id": worker})
+
+
+
+    def worker_alive(self, worker: str, timeout: int = constants.FIGI_WORKER_HEARTBEAT_TIMEOUT) -> bool:
+        """
+        Check whether a worker has sent a heartbeat within the last `timeout` seconds
+        """
+        since = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+        return self.worker_heartbeats.count_documents({"_id": worker, "heartbeat": {"$gte": since}}, limit=1) > 0
+
+
+
+    def enqueue_email(self, to: Union[list[str], str], subject: str, body: str, cc: Optional[Union[list[str], str]] = None, attachment_paths: Optional[Union[list[str], str]] = None, key: Optional[str] = None, faulty_ids: Optional[dict[str, list[str]]] = None) -> bool:
+        """
+        Add an email to the outbox. The email is sent later by the outbox sender (`python -m ngt.workers.outbox`),
+        so the caller never waits for the mail server.
+
+        Parameters:
+            - `to` - the TO email addresses
+            - `subject` - the email's subject
+            - `body` - the email's body. Can be either HTML or plain text
+            - `cc` - the CC email addresses
+            - `attachment_paths` - the attachment(s) - the files are read when the email is sent
+            - `key` - an idempotency key - an email with an already queued key is not queued again
+            - `faulty_ids` - the ids of the faulty rows (`portfolios` / `trades`) that the email reports -
+              they are marked as emailed once the email has been sent (see `complete_email`)
+
+        Output:
+            - `True` if the email has been queued
+        """
+        collection = self.email_outbox
+        collection.create_index("key", unique=True, partialFilterExpression={"key": {"$type": "string"}})
+        collection.create_index([("status", 1), ("available_at", 1)])
+
+        now = datetime.datetime.now()
+        document = {
+            "to": [to] if isinstance(to, str) else to,
+            "cc": [cc] if isinstance(cc, str) else cc,
+            "subject": subject,
+            "body": body,
+            "attachment_paths": [attachment_paths] if isinstance(attachment_paths, str) else (attachment_paths or []),
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+            "upload_timestamp": now,
+            "sent_timestamp": None,
+            "faulty_ids": faulty_ids or {}
+        }
+
+        if key is None:
+            collection.insert_one(document)
+            return True
+
+        result = collection.update_one({"key": key}, {"$setOnInsert": {**document, "key": key}}, upsert=True)
+        return result.upserted_id is not None
+
+
+
+    def lease_emails(self, limit: int, visibility_timeout: int = constants.EMAIL_OUTBOX_VISIBILITY_TIMEOUT) -> list[dict]:
+        """
+        Atomically claim up to `limit` emails of the outbox (see `lease_figis`)
+
+        Parameters:
+            - `limit` - the maximum number of emails to claim
+            - `visibility_timeout` - the lease duration (seconds)
+
+        Output:
+            - the claimed emails
+        """
+        leased = []
+
+        while len(leased) < limit:
+
+            now = datetime.datetime.now()
+            query = {
+                "status": {"$in": ["pending", "leased"]},
+                "available_at": {"$lte": now}
+            }
+            update = {
+                "$set": {
+                    "status": "leased",
+                    "available_at": now + datetime.timedelta(seconds=visibility_timeout)
+                },
+                "$inc": {"attempts": 1}
+            }
+
+            email = self.email_outbox.find_one_and_update(
+                query, update,
+                sort=[("available_at", pymongo.ASCENDING)],
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if not email:
+                break
+
+            leased.append(email)
+
+        return leased
+
+
+
+    def complete_email(self, email_id):
+        """
+        Mark an outbox email as sent and the faulty rows that it reports as emailed
+
+        Parameters:
+            - `email_id` - the email's `_id`
+        """
+        now = datetime.datetime.now()
+        update = {
+            "$set": {
+                "status": "sent",
+                "sent_timestamp": now
+            },
+            "$unset": {"error": ""}
+        }
+
+        email = self.email_outbox.find_one_and_update({"_id": email_id}, update, projection={"faulty_ids": 1})
+        collections = {
+            "portfolios": self.inconsistent_portfolio,
+            "trades": self.inconsistent_trades
+        }
+
+        # Only now - a digest that is never sent leaves its rows in the next digest
+        for mode, ids in ((email or {}).get("faulty_ids") or {}).items():
+            mark_emailed(collections[mode], ids, now)
+
+
+
+    def fail_email(self, email: dict, error: str, max_attempts: int = constants.EMAIL_OUTBOX_MAX_ATTEMPTS, backoff: int = constants.EMAIL_OUTBOX_BACKOFF) -> bool:
+        """
+        Release an email that could not be sent. It is retried with an exponential backoff
+        and marked as `dead` after `max_attempts` attempts.
+
+        Parameters:
+            - `email` - the leased email
+            - `error` - the failure reason
+            - `max_attempts` - the number of attempts before the email is given up
+            - `backoff` - the base retry delay (seconds)
+
+        Output:
+            - `True` if the email has been given up
+        """
+        attempts = email.get("attempts", 1)
+        dead = attempts >= max_attempts
+
+        update = {
+            "status": "dead" if dead else "pending",
+            "error": error,
+            "available_at": datetime.datetime.now() + datetime.timedelta(seconds=backoff * 2 ** max(attempts - 1, 0))
+        }
+        self.email_outbox.update_one({"_id": email["_id"]}, {"$set": update})
+
+        return dead
     
     
 
+class SearchCancelled(Exception):
+    """
+    The search has been stopped before its next request (see `OpenFigi.search`)
+    """
+
+
+
 class OpenFigi(ConfigurableResource):
     
     api_key: str
@@ -97,7 +525,7 @@ class OpenFigi(ConfigurableResource):
 
 
 
-    def search(self, search: str, ccy: Optional[str] = None) -> pd.DataFrame:
+    def search(self, search: str, ccy: Optional[str] = None, before_request: Optional[Callable[[], Optional[bool]]] = None) -> pd.DataFrame:
         """
         Use the OpenFigi v3 Search functionality
         https://www.openfigi.com/api#post-v3-search
@@ -105,6 +533,8 @@ class OpenFigi(ConfigurableResource):
         Parameters:
             - `search` - Key words
             - `ccy` - Currency associated to the desired instrument(s)
+            - `before_request` - called before every request (e.g. to wait for the rate limit) - the search is
+              cancelled with `SearchCancelled` if it returns `False`
 
         Output:
             - all of the fetched `data` for the given figi and currency (optional)
@@ -120,7 +550,21 @@ class OpenFigi(ConfigurableResource):
         
         while True:
 
-            response = self.session.post(url, json=query)
+            if before_request and before_request() is False:
+                raise SearchCancelled(search)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url, json=query)
+            except requests.RequestException:
+                HTTP_STATS.record("api.openfigi.com", "search", (time.perf_counter() - start) * 1000, failed=True)
+                metrics.observe_http("api.openfigi.com", "search", "error", time.perf_counter() - start)
+                raise
+
+            seconds = time.perf_counter() - start
+            HTTP_STATS.record("api.openfigi.com", "search", seconds * 1000, len(response.request.body or b""), len(response.content), not response.ok)
+            metrics.observe_http("api.openfigi.com", "search", str(response.status_code), seconds, response.headers)
+
             local_json = dict(response.json())
 
             data += local_json["data"]
@@ -140,10 +584,28 @@ class Email(ConfigurableResource):
     port: str
     username: str
     password: str
+    use_ssl: bool = True
 
-    def send(self, to: Union[list[str], str], subject: str, body: str, cc: Optional[Union[list[str], str]] = None, attachment_paths: Optional[Union[list[str], str]] = None):
+    def connect(self) -> smtplib.SMTP:
         """
-        Send an email
+        Open an authenticated SMTP connection. The connection can be reused for many emails
+        and should be closed with `quit()` (or used as a context manager).
+        """
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(host=self.host, port=int(self.port))
+        else:
+            server = smtplib.SMTP(host=self.host, port=int(self.port))
+
+        if self.username:
+            server.login(self.username, self.password)
+
+        return server
+
+
+
+    def message(self, to: Union[list[str], str], subject: str, body: str, cc: Optional[Union[list[str], str]] = None, attachment_paths: Optional[Union[list[str], str]] = None) -> MIMEMultipart:
+        """
+        Build an email
 
         Parameters:
             - `to` - the TO email addresses
@@ -151,12 +613,16 @@ class Email(ConfigurableResource):
             - `body` - the email's body. Can be either HTML or plain text
             - `cc` - the CC email addresses
             - `attachment_paths` - the attachment(s) that will be sent with the email
+
+        Output:
+            - the email message
         """
         message = MIMEMultipart()
 
         if isinstance(to, str):
             to = [to]
         
+        message["From"] = self.sender
         message["To"] = "; ".join(to)
         if cc:
             message["CC"] = "; ".join(cc if isinstance(cc, list) else [cc])
@@ -179,7 +645,259 @@ class Email(ConfigurableResource):
         body_type = "html" if body.find("<html>") != -1 or body.find("</") != -1 else "plain"
         message.attach(MIMEText(body, body_type))
 
-        server = smtplib.SMTP_SSL(host=self.host, port=int(self.port))
-        server.login(self.username, self.password)
+        return message
+
+
+
+    def send(self, to: Union[list[str], str], subject: str, body: str, cc: Optional[Union[list[str], str]] = None, attachment_paths: Optional[Union[list[str], str]] = None, server: Optional[smtplib.SMTP] = None):
+        """
+        Send an email. Prefer `Mongo.enqueue_email` inside the pipelines so that they do not wait for the mail server.
+
+        Parameters:
+            - `to` - the TO email addresses
+            - `subject` - the email's subject
+            - `body` - the email's body. Can be either HTML or plain text
+            - `cc` - the CC email addresses
+            - `attachment_paths` - the attachment(s) that will be sent with the email
+            - `server` - an open connection (see `connect`) - a new one is opened and closed if not given
+        """
+        message = self.message(to, subject, body, cc, attachment_paths)
+        to = [to] if isinstance(to, str) else to
+
+        if server is not None:
+            server.sendmail(self.sender, to, message.as_string())
+            return
+
+        with self.connect() as server:
+            server.sendmail(self.sender, to, message.as_string())
+
+
+
+# The outputs of the fused runs (`ArrowIOManager(memory=True)`) per run ID - freed at the end of the run
+MEMORY_OUTPUTS: dict[str, dict[str, object]] = {}
+
+class ArrowIOManager(ConfigurableIOManager):
+    """
+    Store the DataFrames passed between assets as Arrow IPC (memory-mapped reads) or Parquet files instead of pickles.
+    A consumer only reads what it needs:
+        - `AssetIn(metadata={"columns": [...]})` - only these columns are read
+        - `AssetIn(metadata={"parts": [...]})` - only these DataFrames of a tuple output are read (the others are empty)
+
+    Outputs that Arrow cannot store (e.g. mixed type object columns) are pickled - so is every output if pyarrow is
+    not installed.
+
+    With `memory=True` (fused runs, see `jobs.portfolio_fused_upload_job`) nothing is written - the outputs stay in the
+    memory of the run process and every consumer gets its own copy. The outputs are freed once the run is over.
+    Only works with the in-process executor and a failed fused run has to be re-run as a whole.
+    """
+
+    base_dir: Optional[str] = None # Defaults to $DAGSTER_HOME/storage like the filesystem I/O manager
+    format: str = "ipc" # "ipc" (uncompressed, memory-mapped) or "parquet" (compressed, smaller on disk)
+    memory: bool = False
+
+    __extensions = {"ipc": ".arrow", "parquet": ".parquet"}
+
+    def path(self, context: Union[InputContext, OutputContext]) -> str:
+        """
+        Get the path of an output (without extension) - one file per asset and partition
+        """
+        base_dir = self.base_dir or os.path.join(os.environ.get("DAGSTER_HOME", tempfile.gettempdir()), "storage")
+        identifier = context.get_asset_identifier() if context.has_asset_key else context.get_identifier()
+
+        return os.path.join(base_dir, *[part.replace("|", "_").replace("/", "_") for part in identifier])
+
+
+
+    def write_frame(self, data: pd.DataFrame, path: str) -> int:
+        """
+        Write a DataFrame (atomically)
+
+        Output:
+            - the file size (bytes)
+        """
+        table = pyarrow.Table.from_pandas(data)
+        temporary_path = f"{path}.tmp"
+
+        if self.format == "ipc":
+            pyarrow.feather.write_feather(table, temporary_path, compression="uncompressed")
+        else:
+            pyarrow.parquet.write_table(table, temporary_path)
+
+        os.replace(temporary_path, path)
+        return os.path.getsize(path)
+
+
+
+    def read_frame(self, path: str, format: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+        """
+        Read a DataFrame - only the pages of the selected columns are read
+
+        Parameters:
+            - `path` - the file
+            - `format` - the format the file has been written with
+            - `columns` - the columns to read (all if `None`, unknown columns are ignored)
+        """
+        if format != "ipc":
+            names = pyarrow.parquet.read_schema(path).names
+            columns = [column for column in columns if column in names] if columns is not None else None
+            return pyarrow.parquet.read_table(path, columns=columns, memory_map=True, use_pandas_metadata=True).to_pandas()
+
+        with pyarrow.memory_map(path) as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+
+            if columns is not None:
+                # The stored index is a column as well
+                pandas_metadata = table.schema.pandas_metadata or {}
+                index = [column for column in pandas_metadata.get("index_columns", []) if isinstance(column, str)]
+                table = table.select([column for column in [*columns, *index] if column in table.column_names])
+
+            return table.to_pandas()
+
+
+
+    def handle_output(self, context: OutputContext, obj):
+
+        if obj is None:
+            return
+
+        path = self.path(context)
+        if self.memory:
+            # A run that ended without the teardown (e.g. a killed run) must not keep its outputs alive
+            for run_id in [run_id for run_id in MEMORY_OUTPUTS if run_id != context.run_id]:
+                del MEMORY_OUTPUTS[run_id]
+
+            MEMORY_OUTPUTS.setdefault(context.run_id, {})[path] = obj
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        frames = obj if isinstance(obj, tuple) else (obj,)
+        if pyarrow is None or not all(isinstance(frame, pd.DataFrame) for frame in frames):
+            self.pickle(obj, path)
+            return
+
+        try:
+            parts = [self.write_frame(frame, f"{path}.{index}{self.__extensions[self.format]}") for index, frame in enumerate(frames)]
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError, pyarrow.ArrowNotImplementedError) as error:
+            context.log.warning(f"Pickled the output - Arrow cannot store it: {error!r}")
+            self.pickle(obj, path)
+            return
+
+        # The manifest is written last - a reader never sees a half written output
+        with open(f"{path}.json", "w") as file:
+            json.dump({"format": self.format, "parts": len(frames), "tuple": isinstance(obj, tuple)}, file)
+
+        if os.path.exists(f"{path}.pkl"):
+            os.remove(f"{path}.pkl")
+
+        context.add_output_metadata({"path": path, "bytes": sum(parts)})
+
+
+
+    def pickle(self, obj, path: str):
+        """
+        Store an output that is not a DataFrame (or tuple of DataFrames)
+        """
+        with open(f"{path}.pkl", "wb") as file:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if os.path.exists(f"{path}.json"):
+            os.remove(f"{path}.json")
+
+
+
+    @staticmethod
+    def copy_output(obj, columns: Optional[list[str]] = None, parts: Optional[list[int]] = None):
+        """
+        Copy an in-memory output for a consumer (the assets change their inputs in place) - only the requested columns / parts.
+        The copy is lazy - the consumers run with Copy-on-Write (see `instrumented`), so the buffers are only copied if
+        the consumer writes to them
+        """
+        if isinstance(obj, pd.DataFrame):
+            with pd.option_context(COPY_ON_WRITE, True):
+                frame = obj[[column for column in columns if column in obj.columns]] if columns is not None else obj
+                return frame.copy(deep=False)
+
+        if isinstance(obj, tuple) and all(isinstance(frame, pd.DataFrame) for frame in obj):
+            return tuple(
+                ArrowIOManager.copy_output(frame, columns) if parts is None or index in parts else pd.DataFrame()
+                for index, frame in enumerate(obj)
+            )
+
+        return obj
+
+
+
+    def teardown_after_execution(self, context: InitResourceContext):
+        # The in-process executor tears the resources down once, at the end of the run
+        if self.memory:
+            MEMORY_OUTPUTS.pop(context.run_id, None)
+
+
+
+    def load_input(self, context: InputContext):
+
+        path = self.path(context)
+        metadata = getattr(context, "definition_metadata", None) or context.metadata or {}
+
+        outputs = MEMORY_OUTPUTS.get(context.upstream_output.run_id, {}) if self.memory else {}
+        if path in outputs:
+            return self.copy_output(outputs[path], metadata.get("columns"), metadata.get("parts"))
+
+        if not os.path.exists(f"{path}.json"):
+            with open(f"{path}.pkl", "rb") as file:
+                return pickle.load(file)
+
+        with open(f"{path}.json") as file:
+            manifest = json.load(file)
+
+        columns = metadata.get("columns")
+        parts = metadata.get("parts", range(manifest["parts"]))
+
+        extension = self.__extensions[manifest["format"]]
+        frames = tuple(
+            self.read_frame(f"{path}.{index}{extension}", manifest["format"], columns) if index in parts else pd.DataFrame()
+            for index in range(manifest["parts"])
+        )
+
+        return frames if manifest["tuple"] else frames[0]
+
+
+
+class DuckDB(ConfigurableResource):
+    """
+    In-process DuckDB connections for the out-of-core builds (see `operations.duckdb_master`) - a query that does
+    not fit in `memory_limit` spills to `temp_directory` instead of failing
+    """
+
+    snapshot_dir: Optional[str] = None # Defaults to $DAGSTER_HOME/security_master - the Parquet snapshot of the security master
+    temp_directory: Optional[str] = None # Defaults to $DAGSTER_HOME/duckdb_tmp
+    memory_limit: str = "2GB"
+    threads: Optional[int] = None # All cores by default
+
+    @property
+    def home(self) -> str:
+        return os.environ.get("DAGSTER_HOME", tempfile.gettempdir())
+
+    @property
+    def snapshot_path(self) -> str:
+        return self.snapshot_dir or os.path.join(self.home, "security_master")
+
+    def connect(self):
+        """
+        Open a new in-memory connection (close it when done - `with duckdb.connect() as connection:`)
+        """
+        import duckdb
+
+        temp_directory = self.temp_directory or os.path.join(self.home, "duckdb_tmp")
+        os.makedirs(temp_directory, exist_ok=True)
+
+        connection = duckdb.connect()
+        connection.execute(f"SET memory_limit = '{self.memory_limit}'")
+        connection.execute(f"SET temp_directory = '{temp_directory}'")
+        # The order of the rows is never relied on - lets the operators spill / stream instead of buffering
+        connection.execute("SET preserve_insertion_order = false")
+        if self.threads:
+            connection.execute(f"SET threads = {int(self.threads)}")
 
-        server.sendmail(self.sender, to, message.as_string())
+        return connection
@@ -1,2 +1,9 @@
 from dagster import ScheduleDefinition, DefaultScheduleStatus
+from .. import jobs
+from .. import constants
 
+hitl_digest_schedule = ScheduleDefinition(
+    job=jobs.hitl_digest_job,
+    cron_schedule=constants.HITL_DIGEST_CRON,
+    default_status=DefaultScheduleStatus.STOPPED
+)
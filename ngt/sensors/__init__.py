@@ -1,11 +1,30 @@
-from dagster import sensor, RunRequest, SkipReason, DefaultSensorStatus
+from dagster import sensor, RunRequest, SkipReason, DefaultSensorStatus, SensorEvaluationContext
 from ..resources import Mongo, OpenFigi
 from .. import jobs
 from .. import constants
+from .. import partitions
+from ..operations.files import fingerprint, discover_files, unseen_files, mark_seen
+from ..operations.hitl import HITL_FILE_EXTENSIONS, read_hitl_file
+import hashlib
 import datetime
 import os
 import pandas as pd
 
+def content_run_key(*parts) -> str:
+    """
+    Create a run key from the content of the run - the same work always gets the same key
+
+    Parameters:
+        - `parts` - the values that identify the run
+
+    Output:
+        - the SHA-256 of the parts
+    """
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+
+# Fallback for the long running OpenFIGI worker (`python -m ngt.workers.figi`) - skipped while the worker runs
 @sensor(
     job = jobs.open_figi_download_job,
     default_status=DefaultSensorStatus.STOPPED,
@@ -13,21 +32,19 @@ import pandas as pd
 )
 def open_figi_api_sensor(mongo: Mongo, open_figi: OpenFigi):
 
-    collection = mongo.figi_queue
+    if mongo.worker_alive("figi"):
+        return SkipReason("The OpenFIGI worker is running")
 
-    query = {
-        "completed_timestamp": None,   
-    }
-    project = {
-        "_id": 0,
-        "code": "$nt_figi_code",
-        "ccy": "$nt_security_currency"
-    }
-
-    # We do one sample below the MAX limit so that we can ignore the automatic sleep time
-    figis = list(collection.find(query, project).limit(open_figi.MAX_REQUESTS_PER_MINUTE-1))
+    # We do one sample below the MAX limit so that we can ignore the automatic sleep time.
+    # The FIGIs are leased so that overlapping runs never fetch the same FIGI twice
+    figis = mongo.lease_figis(open_figi.MAX_REQUESTS_PER_MINUTE-1)
     if not figis:
         return SkipReason("No new Figis to fetch from OpenFIGI API")
+
+    # Every lease is a new run (a released / expired lease is leased again with a new ID)
+    for figi in figis:
+        figi.pop("attempts")
+    run_key = content_run_key(*[f"{figi['code']}/{figi['ccy']}/{figi['lease_id']}" for figi in figis])
     
     run_config = {
         "ops": {
@@ -39,9 +56,6 @@ def open_figi_api_sensor(mongo: Mongo, open_figi: OpenFigi):
         }
     }
 
-    # Unique key for every run
-    run_key = str(int(datetime.datetime.now().timestamp()))
-
     return RunRequest(run_key, run_config)
 
 
@@ -51,25 +65,31 @@ def open_figi_api_sensor(mongo: Mongo, open_figi: OpenFigi):
     default_status=DefaultSensorStatus.STOPPED,
     minimum_interval_seconds = 60 * 5 # Every 5 min
 )
-def security_master_figi_sensor(mongo: Mongo):
+def security_master_figi_sensor(context: SensorEvaluationContext, mongo: Mongo):
 
+    # The found FIGIs completed after the high-watermark (the latest `completed_timestamp` already requested) that are
+    # not in the security master yet - the index on `found` / `security_master_timestamp` / `completed_timestamp` only
+    # reads the new ones. A failed run is retried from Dagster, its FIGIs are not requested again
+    watermark = datetime.datetime.fromisoformat(context.cursor) if context.cursor else None
     query = {
-        "completed_timestamp": {"$ne": None},
+        "found": True,
         "security_master_timestamp": None,
-        "found": True
+        "completed_timestamp": {"$ne": None} if watermark is None else {"$gt": watermark}
     }
 
-    project = {
-        "_id": 0,
-        "code": "$nt_figi_code",
-        "ccy": "$nt_security_currency"
-    }
+    # Deduplicate inside the database instead of loading the pending set into pandas
+    pipeline = [
+        {"$match": query},
+        {"$group": {"_id": {"code": "$nt_figi_code", "ccy": "$nt_security_currency"}, "completed_timestamp": {"$max": "$completed_timestamp"}}}
+    ]
 
-    collection = mongo.figi_queue
-    figis = pd.DataFrame(collection.find(query, project)).drop_duplicates().to_dict("records")
+    results = list(mongo.figi_queue.aggregate(pipeline))
 
-    if not figis:
+    if not results:
         return SkipReason("No new Figis to fetch from OpenFIGI API")
+
+    figis = sorted([result["_id"] for result in results], key=lambda figi: (figi["code"], str(figi["ccy"])))
+    watermark = max(result["completed_timestamp"] for result in results)
     
     run_config = {
         "ops": {
@@ -81,69 +101,65 @@ def security_master_figi_sensor(mongo: Mongo):
         }
     }
 
-    # Unique key for every run
-    run_key = str(int(datetime.datetime.now().timestamp()))
+    context.update_cursor(watermark.isoformat())
+    run_key = content_run_key(watermark.isoformat(), *[f"{figi['code']}/{figi['ccy']}" for figi in figis])
     return RunRequest(run_key, run_config)
 
 
 
-@sensor(
-    job = jobs.upload_fixed_portfolio_data,
-    default_status=DefaultSensorStatus.STOPPED,
-    minimum_interval_seconds=60 # Every 1 min
-)
-def fixed_portfolio_data_sensor():
+def fixed_portfolio_run_request(file_path: str) -> RunRequest:
+    """
+    Create the run request that uploads a fixed HITL portfolio file
 
-    path = os.path.join(constants.HITL_PATH, "upload", "portfolios")
-    os.makedirs(path, exist_ok=True)
+    Parameters:
+        - `file_path` - the fixed portfolio file
 
-    for file_name in os.listdir(path):
-        
-        if file_name.startswith("~$"):
-            continue
+    Output:
+        - the run request
+    """
+    # The file's content identifies the run - identical uploads are never processed twice
+    file = fingerprint(file_path)
 
-        file_path = os.path.join(path, file_name)
-        if os.path.isdir(file_path):
-            continue
-        
-        config = {
-            "run_key": str(int(datetime.datetime.now().timestamp())),
-            "run_config": {
-                "ops": {
-                    "fixed_inconsistent_portfolio_data": {
-                        "config": {
-                            "file_path": file_path
-                        }
+    config = {
+        "run_key": f"{file['file_name']}/{file['size']}/{file['hash']}",
+        "run_config": {
+            "ops": {
+                "fixed_inconsistent_portfolio_data": {
+                    "config": {
+                        "file_path": file_path
                     }
                 }
             }
         }
+    }
 
-        yield RunRequest(**config)
+    return RunRequest(**config)
 
 
 
-@sensor(
-    job = jobs.trades_upload_job,
-    default_status=DefaultSensorStatus.STOPPED,
-    minimum_interval_seconds=60 # Every 1 min
-)
-def reupload_faulty_trades():
+def faulty_trades_run_requests(file_path: str) -> list[RunRequest]:
+    """
+    Create the run requests that re-upload a fixed HITL trades file - one for every trade date / fund in the file
 
-    path = os.path.join(constants.HITL_PATH, "upload", "trades")
-    os.makedirs(path, exist_ok=True)
+    Parameters:
+        - `file_path` - the fixed trades file
 
-    for file_name in os.listdir(path):
-        
-        if file_name.startswith("~$"):
-            continue
+    Output:
+        - the run requests
+    """
+    file = fingerprint(file_path)
 
-        file_path = os.path.join(path, file_name)
-        if os.path.isdir(file_path):
-            continue
+    # The trades job is partitioned - one run for every trade date / fund in the file
+    data = read_hitl_file(file_path)
+    data = data.dropna(subset="nt_trade_date")
+    trade_dates = pd.to_datetime(data["nt_trade_date"], format="%m/%d/%Y %H:%M:%S")
+
+    run_requests = []
+    for partition_key in partitions.get_partition_keys(trade_dates, data["nt_fund_code"]):
 
         config = {
-            "run_key": str(int(datetime.datetime.now().timestamp())),
+            "run_key": f"{file['file_name']}/{file['size']}/{file['hash']}/{partition_key}",
+            "partition_key": partition_key,
             "run_config": {
                 "ops": {
                     "trades_file_data": {
@@ -154,11 +170,48 @@ def reupload_faulty_trades():
                     "inconsistent_trades_email": {
                         "config": {
                             "to": constants.EMAILS["to"],
-                            "file_path": os.path.join(constants.HITL_PATH, file_name)
+                            "file_path": os.path.join(constants.HITL_PATH, file["file_name"])
                         }
                     }
                 }
             }
         }
+        run_requests.append(RunRequest(**config))
+
+    return run_requests
+
+
+
+@sensor(
+    job = jobs.upload_fixed_portfolio_data,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=60 # Every 1 min
+)
+def fixed_portfolio_data_sensor(context: SensorEvaluationContext, mongo: Mongo):
+
+    # Only the files whose content has not been seen yet (see `unseen_files`)
+    path = os.path.join(constants.HITL_PATH, "upload", "portfolios")
+    files = unseen_files(mongo.file_registry, discover_files(path, HITL_FILE_EXTENSIONS), "hitl/portfolios")
+
+    for file in files:
+        yield fixed_portfolio_run_request(file["file_path"])
+
+    mark_seen(mongo.file_registry, files, "hitl/portfolios")
+
+
+
+@sensor(
+    job = jobs.trades_upload_job,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=60 # Every 1 min
+)
+def reupload_faulty_trades(context: SensorEvaluationContext, mongo: Mongo):
+
+    # Only the files whose content has not been seen yet (see `unseen_files`)
+    path = os.path.join(constants.HITL_PATH, "upload", "trades")
+    files = unseen_files(mongo.file_registry, discover_files(path, HITL_FILE_EXTENSIONS), "hitl/trades")
+
+    for file in files:
+        yield from faulty_trades_run_requests(file["file_path"])
 
-        yield RunRequest(**config)
\ No newline at end of file
+    mark_seen(mongo.file_registry, files, "hitl/trades")
@@ -0,0 +1,161 @@
+from dagster import sensor, RunRequest, SkipReason, DefaultSensorStatus, SensorEvaluationContext, SensorResult
+from ..resources import Mongo
+from ..operations.events import read_changes, get_folder_watcher
+from ..operations.files import unseen_files, mark_seen
+from ..operations.hitl import HITL_FILE_EXTENSIONS
+from .. import jobs
+from .. import constants
+from . import fixed_portfolio_run_request, faulty_trades_run_requests, content_run_key
+import datetime
+import json
+import os
+
+# Event driven alternatives to the polling sensors. Each tick only reads the changes since the
+# resume token stored in the sensor cursor / the last file system events, so an idle tick costs (almost) nothing.
+# The Mongo sensors need MongoDB to run as a replica set (change streams).
+# The OpenFIGI queue has a single streaming consumer - the OpenFIGI worker (`python -m ngt.workers.figi`),
+# with `open_figi_api_sensor` as the polling fallback.
+
+def digest_due(state: dict, now: datetime.datetime, quiet: int = constants.HITL_DIGEST_QUIET, min_interval: int = constants.HITL_DIGEST_MIN_INTERVAL) -> bool:
+    """
+    Check whether the pending faulty rows should be sent now - the digest is debounced so that a burst of faulty rows
+    (e.g. a whole file) is sent in one email rather than one email per tick
+
+    Parameters:
+        - `state` - the sensor state (`pending_since`, `last_event` and `requested` - ISO timestamps or `None`)
+        - `now` - the current time
+        - `quiet` - the seconds without a new faulty row before the digest is sent
+        - `min_interval` - the minimum seconds between two digests
+
+    Output:
+        - `True` if a digest should be requested
+    """
+    if not state.get("pending_since"):
+        return False
+
+    last_event = datetime.datetime.fromisoformat(state["last_event"])
+    requested = datetime.datetime.fromisoformat(state["requested"]) if state.get("requested") else None
+
+    return (now - last_event).total_seconds() >= quiet and (requested is None or (now - requested).total_seconds() >= min_interval)
+
+
+
+@sensor(
+    job = jobs.hitl_digest_job,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=60
+)
+def faulty_digest_stream_sensor(context: SensorEvaluationContext, mongo: Mongo):
+
+    # The cursor holds the resume token and the debounce state (see `digest_due`)
+    state = json.loads(context.cursor) if context.cursor else {}
+    now = datetime.datetime.now()
+
+    # New pending faulty rows in any `faulty.*` collection (portfolios, trades)
+    pipeline = [
+        {"$match": {"operationType": "insert", "fullDocument.status": "pending"}}
+    ]
+    events, state["token"], _ = read_changes(mongo.inconsistent_portfolio.database, pipeline, state.get("token"))
+
+    # A (re)started stream needs no full scan - the digest itself picks up everything that is still pending
+    if any((event.get("fullDocument") or {}).get("faulty_id") is not None for event in events):
+        state["pending_since"] = state.get("pending_since") or now.isoformat()
+        state["last_event"] = now.isoformat()
+
+    if not digest_due(state, now):
+        reason = "Waiting for the faulty rows to settle" if state.get("pending_since") else "No new faulty rows"
+        return SensorResult(skip_reason=SkipReason(reason), cursor=json.dumps(state))
+
+    # The stream position identifies the batch - the rows up to the resume token
+    run_key = content_run_key(state["pending_since"], state["token"])
+    state.update(pending_since=None, last_event=None, requested=now.isoformat())
+
+    return SensorResult(run_requests=[RunRequest(run_key)], cursor=json.dumps(state))
+
+
+
+@sensor(
+    job = jobs.security_master_figi_update_job,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=5
+)
+def security_master_stream_sensor(context: SensorEvaluationContext, mongo: Mongo):
+
+    # FIGIs that have just been found by the OpenFIGI API
+    pipeline = [
+        {"$match": {"operationType": "update", "updateDescription.updatedFields.found": True}}
+    ]
+    events, cursor, restarted = read_changes(mongo.figi_queue, pipeline, context.cursor)
+
+    figis = {
+        (event["fullDocument"]["nt_figi_code"], event["fullDocument"]["nt_security_currency"])
+        for event in events if event.get("fullDocument")
+    }
+
+    if restarted:
+        # No history - pick up everything that is still waiting once
+        query = {
+            "completed_timestamp": {"$ne": None},
+            "security_master_timestamp": None,
+            "found": True
+        }
+        figis.update(
+            (figi["nt_figi_code"], figi["nt_security_currency"])
+            for figi in mongo.figi_queue.find(query, {"_id": 0, "nt_figi_code": 1, "nt_security_currency": 1})
+        )
+
+    if not figis:
+        return SensorResult(skip_reason=SkipReason("No new FIGIs for the security master"), cursor=cursor)
+
+    run_config = {
+        "ops": {
+            "figi_security_master": {
+                "config": {
+                    "figis": [{"code": code, "ccy": ccy} for code, ccy in sorted(figis)]
+                }
+            }
+        }
+    }
+
+    run_key = content_run_key(*[f"{code}/{ccy}" for code, ccy in sorted(figis, key=str)], cursor)
+    return SensorResult(run_requests=[RunRequest(run_key, run_config)], cursor=cursor)
+
+
+
+@sensor(
+    job = jobs.upload_fixed_portfolio_data,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=5
+)
+def fixed_portfolio_data_watch_sensor(context: SensorEvaluationContext, mongo: Mongo):
+
+    watcher = get_folder_watcher(os.path.join(constants.HITL_PATH, "upload", "portfolios"), HITL_FILE_EXTENSIONS)
+    files = unseen_files(mongo.file_registry, watcher.changes(), "hitl/portfolios")
+
+    if not files:
+        return SensorResult(skip_reason=SkipReason("No new fixed portfolio files"))
+
+    run_requests = [fixed_portfolio_run_request(file["file_path"]) for file in files]
+    mark_seen(mongo.file_registry, files, "hitl/portfolios")
+
+    return SensorResult(run_requests=run_requests)
+
+
+
+@sensor(
+    job = jobs.trades_upload_job,
+    default_status=DefaultSensorStatus.STOPPED,
+    minimum_interval_seconds=5
+)
+def faulty_trades_watch_sensor(context: SensorEvaluationContext, mongo: Mongo):
+
+    watcher = get_folder_watcher(os.path.join(constants.HITL_PATH, "upload", "trades"), HITL_FILE_EXTENSIONS)
+    files = unseen_files(mongo.file_registry, watcher.changes(), "hitl/trades")
+
+    if not files:
+        return SensorResult(skip_reason=SkipReason("No new fixed trades files"))
+
+    run_requests = [run_request for file in files for run_request in faulty_trades_run_requests(file["file_path"])]
+    mark_seen(mongo.file_registry, files, "hitl/trades")
+
+    return SensorResult(run_requests=run_requests)
@@ -0,0 +1,28 @@
+from dagster import run_status_sensor, RunStatusSensorContext, DagsterRunStatus, DagsterEventType, DefaultSensorStatus, SkipReason
+from ..resources import Mongo
+from ..operations.instrumentation import run_summary
+import datetime
+
+@run_status_sensor(
+    run_status=DagsterRunStatus.SUCCESS,
+    default_status=DefaultSensorStatus.STOPPED
+)
+def run_instrumentation_summary(context: RunStatusSensorContext, mongo: Mongo):
+
+    # The per asset Mongo / HTTP / compute figures of the finished run in one table (see `operations.instrumentation`) -
+    # opt-in like the other sensors, it reads the event log of every successful run
+    entries = context.instance.all_logs(context.dagster_run.run_id, of_type=DagsterEventType.ASSET_MATERIALIZATION)
+    summary = run_summary([entry.asset_materialization for entry in entries])
+
+    if len(summary) == 0:
+        return SkipReason(f"No materializations in run {context.dagster_run.run_id}")
+
+    context.log.info(f"{context.dagster_run.job_name} ({context.dagster_run.run_id}):\n{summary.to_markdown(index=False)}")
+
+    mongo.run_summaries.insert_one({
+        "run_id": context.dagster_run.run_id,
+        "job_name": context.dagster_run.job_name,
+        "tags": dict(context.dagster_run.tags),
+        "assets": summary.astype(object).where(summary.notna(), None).to_dict("records"),
+        "upload_timestamp": datetime.datetime.now()
+    })
@@ -0,0 +1,241 @@
+from ..resources import Mongo, OpenFigi, SearchCancelled
+from ..operations.security_master import enrich_security_master
+from ..operations import metrics
+from typing import Optional
+import threading
+import argparse
+import datetime
+import logging
+import signal
+import time
+import os
+
+logger = logging.getLogger("ngt.workers.figi")
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute: int, stop: Optional[threading.Event] = None):
+        """
+        Spread the requests evenly so that no more than `requests_per_minute` are made in any minute
+
+        Parameters:
+            - `requests_per_minute` - the allowed number of requests per minute
+            - `stop` - waiting is interrupted once the event is set
+        """
+        self.interval = 60 / requests_per_minute
+        self.stop = stop or threading.Event()
+        self.__next = time.monotonic()
+
+
+
+    def wait(self) -> bool:
+        """
+        Block until the next request is allowed
+
+        Output:
+            - `False` if the wait has been interrupted by `stop` - the request must not be sent
+        """
+        delay = self.__next - time.monotonic()
+        if delay > 0 and self.stop.wait(delay):
+            return False
+
+        if self.stop.is_set():
+            return False
+
+        self.__next = max(self.__next, time.monotonic()) + self.interval
+        return True
+
+
+
+class FigiWorker:
+
+    def __init__(self, mongo: Mongo, open_figi: OpenFigi, batch_size: int = 10, idle_seconds: int = 30, metrics_seconds: int = 60):
+        """
+        Long running consumer of the OpenFIGI queue. FIGIs are leased in batches, fetched at the
+        API's rate limit, written to the API collection in one insert per batch and the security
+        master is enriched straight away. The OpenFIGI sensors are only a fallback - they skip their
+        ticks while the worker's heartbeat is alive, so the worker has the whole rate limit.
+
+        Parameters:
+            - `mongo` - the Mongo resource
+            - `open_figi` - the OpenFIGI resource
+            - `batch_size` - the number of FIGIs leased and written at a time
+            - `idle_seconds` - the wait time when the queue is empty
+            - `metrics_seconds` - how often the throughput / lag metrics are logged
+        """
+        self.mongo = mongo
+        self.open_figi = open_figi
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.metrics_seconds = metrics_seconds
+
+        self.stop = threading.Event()
+        self.rate_limiter = RateLimiter(open_figi.MAX_REQUESTS_PER_MINUTE, self.stop)
+
+        self.metrics = {
+            "fetched": 0,
+            "found": 0,
+            "failed": 0,
+            "security_master_updates": 0
+        }
+        self.__started = time.monotonic()
+        self.__last_metrics = time.monotonic()
+
+
+
+    def shutdown(self, *args):
+        """
+        Finish the current FIGI, write the batch and stop
+        """
+        logger.info("Shutting down...")
+        self.stop.set()
+
+
+
+    def lag(self) -> dict:
+        """
+        Get the queue depth and the age of the oldest pending FIGI
+
+        Output:
+            - `pending` FIGIs and `lag_seconds`
+        """
+        query = {
+            "completed_timestamp": None,
+            "status": {"$nin": ["dead"]}
+        }
+        pending = self.mongo.figi_queue.count_documents(query)
+        oldest = self.mongo.figi_queue.find_one(query, {"upload_timestamp": 1}, sort=[("upload_timestamp", 1)])
+
+        lag = 0
+        if oldest and oldest.get("upload_timestamp"):
+            lag = (datetime.datetime.now() - oldest["upload_timestamp"]).total_seconds()
+
+        return {
+            "pending": pending,
+            "lag_seconds": round(lag, 1)
+        }
+
+
+
+    def log_metrics(self, force: bool = False):
+        """
+        Log the throughput (FIGIs per minute) and the queue lag
+        """
+        if not force and time.monotonic() - self.__last_metrics < self.metrics_seconds:
+            return
+
+        minutes = max(time.monotonic() - self.__started, 1) / 60
+        metrics = {
+            **self.metrics,
+            "figis_per_minute": round(self.metrics["fetched"] / minutes, 2),
+            **self.lag()
+        }
+
+        logger.info(f"Metrics: {metrics}")
+        self.__last_metrics = time.monotonic()
+
+
+
+    def process_batch(self, figis: list[dict]):
+        """
+        Fetch, store and enrich a leased batch of FIGIs
+
+        Parameters:
+            - `figis` - the leased FIGIs (`code`, `ccy`, `lease_id`)
+        """
+        results = []
+
+        for figi in figis:
+
+            if self.stop.is_set():
+                break
+
+            try:
+                data = self.open_figi.search(figi["code"], figi["ccy"], before_request=self.rate_limiter.wait)
+            except SearchCancelled:
+                break
+            except Exception as error:
+                dead = self.mongo.fail_figi(figi["code"], figi["ccy"], repr(error), lease_id=figi["lease_id"])
+                logger.warning(f"Failed {figi['code']} ({'dead-lettered' if dead else 'will be retried'}): {error!r}")
+                self.metrics["failed"] += 1
+                metrics.FIGIS_FETCHED.labels("failed").inc()
+                continue
+
+            results.append((figi, data))
+
+        # A FIGI whose lease has expired belongs to another consumer now - its results are not stored (like `new_figis`)
+        results = [(figi, data) for figi, data in results if self.mongo.complete_figi(figi["code"], figi["ccy"], len(data) > 0, figi["lease_id"])]
+
+        # One write for the whole batch, then the security master
+        documents = []
+        now = datetime.datetime.now()
+        for figi, data in results:
+            if len(data) > 0:
+                documents += data.assign(ccy=figi["ccy"], upload_timestamp=now).to_dict("records")
+
+        if documents:
+            self.mongo.open_figi.insert_many(documents)
+
+        found = [(figi["code"], figi["ccy"]) for figi, data in results if len(data) > 0]
+        updates = enrich_security_master(self.mongo, found)
+
+        self.metrics["fetched"] += len(results)
+        self.metrics["found"] += len(found)
+        metrics.FIGIS_FETCHED.labels("found").inc(len(found))
+        metrics.FIGIS_FETCHED.labels("empty").inc(len(results) - len(found))
+        self.metrics["security_master_updates"] += updates["updates"]
+
+        # Anything not fetched because of a shutdown goes straight back to the queue
+        if figis and self.stop.is_set():
+            self.mongo.release_figis(figis[0]["lease_id"])
+
+
+
+    def run(self):
+        """
+        Drain the queue until `shutdown` is called
+        """
+        logger.info(f"Started - batch size {self.batch_size}, {self.open_figi.MAX_REQUESTS_PER_MINUTE} requests per minute")
+
+        # The lease must outlive the time needed to fetch the whole batch (a search can take more than one request)
+        visibility_timeout = int(self.batch_size * self.rate_limiter.interval * 3) + 60
+
+        while not self.stop.is_set():
+
+            self.mongo.heartbeat("figi")
+            figis = self.mongo.lease_figis(self.batch_size, visibility_timeout)
+            if figis:
+                self.process_batch(figis)
+            else:
+                self.stop.wait(self.idle_seconds)
+
+            self.log_metrics()
+
+        self.mongo.heartbeat("figi", alive=False)
+        self.log_metrics(force=True)
+        logger.info("Stopped")
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Continuously fetch the queued FIGIs from the OpenFIGI API")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--idle-seconds", type=int, default=30)
+    parser.add_argument("--metrics-seconds", type=int, default=60)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    worker = FigiWorker(
+        mongo=Mongo(url=os.environ["MONGO_URL"]),
+        open_figi=OpenFigi(api_key=os.environ["FIGI_API_KEY"]),
+        batch_size=args.batch_size,
+        idle_seconds=args.idle_seconds,
+        metrics_seconds=args.metrics_seconds
+    )
+
+    signal.signal(signal.SIGINT, worker.shutdown)
+    signal.signal(signal.SIGTERM, worker.shutdown)
+
+    worker.run()
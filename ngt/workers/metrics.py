@@ -0,0 +1,94 @@
+from ..resources import Mongo
+from ..operations.metrics import get_registry
+from typing import Optional
+import threading
+import argparse
+import logging
+import signal
+import os
+
+logger = logging.getLogger("ngt.workers.metrics")
+
+class MetricsExporter:
+
+    def __init__(self, mongo: Mongo, port: int = 9464, textfile: Optional[str] = None, interval_seconds: int = 30):
+        """
+        Export the pipeline metrics (see `operations.metrics`) for Prometheus - either over HTTP (`/metrics`)
+        or as a textfile for the node exporter's textfile collector
+
+        Parameters:
+            - `mongo` - the Mongo resource (queue depths / ages are read on every scrape)
+            - `port` - the HTTP port (ignored if `textfile` is given)
+            - `textfile` - the `.prom` file that is rewritten every `interval_seconds`
+            - `interval_seconds` - how often the textfile is rewritten
+        """
+        self.registry = get_registry(mongo)
+        self.port = port
+        self.textfile = textfile
+        self.interval_seconds = interval_seconds
+        self.stop = threading.Event()
+
+
+
+    def shutdown(self, *args):
+        """
+        Stop exporting
+        """
+        logger.info("Shutting down...")
+        self.stop.set()
+
+
+
+    def write_textfile(self):
+        """
+        Write the metrics to the textfile (atomically, so the collector never reads half a file)
+        """
+        from prometheus_client import write_to_textfile
+
+        write_to_textfile(self.textfile, self.registry)
+
+
+
+    def run(self):
+        """
+        Export until `shutdown` is called
+        """
+        if self.textfile:
+            logger.info(f"Writing {self.textfile} every {self.interval_seconds} seconds")
+            while not self.stop.is_set():
+                try:
+                    self.write_textfile()
+                except Exception as error: # Mongo might be down - keep the last file
+                    logger.warning(f"Failed to write the metrics: {error!r}")
+                self.stop.wait(self.interval_seconds)
+            return
+
+        from prometheus_client import start_http_server
+
+        start_http_server(self.port, registry=self.registry)
+        logger.info(f"Serving http://0.0.0.0:{self.port}/metrics")
+        self.stop.wait()
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export the pipeline metrics for Prometheus")
+    parser.add_argument("--port", type=int, default=9464)
+    parser.add_argument("--textfile", default=None, help="Write a node exporter textfile instead of serving HTTP")
+    parser.add_argument("--interval-seconds", type=int, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    exporter = MetricsExporter(
+        mongo=Mongo(url=os.environ["MONGO_URL"], monitor=False),
+        port=args.port,
+        textfile=args.textfile,
+        interval_seconds=args.interval_seconds
+    )
+
+    signal.signal(signal.SIGINT, exporter.shutdown)
+    signal.signal(signal.SIGTERM, exporter.shutdown)
+
+    exporter.run()
@@ -0,0 +1,202 @@
+from ..resources import Mongo, Email
+from ..operations import metrics
+from typing import Optional
+import threading
+import argparse
+import logging
+import smtplib
+import signal
+import os
+
+logger = logging.getLogger("ngt.workers.outbox")
+
+class OutboxSender:
+
+    def __init__(self, mongo: Mongo, mail: Email, batch_size: int = 20, idle_seconds: int = 10, max_idle_connection_seconds: int = 60):
+        """
+        Long running sender of the email outbox. Emails are leased in batches and sent over one
+        authenticated SMTP connection that is kept open between batches. A failed email is retried
+        with an exponential backoff (see `Mongo.fail_email`).
+
+        Parameters:
+            - `mongo` - the Mongo resource
+            - `mail` - the Email resource
+            - `batch_size` - the number of emails leased at a time
+            - `idle_seconds` - the wait time when the outbox is empty
+            - `max_idle_connection_seconds` - the connection is closed once the outbox has been empty for this long
+        """
+        self.mongo = mongo
+        self.mail = mail
+        self.batch_size = batch_size
+        self.idle_seconds = idle_seconds
+        self.max_idle_connection_seconds = max_idle_connection_seconds
+
+        self.stop = threading.Event()
+        self.metrics = {
+            "sent": 0,
+            "failed": 0,
+            "dead": 0,
+            "connections": 0
+        }
+        self.__server: Optional[smtplib.SMTP] = None
+        self.__idle = 0
+
+
+
+    def shutdown(self, *args):
+        """
+        Finish the current email, close the connection and stop
+        """
+        logger.info("Shutting down...")
+        self.stop.set()
+
+
+
+    @property
+    def server(self) -> smtplib.SMTP:
+        """
+        The open SMTP connection - (re)connected when needed
+        """
+        if self.__server is None:
+            self.__server = self.mail.connect()
+            self.metrics["connections"] += 1
+
+        return self.__server
+
+
+
+    def close(self):
+        """
+        Close the SMTP connection (if open)
+        """
+        if self.__server is None:
+            return
+
+        try:
+            self.__server.quit()
+        except smtplib.SMTPException:
+            pass
+        finally:
+            self.__server = None
+
+
+
+    def send(self, email: dict):
+        """
+        Send one outbox email. A dropped connection is reopened once before the email is failed.
+
+        Parameters:
+            - `email` - the leased email
+        """
+        arguments = [email["to"], email["subject"], email["body"], email.get("cc"), email.get("attachment_paths")]
+
+        try:
+            self.mail.send(*arguments, server=self.server)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self.mail.send(*arguments, server=self.server)
+
+
+
+    def process_batch(self, emails: list[dict]):
+        """
+        Send a leased batch of emails
+
+        Parameters:
+            - `emails` - the leased emails
+        """
+        for email in emails:
+
+            try:
+                self.send(email)
+            except (smtplib.SMTPException, OSError) as error:
+                # The connection might be unusable - the next email opens a new one
+                self.close()
+                dead = self.mongo.fail_email(email, repr(error))
+                logger.warning(f"Failed {email['subject']!r} ({'given up' if dead else 'will be retried'}): {error!r}")
+                self.metrics["dead" if dead else "failed"] += 1
+                metrics.EMAILS_SENT.labels("dead" if dead else "failed").inc()
+                continue
+
+            self.mongo.complete_email(email["_id"])
+            self.metrics["sent"] += 1
+            metrics.EMAILS_SENT.labels("sent").inc()
+
+            if self.stop.is_set():
+                break
+
+
+
+    def drain(self) -> int:
+        """
+        Send everything that is currently in the outbox
+
+        Output:
+            - the number of sent emails
+        """
+        sent = self.metrics["sent"]
+
+        while not self.stop.is_set():
+            emails = self.mongo.lease_emails(self.batch_size)
+            if not emails:
+                break
+
+            self.process_batch(emails)
+
+        return self.metrics["sent"] - sent
+
+
+
+    def run(self):
+        """
+        Drain the outbox until `shutdown` is called
+        """
+        logger.info(f"Started - batch size {self.batch_size}")
+
+        while not self.stop.is_set():
+
+            if self.drain() > 0:
+                self.__idle = 0
+                logger.info(f"Metrics: {self.metrics}")
+                continue
+
+            # Keep the connection for the next burst of emails, but not forever
+            self.__idle += self.idle_seconds
+            if self.__idle >= self.max_idle_connection_seconds:
+                self.close()
+
+            self.stop.wait(self.idle_seconds)
+
+        self.close()
+        logger.info(f"Stopped - {self.metrics}")
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Continuously send the emails of the outbox")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--idle-seconds", type=int, default=10)
+    parser.add_argument("--no-ssl", action="store_true", help="Plain SMTP (e.g. a local `aiosmtpd` test server)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    sender = OutboxSender(
+        mongo=Mongo(url=os.environ["MONGO_URL"]),
+        mail=Email(
+            sender=os.environ["EMAIL_SENDER"],
+            host=os.environ["EMAIL_HOST"],
+            port=os.environ["EMAIL_PORT"],
+            username=os.environ.get("EMAIL_USERNAME", ""),
+            password=os.environ.get("EMAIL_PASSWORD", ""),
+            use_ssl=not args.no_ssl
+        ),
+        batch_size=args.batch_size,
+        idle_seconds=args.idle_seconds
+    )
+
+    signal.signal(signal.SIGINT, sender.shutdown)
+    signal.signal(signal.SIGTERM, sender.shutdown)
+
+    sender.run()
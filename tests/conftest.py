@@ -0,0 +1,14 @@
+import pytest
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    The Mongo resource on an in-memory mongomock client (a new, empty client per test)
+    """
+    mongomock = pytest.importorskip("mongomock")
+    from ngt.resources import Mongo
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr("pymongo.MongoClient", lambda *_, **__: client)
+
+    return Mongo(url="mongodb://mongomock", monitor=False)
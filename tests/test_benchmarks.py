@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("dagster")
+pytest.importorskip("mongomock")
+
+import os
+import sys
+import subprocess
+
+# Smoke tests of the benchmarks - every upload job runs end to end on a small synthetic file with mongomock (run like
+# the command line so that the patched `MongoClient` and the resources are the ones the benchmarks use)
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_benchmark(module: str, mode: str, tmp_path, *options: str) -> subprocess.CompletedProcess:
+    """
+    Run a benchmark module with mongomock on 200 rows (against an empty baseline)
+    """
+    return subprocess.run(
+        [sys.executable, "-m", module, mode, "--mongomock", "--rows", "200", "--baseline", str(tmp_path / "baseline.json"), *options],
+        cwd=ROOT_PATH, capture_output=True, text=True, timeout=600
+    )
+
+
+
+@pytest.mark.parametrize("mode", ["portfolios", "trades"])
+def test_pipeline(mode, tmp_path):
+    result = run_benchmark("benchmarks.pipeline", mode, tmp_path)
+    assert result.returncode == 0, result.stderr
+
+    # The full job and every asset on its own
+    assert f"{mode}_upload_job" in result.stdout
+    assert "| asset " in result.stdout
+
+
+
+def test_pipeline_comparison(tmp_path):
+    result = run_benchmark("benchmarks.pipeline", "trades", tmp_path, "--no-standalone", "--reset", "--io-manager", "pickle", "memory")
+    assert result.returncode == 0, result.stderr
+    assert "memory" in result.stdout
+
+
+
+@pytest.mark.parametrize("mode", ["portfolios", "trades"])
+def test_memory(mode, tmp_path):
+    result = run_benchmark("benchmarks.memory", mode, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert "peak_traced_mb" in result.stdout
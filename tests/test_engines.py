@@ -0,0 +1,202 @@
+import pytest
+
+pytest.importorskip("dagster")
+pytest.importorskip("polars")
+
+import os
+import numpy as np
+import pandas as pd
+from ngt.operations import transforms, polars_transforms
+from ngt.assets.security_master import INSTRUMENT_COLUMN_MAPPINGS
+
+# The parity of the pandas (reference) and polars engines (see `ngt.operations.engine`) - both must return the same
+# rows in the same order, and the ids must be the same strings (they are the keys of the uploaded rows)
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ngt", "data")
+
+def normalize(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make the outputs of both engines comparable - `None` / `NaN` become `None` and the dtypes (e.g. categories) are ignored
+    """
+    frame = frame.reset_index(drop=True).astype(object)
+    return frame.where(frame.notna(), None)
+
+
+
+def assert_same(expected, actual):
+    """
+    Assert that both engines returned the same output (a DataFrame, a tuple of DataFrames or a value)
+    """
+    expected = expected if isinstance(expected, tuple) else (expected,)
+    actual = actual if isinstance(actual, tuple) else (actual,)
+    assert len(expected) == len(actual)
+
+    for expected_value, actual_value in zip(expected, actual):
+
+        if not isinstance(expected_value, pd.DataFrame):
+            assert expected_value == actual_value
+            continue
+
+        expected_value, actual_value = normalize(expected_value), normalize(actual_value)
+        assert list(expected_value.columns) == list(actual_value.columns)
+
+        # The ids are compared as exact strings before the frames
+        if "id" in expected_value.columns:
+            assert expected_value["id"].to_list() == actual_value["id"].to_list()
+
+        pd.testing.assert_frame_equal(expected_value, actual_value, check_dtype=False)
+
+
+
+@pytest.fixture(scope="module")
+def portfolios() -> pd.DataFrame:
+    return transforms.categorize(pd.read_csv(os.path.join(DATA_PATH, "Portfolios.csv")))
+
+
+
+@pytest.fixture(scope="module")
+def trades() -> pd.DataFrame:
+    data = pd.read_csv(os.path.join(DATA_PATH, "Trades.csv"))
+    return transforms.categorize(data.dropna(subset="nt_trade_date").drop_duplicates().reset_index(drop=True))
+
+
+
+@pytest.fixture
+def edge_portfolios() -> pd.DataFrame:
+    """
+    Portfolio rows with every kind of identifier, missing values (`NaN` and `None`) and quantity formatting
+    """
+    columns = [
+        "nx_date", "nt_pool_fund_code", "nt_security_name", "nt_security_currency", "nt_gti_code", "nt_bloomberg_code",
+        "nt_yellow_key_code", "nt_figi_code", "nt_quotation_code", "nt_quantity", "nt_issuer_country_code",
+        "nt_second_quotation_currency", "nt_underlying_security_name", "nt_bloomberg_code_of_underlying"
+    ]
+    rows = [
+        # FIGI
+        ["2024-02-19", "NGT6144", "TESLA INC", "USD", "S01", "TSLA UW", "Equity", "BBG000N9P426", np.nan, 255690.0, "US", np.nan, np.nan, np.nan],
+        # Same row - dropped
+        ["2024-02-19", "NGT6144", "TESLA INC", "USD", "S01", "TSLA UW", "Equity", "BBG000N9P426", np.nan, 255690.0, "US", np.nan, np.nan, np.nan],
+        # Bloomberg Code + underlying, negative quantity
+        ["2024-02-20", "NGT2754", "SPX 03/15/24 C5000", "USD", "O01", "SPX 3 C5000", "Index", np.nan, np.nan, -1250.5, "US", np.nan, "S&P 500 INDEX", "SPX"],
+        # Bloomberg Code without an underlying (`None`)
+        ["2024-02-21", "NGT2754", "US TREASURY N/B", "USD", "B01", "912828ZT0", "Govt", None, np.nan, 1036690.26, "US", np.nan, None, None],
+        # Security name only (with spaces), missing quantity
+        ["2024-02-22", "NGT6144", "CASH USD ACCOUNT", "USD", "C01", np.nan, np.nan, np.nan, np.nan, np.nan, "US", np.nan, np.nan, np.nan],
+        # Missing category (GTI) - no id
+        ["2024-02-23", "NGT6144", "APPLE INC", "USD", np.nan, "AAPL UW", "Equity", "BBG000B9XRY4", np.nan, 0.1, "US", "EUR", np.nan, np.nan],
+        # Monday - the business date is the Friday before, quantity 0
+        ["2024-02-26", "NGT2754", "MICROSOFT CORP", "USD", "S01", "MSFT UW", "Equity", "BBG000BPH459", np.nan, 0.0, "US", np.nan, np.nan, np.nan],
+        # Missing fund / country
+        ["2024-02-27", np.nan, "NVIDIA CORP", "USD", "S01", "NVDA UW", "Equity", "BBG000BBJQV0", np.nan, 12.125, np.nan, np.nan, np.nan, np.nan]
+    ]
+
+    return transforms.categorize(pd.DataFrame(rows, columns=columns))
+
+
+
+@pytest.fixture
+def edge_trades() -> pd.DataFrame:
+    """
+    Trades with missing / zero prices and quantities, conflicting prices and missing groups
+    """
+    columns = [
+        "nx_date", "nt_trade_date", "nt_accounting_date", "nt_fund_code", "nt_security_description", "nt_security_currency",
+        "nt_gti_code", "nt_quotation_name", "nt_issuer_country_name", "nt_bloomberg_code", "nt_transaction_quantity", "nt_transaction_price"
+    ]
+    rows = [
+        ["2/12/2024", "2/9/2024 0:00:00", "Monday, February 12", "NGT6144", "AUTOMATIC DATA PROCESSING", "USD", "S01", "NASDAQ", "UNITED-STATES (U.S.A.)", "ADP UW", 3429.0, 749.97],
+        ["1/24/2024", "1/23/2024 0:00:00", "Wednesday, January 24", "NGT6144", "AUTO TRADER GROUP PLC", "GBP", "S01", "SEATS LONDON", "GREAT-BRITAIN", "AUTO LN", -6273.0, 21.786],
+        # Missing / zero price and quantity
+        ["1/24/2024", "1/23/2024 0:00:00", "Wednesday, January 24", "NGT6144", "AUTO TRADER GROUP PLC", "GBP", "S01", "SEATS LONDON", "GREAT-BRITAIN", "AUTO LN", 0.0, 21.5],
+        ["1/25/2024", "1/24/2024 0:00:00", "Thursday, January 25", "NGT2754", "TESLA INC", "USD", "S01", np.nan, np.nan, "TSLA UW", 100.0, np.nan],
+        ["1/25/2024", "1/24/2024 0:00:00", "Thursday, January 25", "NGT2754", "TESLA INC", "USD", "S01", np.nan, np.nan, "TSLA UW", np.nan, 187.29],
+        # Same security / date with different prices - both conflict
+        ["1/26/2024", "1/25/2024 0:00:00", "Friday, January 26", "NGT2754", "APPLE INC", "USD", "S01", "NASDAQ", np.nan, "AAPL UW", 50.0, 194.17],
+        ["1/26/2024", "1/25/2024 0:00:00", "Friday, January 26", "NGT2754", "APPLE INC", "USD", "S01", "NASDAQ", np.nan, "AAPL UW", 25.0, 194.5],
+        # Same security / date / price - no conflict
+        ["1/29/2024", "1/26/2024 0:00:00", "Monday, January 29", "NGT6144", "MICROSOFT CORP", "USD", "S01", "NASDAQ", np.nan, "MSFT UW", 10.0, 403.93],
+        ["1/29/2024", "1/26/2024 0:00:00", "Monday, January 29", "NGT6144", "MICROSOFT CORP", "USD", "S01", "NASDAQ", np.nan, "MSFT UW", -10.0, 403.93],
+        # No Bloomberg Code - not a group, never a conflict
+        ["1/30/2024", "1/29/2024 0:00:00", "Tuesday, January 30", "NGT6144", "PRIVATE LOAN A", "EUR", np.nan, np.nan, np.nan, np.nan, 1000000.0, 100.0],
+        ["1/30/2024", "1/29/2024 0:00:00", "Tuesday, January 30", "NGT6144", "PRIVATE LOAN A", "EUR", np.nan, np.nan, np.nan, np.nan, 500000.0, 99.5]
+    ]
+
+    return transforms.categorize(pd.DataFrame(rows, columns=columns))
+
+
+
+def test_portfolio_ids(portfolios):
+    assert_same(transforms.portfolio_ids(portfolios), polars_transforms.portfolio_ids(portfolios))
+
+
+
+def test_portfolio_ids_edge_cases(edge_portfolios):
+    expected = transforms.portfolio_ids(edge_portfolios)
+    assert_same(expected, polars_transforms.portfolio_ids(edge_portfolios))
+
+    # The float quantities are formatted like `astype(str)`
+    assert expected["id"].dropna().str.endswith(("/255690.0", "/NEG1250.5", "/1036690.26", "/nan", "/0.0", "/12.125")).all()
+
+
+
+def test_portfolio_ids_integer_quantities(edge_portfolios):
+    data = edge_portfolios.dropna(subset="nt_quantity").astype({"nt_quantity": "int64"}).reset_index(drop=True)
+    assert_same(transforms.portfolio_ids(data), polars_transforms.portfolio_ids(data))
+
+
+
+def test_portfolio_ids_numeric_underlying(edge_portfolios):
+    # An underlying code column with only numbers is read as float
+    data = edge_portfolios.assign(nt_bloomberg_code_of_underlying=[np.nan, np.nan, 536292.0, np.nan, np.nan, np.nan, np.nan, np.nan])
+    expected = transforms.portfolio_ids(data)
+    assert_same(expected, polars_transforms.portfolio_ids(data))
+    assert "/SPX 3 C5000/536292.0/" in expected["id"].iloc[1]
+
+
+
+def test_fill_by_figi(portfolios, edge_portfolios):
+    for data in (portfolios, edge_portfolios):
+        columns = data.rename(columns=lambda column: column[3:] if column.startswith("nt_") else column)
+        assert_same(transforms.fill_by_figi(columns), polars_transforms.fill_by_figi(columns))
+
+
+
+def test_portfolio_instruments(portfolios, edge_portfolios):
+    for data in (portfolios, edge_portfolios):
+        expected = transforms.portfolio_instruments(data, INSTRUMENT_COLUMN_MAPPINGS)
+        assert_same(expected, polars_transforms.portfolio_instruments(data, INSTRUMENT_COLUMN_MAPPINGS))
+
+
+
+def test_unique_figis(portfolios):
+    instruments = transforms.portfolio_instruments(portfolios, INSTRUMENT_COLUMN_MAPPINGS)
+    assert_same(transforms.unique_figis(instruments), polars_transforms.unique_figis(instruments))
+
+
+
+def test_unique_figis_ties():
+    # Two duplicated FIGIs (one tie), instruments without a FIGI and without a Yellow Code
+    instruments = pd.DataFrame({
+        "figi_code": ["BBG1", "BBG1", "BBG2", "BBG2", np.nan, None, "BBG3"],
+        "security_name": [np.nan, "A", "B", "B", "C", "D", "E"],
+        "yellow_key_code": ["Equity", "Equity", "Corp", "Corp", "Govt", np.nan, np.nan],
+        "gti_code": pd.Categorical(["S01", np.nan, "B01", "B01", "B01", "C01", "S01"])
+    })
+    assert_same(transforms.unique_figis(instruments), polars_transforms.unique_figis(instruments))
+
+
+
+def test_trade_filter(trades, edge_trades):
+    for data in (trades, edge_trades):
+        assert_same(transforms.trade_filter(data), polars_transforms.trade_filter(data))
+
+
+
+def test_trade_ids(trades, edge_trades):
+    for data in (trades, edge_trades):
+        valid, _, _ = transforms.trade_filter(data)
+        expected = transforms.trade_ids(valid)
+        assert_same(expected, polars_transforms.trade_ids(valid))
+
+    # The prices / quantities are formatted like `astype(str)`
+    assert "2024-01-23/2024-01-24/NGT6144/S01/AUTO_TRADER_GROUP_PLC/GBP/21.786(NEG6273.0)" in expected["id"].to_list()
@@ -0,0 +1,169 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+import pymongo.errors
+from types import SimpleNamespace
+from bson import json_util
+from ngt.operations import events
+from ngt.operations.events import read_changes, FolderWatcher
+from ngt.sensors.events import digest_due
+
+# The event driven sensors - the change streams (`read_changes`) and file system events (`FolderWatcher`) are faked,
+# so no replica set / OS events are needed
+
+class FakeStream:
+
+    def __init__(self, events: list[dict], resume_after: dict = None):
+        """
+        A change stream over `events` - the resume token of an event is its `_id`, a stream resumes after its token
+        """
+        self.events = events
+        if resume_after is not None:
+            self.events = events[[event["_id"] for event in events].index(resume_after) + 1:]
+
+        self.resume_token = resume_after
+        self.alive = True
+
+    def try_next(self):
+        if not self.events:
+            return None
+
+        event, self.events = self.events[0], self.events[1:]
+        self.resume_token = event["_id"]
+        return event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.alive = False
+
+
+
+class FakeSource:
+
+    def __init__(self, events: list[dict], expired: bool = False):
+        """
+        A collection / database whose `watch` returns a `FakeStream` (`expired` - the resume tokens are no longer in the oplog)
+        """
+        self.events = events
+        self.expired = expired
+        self.calls = []
+
+    def watch(self, pipeline, resume_after=None, **kwargs):
+        self.calls.append(resume_after)
+        if resume_after is not None and self.expired:
+            raise pymongo.errors.OperationFailure("Resume token not found")
+
+        return FakeStream(self.events, resume_after)
+
+
+
+def change(number: int) -> dict:
+    return {"_id": {"_data": f"token{number}"}, "operationType": "insert", "fullDocument": {"faulty_id": f"id{number}"}}
+
+
+
+def test_read_changes_resumes_from_the_cursor():
+    source = FakeSource([change(number) for number in range(5)])
+
+    read, cursor, restarted = read_changes(source, [], None, max_events=3)
+    assert [event["fullDocument"]["faulty_id"] for event in read] == ["id0", "id1", "id2"]
+    assert json_util.loads(cursor) == {"_data": "token2"}
+    assert restarted
+
+    read, cursor, restarted = read_changes(source, [], cursor)
+    assert [event["fullDocument"]["faulty_id"] for event in read] == ["id3", "id4"]
+    assert not restarted
+
+    # No new events - the cursor is kept
+    assert read_changes(source, [], cursor) == ([], cursor, False)
+
+
+
+def test_read_changes_restarts_an_expired_stream():
+    source = FakeSource([change(number) for number in range(2)], expired=True)
+
+    read, cursor, restarted = read_changes(source, [], json_util.dumps({"_data": "token0"}))
+    assert len(read) == 2 and restarted
+    assert source.calls == [{"_data": "token0"}, None]
+    assert json_util.loads(cursor) == {"_data": "token1"}
+
+
+
+def test_read_changes_keeps_the_cursor_without_token():
+    # A new stream without events has no token - "null" is never stored
+    read, cursor, restarted = read_changes(FakeSource([]), [], None)
+    assert (read, cursor, restarted) == ([], None, True)
+
+
+
+class FakeObserver:
+
+    def schedule(self, *args, **kwargs):
+        pass
+
+    def start(self):
+        pass
+
+
+
+def file_event(event_type: str, path: str, dest_path: str = None, is_directory: bool = False):
+    return SimpleNamespace(event_type=event_type, src_path=path, dest_path=dest_path, is_directory=is_directory)
+
+
+
+def test_folder_watcher(tmp_path, monkeypatch):
+    monkeypatch.setattr(events, "Observer", FakeObserver)
+    (tmp_path / "first.csv").write_text("a\n1\n")
+    watcher = FolderWatcher(str(tmp_path), (".csv",))
+
+    # The first call lists the folder, then only the files of the events are returned
+    assert watcher.changes() == [str(tmp_path / "first.csv")]
+    assert watcher.changes() == []
+
+    for name in ("second.csv", "moved.csv", "notes.txt"):
+        (tmp_path / name).write_text("a\n1\n")
+
+    watcher.on_any_event(file_event("created", str(tmp_path / "second.csv")))
+    watcher.on_any_event(file_event("modified", str(tmp_path / "second.csv")))
+    watcher.on_any_event(file_event("moved", str(tmp_path / "old.csv"), str(tmp_path / "moved.csv")))
+    watcher.on_any_event(file_event("created", str(tmp_path / "notes.txt")))
+    watcher.on_any_event(file_event("created", str(tmp_path / "deleted.csv")))
+    watcher.on_any_event(file_event("deleted", str(tmp_path / "first.csv")))
+    watcher.on_any_event(file_event("created", str(tmp_path / "folder"), is_directory=True))
+
+    # Once per file, the other extensions / removed files / folders are left out
+    assert watcher.changes() == [str(tmp_path / "moved.csv"), str(tmp_path / "second.csv")]
+    assert watcher.changes() == []
+
+
+
+def test_folder_watcher_without_watchdog(tmp_path, monkeypatch):
+    monkeypatch.setattr(events, "Observer", None)
+    (tmp_path / "first.csv").write_text("a\n1\n")
+    watcher = FolderWatcher(str(tmp_path), (".csv",))
+
+    # The folder is listed on every call
+    assert watcher.changes() == [str(tmp_path / "first.csv")]
+    assert watcher.changes() == [str(tmp_path / "first.csv")]
+
+
+
+def test_digest_due():
+    now = datetime.datetime(2024, 2, 12, 12)
+    minutes = lambda value: (now - datetime.timedelta(minutes=value)).isoformat()
+
+    # Nothing pending
+    assert not digest_due({}, now)
+
+    # The faulty rows are still arriving
+    assert not digest_due({"pending_since": minutes(30), "last_event": minutes(2)}, now, quiet=600)
+    assert digest_due({"pending_since": minutes(30), "last_event": minutes(15)}, now, quiet=600)
+
+    # The last digest is too recent
+    state = {"pending_since": minutes(30), "last_event": minutes(15), "requested": minutes(40)}
+    assert not digest_due(state, now, quiet=600, min_interval=3600)
+    assert digest_due(state, now, quiet=600, min_interval=1800)
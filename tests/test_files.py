@@ -0,0 +1,97 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import logging
+from types import SimpleNamespace
+from ngt.operations.files import load_files, complete_files
+
+# The incremental file loads - a file is skipped, read from its appended tail or read in full depending on its last
+# upload in the file registry
+
+def run_context(run_id: str) -> SimpleNamespace:
+    """
+    An unpartitioned run's context (only what `load_files` / `complete_files` use)
+    """
+    return SimpleNamespace(run_id=run_id, partition_key=None, has_partition_key=False, log=logging.getLogger(__name__))
+
+
+
+def upload(registry, file_paths: list[str], run_id: str) -> tuple:
+    """
+    Load the files and mark them as uploaded like a successful run
+    """
+    context = run_context(run_id)
+    data, files = load_files(context, registry, file_paths, "trades")
+    complete_files(context, registry)
+
+    return data, files
+
+
+
+def test_load_files_appended_tail(mongo, tmp_path):
+    registry = mongo.file_registry
+    file_path = tmp_path / "Trades.csv"
+    file_path.write_text("code,price\nAAPL,1.5\nMSFT,2.5\n")
+
+    data, files = upload(registry, [str(file_path)], "run1")
+    assert data["code"].to_list() == ["AAPL", "MSFT"]
+    assert (files[0]["offset"], files[0]["rows"]) == (0, 2)
+    uploaded_size = files[0]["size"]
+
+    # Only the appended rows are read (with the header of the file)
+    with open(file_path, "a") as file:
+        file.write("TSLA,3.5\nNVDA,4.5\n")
+
+    data, files = upload(registry, [str(file_path)], "run2")
+    assert data.to_dict("records") == [{"code": "TSLA", "price": 3.5}, {"code": "NVDA", "price": 4.5}]
+    assert files[0]["offset"] == uploaded_size
+    assert (files[0]["skip_rows"], files[0]["rows"]) == (2, 4)
+
+    # Unchanged since the last upload - nothing is read
+    data, files = upload(registry, [str(file_path)], "run3")
+    assert data.empty and files == []
+
+
+
+def test_load_files_rewritten(mongo, tmp_path):
+    registry = mongo.file_registry
+    file_path = tmp_path / "Trades.csv"
+    file_path.write_text("code,price\nAAPL,1.5\nMSFT,2.5\n")
+    upload(registry, [str(file_path)], "run1")
+
+    # The uploaded bytes changed - the whole file is read again
+    file_path.write_text("code,price\nAAPL,1.6\nMSFT,2.5\nTSLA,3.5\n")
+
+    data, files = upload(registry, [str(file_path)], "run2")
+    assert data["code"].to_list() == ["AAPL", "MSFT", "TSLA"]
+    assert (files[0]["offset"], files[0]["skip_rows"], files[0]["rows"]) == (0, 0, 3)
+
+
+
+def test_load_files_same_content(mongo, tmp_path):
+    registry = mongo.file_registry
+    for name in ("Trades.csv", "Trades copy.csv"):
+        (tmp_path / name).write_text("code,price\nAAPL,1.5\n")
+
+    upload(registry, [str(tmp_path / "Trades.csv")], "run1")
+
+    # A copy of an uploaded file (same content hash) is skipped
+    data, files = upload(registry, [str(tmp_path / "Trades copy.csv")], "run2")
+    assert data.empty and files == []
+
+
+
+def test_load_files_pending_runs(mongo, tmp_path):
+    registry = mongo.file_registry
+    file_path = tmp_path / "Trades.csv"
+    file_path.write_text("code,price\nAAPL,1.5\n")
+
+    # A run that did not complete leaves its files pending - the next run reads them again
+    data, _ = load_files(run_context("run1"), registry, [str(file_path)], "trades")
+    assert len(data) == 1
+
+    data, _ = upload(registry, [str(file_path)], "run2")
+    assert len(data) == 1
+    assert registry.count_documents({"run_id": "run1", "status": "pending"}) == 1
+    assert registry.count_documents({"run_id": "run2", "status": "completed"}) == 1
@@ -0,0 +1,96 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+import numpy as np
+import pandas as pd
+from ngt.operations.hitl import apply_corrections, canonical_value, faulty_ids, content_key, new_faulty, insert_faulty
+
+# The HITL rows - the corrections of the fixed files and the content based ids of the faulty rows
+
+
+
+def test_apply_corrections():
+    # One HITL row per faulty column - each row only holds the correction of its column
+    fixed = pd.DataFrame({
+        "id": ["a", "a", "b", "c", "c"],
+        "column_name": ["yellow_key_code", "issuer_country_code", "yellow_key_code", "security_currency", "security_currency"],
+        "comment": ["No Bloomberg Yellow Key Code found.", "No country code found.", "No Bloomberg Yellow Key Code found.", "No security currency found.", "No security currency found."],
+        "faulty_id": ["f1", "f2", "f3", "f4", "f4"],
+        "yellow_key_code": ["Equity", np.nan, "Corp", "Govt", "Govt"],
+        "issuer_country_code": [np.nan, "US", "GB", "FR", "FR"],
+        "security_currency": ["USD", "USD", np.nan, "EUR", "EUR"]
+    })
+
+    collapsed = apply_corrections(fixed)
+
+    # One row per id with every correction, without the HITL columns
+    assert list(collapsed.columns) == ["id", "yellow_key_code", "issuer_country_code", "security_currency"]
+    assert collapsed.fillna("-").values.tolist() == [
+        ["a", "Equity", "US", "USD"],
+        ["b", "Corp", "GB", "-"],
+        ["c", "Govt", "FR", "EUR"]
+    ]
+
+
+
+def test_apply_corrections_empty():
+    assert len(apply_corrections(pd.DataFrame(columns=["id", "column_name"]))) == 0
+
+
+
+def test_canonical_value():
+    # The same value whatever its dtype
+    assert canonical_value(1) == canonical_value(1.0) == canonical_value("1") == canonical_value(np.int64(1)) == "1"
+    assert canonical_value(1.5) == canonical_value(np.float32(1.5)) == "1.5"
+    assert canonical_value(None) == canonical_value(np.nan) == canonical_value(pd.NaT) == canonical_value(pd.NA) == ""
+    assert canonical_value(pd.Timestamp("2024-02-12")) == canonical_value(datetime.datetime(2024, 2, 12)) == "2024-02-12T00:00:00"
+    assert canonical_value(" USD ") == "USD"
+
+
+
+def test_faulty_ids_canonical():
+    # The rows of a re-run with other dtypes (categories, float after a NaN, parsed dates) get the same ids
+    data = pd.DataFrame({
+        "date": ["2024-02-12T00:00:00", "2024-02-13T00:00:00"],
+        "pool_fund_code": ["NGT6144", "NGT2754"],
+        "quantity": [100, 250],
+        "yellow_key_code": [None, "Equity"]
+    })
+    typed = data.assign(
+        date=pd.to_datetime(data["date"]),
+        pool_fund_code=data["pool_fund_code"].astype("category"),
+        quantity=data["quantity"].astype(float),
+        yellow_key_code=[np.nan, "Equity"]
+    )
+
+    ids = faulty_ids(data)
+    assert ids.to_list() == faulty_ids(typed).to_list()
+    assert ids.nunique() == 2 and ids.str.fullmatch("[0-9a-f]{64}").all()
+
+    # Only the selected columns identify the row
+    assert faulty_ids(data, ["pool_fund_code"]).to_list() == faulty_ids(data.assign(quantity=[1, 2]), ["pool_fund_code"]).to_list()
+    assert faulty_ids(data).to_list() != faulty_ids(data.assign(quantity=[1, 2])).to_list()
+
+
+
+def test_content_key():
+    assert content_key(pd.Series(["b", "a"])) == content_key(pd.Series(["a", "b"]))
+    assert content_key(pd.Series(["a"])) != content_key(pd.Series(["a", "b"]))
+
+
+
+def test_insert_faulty_once(mongo):
+    faulty = pd.DataFrame({"id": ["a", "b"], "status": "pending"})
+    faulty["faulty_id"] = faulty_ids(faulty, ["id"])
+    collection = mongo.inconsistent_portfolio
+
+    assert insert_faulty(collection, new_faulty(collection, faulty)) == 2
+
+    # A re-run only tracks the new rows
+    again = pd.concat([faulty, pd.DataFrame({"id": ["c"], "status": "pending"})], ignore_index=True)
+    again["faulty_id"] = faulty_ids(again, ["id"])
+    assert new_faulty(collection, again)["id"].to_list() == ["c"]
+    assert insert_faulty(collection, again) == 1
+    assert collection.count_documents({}) == 3
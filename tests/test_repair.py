@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import numpy as np
+import pandas as pd
+from ngt.operations.repair import repair, REPAIR_COLUMNS, LOOKUP_KEYS
+
+# The repair of the missing HITL columns - every source only fills what the sources before it left missing
+
+def lookups(values: dict = None) -> dict:
+    """
+    The key to column to key value to value mappings (see `load_corrections` / `unique_values`)
+    """
+    lookups = {key: {column: {} for column in REPAIR_COLUMNS} for key in LOOKUP_KEYS}
+    for (key, column), mapping in (values or {}).items():
+        lookups[key][column] = mapping
+    return lookups
+
+
+
+@pytest.fixture
+def data() -> pd.DataFrame:
+    return pd.DataFrame({
+        "figi_code": ["BBG1", "BBG2", "BBG3", np.nan],
+        "bloomberg_code": ["TSLA UW", "VOD LN", "XYZ", "AAPL UW"],
+        "yellow_key_code": pd.Series([np.nan] * 4, dtype=object),
+        "issuer_country_code": [np.nan, "GB", np.nan, np.nan],
+        "security_currency": [np.nan, np.nan, np.nan, "USD"]
+    })
+
+
+
+def test_repair_precedence(data):
+    corrections = lookups({
+        ("figi_code", "yellow_key_code"): {"BBG1": "Corp"},
+        ("bloomberg_code", "issuer_country_code"): {"TSLA UW": "NL"}
+    })
+    history = lookups({
+        ("figi_code", "yellow_key_code"): {"BBG1": "Equity", "BBG3": "Govt"},
+        ("figi_code", "security_currency"): {"BBG1": "EUR"},
+        ("bloomberg_code", "issuer_country_code"): {"TSLA UW": "US", "XYZ": "FR"}
+    })
+    currencies = {"BBG1": "USD", "BBG2": "GBP"}
+
+    repaired, repairs = repair(data.copy(), corrections, history, currencies)
+
+    # (1) corrections before (2) history before (3) the rules
+    assert repaired["yellow_key_code"].to_list() == ["Corp", "Equity", "Govt", "Equity"]
+    assert repaired["issuer_country_code"].to_list() == ["NL", "GB", "FR", "US"]
+    assert repaired["security_currency"].fillna("-").to_list() == ["EUR", "GBP", "-", "USD"]
+
+    assert repairs == {
+        "yellow_key_code/corrections/figi_code": 1,
+        "yellow_key_code/history/figi_code": 1,
+        "yellow_key_code/exchange": 2,
+        "issuer_country_code/corrections/bloomberg_code": 1,
+        "issuer_country_code/history/bloomberg_code": 1,
+        "issuer_country_code/exchange": 1,
+        "security_currency/history/figi_code": 1,
+        "security_currency/security_master": 1
+    }
+
+
+
+def test_repair_never_overwrites(data):
+    # The known values are kept, whatever the sources say
+    history = lookups({("bloomberg_code", "issuer_country_code"): {"VOD LN": "US"}})
+    repaired, repairs = repair(data.copy(), lookups(), history, {"BBG4": "CHF"})
+
+    assert repaired.loc[1, "issuer_country_code"] == "GB"
+    assert repaired.loc[3, "security_currency"] == "USD"
+    assert "issuer_country_code/history/bloomberg_code" not in repairs
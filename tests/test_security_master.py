@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+from ngt.operations.security_master import upsert_securities, enrich_security_master, attributes_hash, security_key, SECURITY_ATTRIBUTES
+
+# The security master writes - one document per security key, versioned in the history collection
+
+def security(**attributes) -> dict:
+    return {column: attributes.get(column) for column in SECURITY_ATTRIBUTES}
+
+
+
+@pytest.fixture
+def partial_indexes(monkeypatch):
+    """
+    mongomock ignores `partialFilterExpression` - the unique index of the keys would cover the legacy documents without a key
+    """
+    import mongomock.collection
+    create_index = mongomock.collection.Collection.create_index
+
+    def create_partial_index(self, keys, **kwargs):
+        if "partialFilterExpression" in kwargs:
+            kwargs.pop("unique", None)
+        return create_index(self, keys, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "create_index", create_partial_index)
+
+
+
+def test_adopt_legacy_documents(mongo, partial_indexes):
+    # Written before the security keys - by FIGI, by Bloomberg Code (+ underlying) and by name / currency
+    mongo.security_master.insert_many([
+        {**security(figi_code="BBG1", security_name="TESLA INC", ccy="USD"), "upload_timestamp": datetime.datetime(2024, 1, 1)},
+        {**security(bbg_code="SPX 3 C5000", underlying_bbg_code="SPX", ccy="USD"), "upload_timestamp": datetime.datetime(2024, 1, 1)},
+        {**security(bbg_code="SPX 3 C5000", underlying_bbg_code="NDX", ccy="USD"), "upload_timestamp": datetime.datetime(2024, 1, 1)},
+        {**security(security_name="CASH USD ACCOUNT", ccy="USD"), "figi_code": float("nan"), "upload_timestamp": datetime.datetime(2024, 1, 1)}
+    ])
+
+    metadata, _ = upsert_securities(mongo, [
+        security(figi_code="BBG1", security_name="TESLA INC", ccy="USD", gti_code="S01"),
+        security(bbg_code="SPX 3 C5000", underlying_bbg_code="SPX", ccy="USD", gti_code="O01"),
+        security(security_name="CASH USD ACCOUNT", ccy="USD", gti_code="C01")
+    ])
+
+    assert metadata["adopted"] == 3 and metadata["inserted"] == 0
+    assert sorted(document["security_key"] for document in mongo.security_master.find({"security_key": {"$ne": None}})) == [
+        "BBG1", "bbg:SPX 3 C5000/SPX", "name:CASH USD ACCOUNT/USD"
+    ]
+
+    # The legacy document of the other underlying is left as it is
+    assert mongo.security_master.find_one({"underlying_bbg_code": "NDX"}).get("security_key") is None
+
+
+
+def test_enrich_security_master_versions(mongo):
+    uploaded = security(figi_code="BBG1", ccy="USD", yellow_key_code="Equity", gti_code="S01")
+    upsert_securities(mongo, [uploaded])
+    mongo.open_figi.insert_one({"figi": "BBG1", "ccy": "USD", "ticker": "TSLA", "marketSector": "Equity", "securityType": "Common Stock", "securityType2": "Common Stock"})
+
+    assert enrich_security_master(mongo, [("BBG1", "USD")]) == {"updates": 1, "skips": 0}
+
+    # The enrichment is a new version with a new hash of the attributes
+    document = mongo.security_master.find_one({"security_key": "BBG1"})
+    assert document["security_name"] == "TSLA" and document["version"] == 2
+    assert document["attributes_hash"] == attributes_hash(document)
+
+    history = list(mongo.security_master_history.find({"security_key": security_key(uploaded)}, sort=[("version", 1)]))
+    assert [version["version"] for version in history] == [1, 2]
+    assert history[1]["changes"] == {"security_name": "TSLA", "security_type": "Common Stock", "security_type_2": "Common Stock"}
+    assert history[1]["previous"] == {"security_name": None, "security_type": None, "security_type_2": None}
+
+    # The same upload again is unchanged - the missing name does not erase the enriched one
+    metadata, _ = upsert_securities(mongo, [uploaded])
+    assert metadata["unchanged"] == 1 and metadata["updated"] == 0
+
+
+
+def test_enrich_security_master_unchanged(mongo):
+    upsert_securities(mongo, [security(figi_code="BBG1", ccy="USD", security_name="TESLA INC", yellow_key_code="Equity")])
+    mongo.open_figi.insert_one({"figi": "BBG1", "ccy": "USD", "ticker": "TSLA", "marketSector": "Equity"})
+
+    # Nothing changed - no new version
+    enrich_security_master(mongo, [("BBG1", "USD")])
+    assert mongo.security_master.find_one({"security_key": "BBG1"})["version"] == 1
+    assert mongo.security_master_history.count_documents({}) == 1
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+from dagster import build_sensor_context, SkipReason
+from ngt.sensors import security_master_figi_sensor
+
+# The cursor based sensors - only the work newer than the cursor's high-watermark is requested, with run keys that
+# only depend on that work
+
+def completed(code: str, minute: int, **kwargs) -> dict:
+    return {
+        "nt_figi_code": code, "nt_security_currency": "USD", "found": True, "security_master_timestamp": None,
+        "completed_timestamp": datetime.datetime(2024, 2, 12, 9, minute), **kwargs
+    }
+
+
+
+def evaluate(mongo, cursor=None):
+    with build_sensor_context(cursor=cursor, resources={"mongo": mongo}) as context:
+        result = security_master_figi_sensor(context)
+        return result, context.cursor
+
+
+
+def test_security_master_figi_sensor(mongo):
+    mongo.figi_queue.insert_many([
+        completed("BBG1", 1), completed("BBG2", 2),
+        completed("BBG3", 3, found=False), completed("BBG4", 4, security_master_timestamp=datetime.datetime(2024, 2, 12))
+    ])
+    documents = list(mongo.figi_queue.find({}, {"_id": 0}))
+
+    request, cursor = evaluate(mongo)
+    assert [figi["code"] for figi in request.run_config["ops"]["figi_security_master"]["config"]["figis"]] == ["BBG1", "BBG2"]
+    assert cursor == "2024-02-12T09:02:00"
+
+    # The same work gets the same run key, and the evaluation does not write to Mongo
+    assert evaluate(mongo)[0].run_key == request.run_key
+    assert list(mongo.figi_queue.find({}, {"_id": 0})) == documents
+
+    # Only the FIGIs completed after the watermark
+    assert isinstance(evaluate(mongo, cursor)[0], SkipReason)
+
+    mongo.figi_queue.insert_one(completed("BBG5", 5))
+    request, cursor = evaluate(mongo, cursor)
+    assert request.run_config["ops"]["figi_security_master"]["config"]["figis"] == [{"code": "BBG5", "ccy": "USD"}]
+    assert cursor == "2024-02-12T09:05:00"
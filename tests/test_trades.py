@@ -0,0 +1,62 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+import numpy as np
+import pandas as pd
+from dagster import build_asset_context
+from ngt.assets.trades import new_trades_columns, previous_prices
+
+# The price change of the trades - a partition only holds one trade date, so it starts from the prices of the
+# previous business day stored in `processed.prices`
+
+def trades(trade_date: str) -> pd.DataFrame:
+    return pd.DataFrame({
+        "nx_date": trade_date,
+        "trade_date": pd.to_datetime([trade_date] * 4),
+        "bloomberg_code": ["ADP UW", "AUTO LN", "AUTO LN", "NEW UW"],
+        "transaction_quantity": [3429.0, -6273.0, 100.0, 10.0],
+        "transaction_price": [749.97, 21.786, 22.0, 5.0],
+        "issuer_country_name": ["UNITED-STATES (U.S.A.)", "GREAT-BRITAIN", "GREAT-BRITAIN", np.nan]
+    })
+
+
+
+@pytest.fixture
+def prices(mongo):
+    # Monday's trades start from Friday's prices - the price of Thursday is not used
+    mongo.prices.insert_many([
+        {"date": datetime.datetime(2024, 2, 9), "bbg_code": "ADP UW", "price": 750.0, "ccy": "USD", "country_code": "US"},
+        {"date": datetime.datetime(2024, 2, 9), "bbg_code": "AUTO LN", "price": 21.0, "ccy": "GBP", "country_code": "GB"},
+        {"date": datetime.datetime(2024, 2, 8), "bbg_code": "NEW UW", "price": 4.0, "ccy": "USD", "country_code": "US"}
+    ])
+    return mongo
+
+
+
+def test_previous_prices(prices):
+    previous = previous_prices(prices, trades("2024-02-12"))
+
+    assert sorted(previous) == ["ADP UW", "AUTO LN"]
+    assert previous["ADP UW"]["transaction_price"].to_list() == [750.0]
+    assert previous["ADP UW"]["trade_date"].to_list() == [pd.Timestamp("2024-02-09")]
+
+
+
+def test_new_trades_columns_pct_change(prices):
+    # The asset function without `instrumented` (it needs the run of the context)
+    compute = new_trades_columns.op.compute_fn.decorated_fn.__wrapped__
+    with build_asset_context() as context:
+        output = compute(context, trades("2024-02-12"), prices)
+    data = output.value.set_index(["bloomberg_code", "transaction_price"])
+
+    # One row per trade, the change is computed against the previous business day (then the previous trade of the day)
+    assert len(data) == 4
+    assert data["pct_change"].notna().sum() == 3
+    assert data.loc[("ADP UW", 749.97), "pct_change"] == pytest.approx(749.97 / 750 - 1)
+    assert data.loc[("AUTO LN", 21.786), "pct_change"] == pytest.approx(21.786 / 21 - 1)
+    assert data.loc[("AUTO LN", 22.0), "pct_change"] == pytest.approx(22 / 21.786 - 1)
+
+    # No price the business day before
+    assert pd.isna(data.loc[("NEW UW", 5.0), "pct_change"])
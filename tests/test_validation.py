@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import numpy as np
+import pandas as pd
+from ngt.operations.validation import Rule, not_missing, validate, rule_counts, failed_rows
+
+# The vectorized validation - every rule is evaluated once for all of the rows
+
+RULES = [
+    not_missing("fund", "fund", "No fund."),
+    not_missing("currency", "currency", "No currency."),
+    Rule("positive", "quantity", "The quantity is negative.", lambda data: data["quantity"] >= 0)
+]
+
+@pytest.fixture
+def data() -> pd.DataFrame:
+    return pd.DataFrame({
+        "id": ["a", "b", "c", "d"],
+        "fund": ["F1", None, "F2", np.nan],
+        "currency": ["USD", "EUR", None, None],
+        "quantity": [1.0, -2.0, np.nan, 3.0]
+    }, index=[10, 11, 12, 13])
+
+
+
+def test_validate_bitmask(data):
+    failures, bitmask = validate(data, RULES)
+
+    assert list(failures.columns) == ["fund", "currency", "positive"]
+    assert failures.index.equals(data.index)
+
+    # Bit `i` = rule `i` failed - a missing quantity is not negative but `NaN >= 0` fails like a missing value
+    assert bitmask.to_dict() == {10: 0, 11: 0b101, 12: 0b110, 13: 0b011}
+    assert rule_counts(failures) == {"fund": 2, "currency": 2, "positive": 2}
+
+
+
+def test_validate_missing_results(data):
+    # A rule that returns `NA` fails the row
+    rules = [Rule("nullable", "quantity", "", lambda data: data["quantity"].astype("Float64") > 0)]
+    _, bitmask = validate(data, rules)
+    assert bitmask.to_list() == [0, 1, 1, 0]
+
+
+
+def test_failed_rows(data):
+    failures, _ = validate(data, RULES)
+    faulty = failed_rows(data, failures, RULES)
+
+    # One row per failed rule and row, grouped by rule (in the order of the rules)
+    assert faulty[["id", "column_name", "comment"]].values.tolist() == [
+        ["b", "fund", "No fund."], ["d", "fund", "No fund."],
+        ["c", "currency", "No currency."], ["d", "currency", "No currency."],
+        ["b", "quantity", "The quantity is negative."], ["c", "quantity", "The quantity is negative."]
+    ]
+    assert list(faulty.columns) == ["id", "column_name", "comment", "fund", "currency", "quantity"]
+
+
+
+def test_failed_rows_none_failed(data):
+    valid = data.iloc[[0]]
+    failures, bitmask = validate(valid, RULES)
+
+    assert bitmask.to_list() == [0]
+    assert len(failed_rows(valid, failures, RULES)) == 0
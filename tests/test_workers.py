@@ -0,0 +1,144 @@
+import pytest
+
+pytest.importorskip("dagster")
+
+import datetime
+import smtplib
+import pandas as pd
+from ngt.workers.figi import FigiWorker
+from ngt.workers.outbox import OutboxSender
+
+# The long running queue consumers - the external APIs are faked, the queues run on mongomock
+
+class FakeOpenFigi:
+
+    MAX_REQUESTS_PER_MINUTE = 6000
+
+    def __init__(self, on_search=None):
+        """
+        Return one listing for every searched FIGI (`on_search` is called before it is returned)
+        """
+        self.on_search = on_search
+
+    def search(self, search, ccy=None, before_request=None):
+        if self.on_search:
+            self.on_search(search)
+
+        return pd.DataFrame([{"figi": search, "name": f"{search} INC", "ticker": search[-4:], "securityType": "Common Stock"}])
+
+
+
+def queue_figis(mongo, codes: list[str]):
+    mongo.figi_queue.insert_many([
+        {"nt_figi_code": code, "nt_security_currency": "USD", "status": "pending", "completed_timestamp": None}
+        for code in codes
+    ])
+
+
+
+def test_figi_worker(mongo):
+    queue_figis(mongo, ["BBG1", "BBG2"])
+    worker = FigiWorker(mongo, FakeOpenFigi())
+
+    worker.process_batch(mongo.lease_figis(10))
+
+    assert sorted(document["figi"] for document in mongo.open_figi.find()) == ["BBG1", "BBG2"]
+    assert mongo.figi_queue.count_documents({"status": "completed", "found": True}) == 2
+
+
+
+def test_figi_worker_expired_lease(mongo):
+    queue_figis(mongo, ["BBG1", "BBG2"])
+
+    # The lease of BBG2 expires while it is fetched - another consumer has claimed it since
+    def expire(code):
+        if code == "BBG2":
+            mongo.figi_queue.update_one({"nt_figi_code": code}, {"$set": {"lease_id": "another-consumer"}})
+
+    worker = FigiWorker(mongo, FakeOpenFigi(expire))
+    worker.process_batch(mongo.lease_figis(10))
+
+    # Only the results of the FIGIs the worker still held are stored
+    assert [document["figi"] for document in mongo.open_figi.find()] == ["BBG1"]
+    assert mongo.figi_queue.find_one({"nt_figi_code": "BBG2"})["status"] == "leased"
+
+
+
+class FakeMail:
+
+    def __init__(self, failures: int = 0):
+        """
+        An Email resource whose first `failures` sends fail
+        """
+        self.failures = failures
+        self.sent = []
+
+    def connect(self):
+        return FakeServer()
+
+    def send(self, to, subject, body, cc=None, attachment_paths=None, server=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise smtplib.SMTPDataError(451, "Try again later")
+
+        self.sent.append(subject)
+
+
+
+class FakeServer:
+
+    def quit(self):
+        pass
+
+
+
+def make_available(mongo):
+    # The backoff has elapsed
+    mongo.email_outbox.update_many({}, {"$set": {"available_at": datetime.datetime.now() - datetime.timedelta(seconds=1)}})
+
+
+
+def test_outbox_retry_backoff(mongo):
+    mongo.enqueue_email("hitl@ngt.com", "Digest", "body", key="digest-1")
+    sender = OutboxSender(mongo, FakeMail(failures=10))
+
+    for attempt in range(1, 6):
+        before = datetime.datetime.now()
+        sender.process_batch(mongo.lease_emails(10))
+        email = mongo.email_outbox.find_one()
+
+        assert email["attempts"] == attempt
+        if attempt < 5:
+            # Pending again after 30s, 60s, 120s, 240s - and not leased before
+            assert email["status"] == "pending"
+            delay = (email["available_at"] - before).total_seconds()
+            assert 30 * 2 ** (attempt - 1) - 1 < delay < 30 * 2 ** (attempt - 1) + 5
+            assert mongo.lease_emails(10) == []
+            make_available(mongo)
+
+    # Given up after `EMAIL_OUTBOX_MAX_ATTEMPTS`
+    assert email["status"] == "dead"
+    make_available(mongo)
+    assert mongo.lease_emails(10) == []
+    assert sender.metrics == {"sent": 0, "failed": 4, "dead": 1, "connections": 5}
+
+
+
+def test_outbox_retry_then_sent(mongo):
+    mongo.inconsistent_portfolio.insert_many([{"faulty_id": "f1", "status": "pending"}, {"faulty_id": "f2", "status": "pending"}])
+    assert mongo.enqueue_email("hitl@ngt.com", "Digest", "body", key="digest-1", faulty_ids={"portfolios": ["f1"]})
+    assert not mongo.enqueue_email("hitl@ngt.com", "Digest", "body", key="digest-1")
+
+    mail = FakeMail(failures=1)
+    sender = OutboxSender(mongo, mail)
+    sender.process_batch(mongo.lease_emails(10))
+
+    # The failed email's rows are not emailed yet
+    assert mongo.inconsistent_portfolio.count_documents({"emailed_timestamp": {"$ne": None}}) == 0
+
+    make_available(mongo)
+    sender.process_batch(mongo.lease_emails(10))
+
+    email = mongo.email_outbox.find_one()
+    assert (email["status"], email["attempts"], mail.sent) == ("sent", 2, ["Digest"])
+    assert [row["faulty_id"] for row in mongo.inconsistent_portfolio.find({"emailed_timestamp": {"$ne": None}})] == ["f1"]